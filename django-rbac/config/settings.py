@@ -75,6 +75,19 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (e.g. Redis or Memcached) in production so that
+# cached permissions and their invalidation apply to every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -150,11 +163,48 @@ INSTALLED_APPS = [
 # REST Framework settings and JWT Authentication
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Opt-in: authenticates from the token claims and the cached user state
+        # without loading the User row. Needs a cache shared by every process.
+        'users.authentication.StatelessJWTAuthentication'
+        if os.getenv('STATELESS_JWT_AUTH', 'False').lower() in ('true', '1', 't')
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 25,
+    # Trusted reverse proxies in front of the app. 0: the client IP is REMOTE_ADDR and
+    # X-Forwarded-For is ignored (it is set by the client); n: the address seen by the
+    # outermost of n proxies. Used by the IP rate limits and the login audit.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
+}
+
+# History endpoints use keyset pagination (rbac.pagination.HistoryCursorPagination).
+# Whether their pages include the total count by default (COUNT(*) is slow on large
+# tables); ?count=true / ?count=false overrides it per request.
+HISTORY_PAGINATION_COUNT = False
+
+# Entries of the in-process LRU cache of rbac.services.point_in_time_service
+# (permissions of a user at a past date).
+RBAC_POINT_IN_TIME_CACHE_SIZE = 1024
+
+# History retention (manage.py prune_history). Per history (user, role, group,
+# permission): records older than KEEP_DAYS are removed, except the last KEEP_LAST
+# of each object (and always its latest one); None disables either rule. COMPACT
+# drops '~' records that changed nothing; COLLAPSE_SECONDS > 0 also merges
+# consecutive '~' records of an object by the same user within that many seconds. Removed records are archived as gzipped
+# JSONL under ARCHIVE_DIR (one file per history and month), readable by the history
+# endpoints with ?archived=true.
+HISTORY_RETENTION = {
+    'ARCHIVE_DIR': os.getenv('HISTORY_ARCHIVE_DIR', str(BASE_DIR / 'history_archive')),
+    'BATCH_SIZE': 1000,
+    'COMPACT': True,
+    'COLLAPSE_SECONDS': 0,
+    'POLICIES': {
+        'user': {'KEEP_DAYS': 365, 'KEEP_LAST': 10},
+        'role': {'KEEP_DAYS': 730, 'KEEP_LAST': 20},
+        'group': {'KEEP_DAYS': 730, 'KEEP_LAST': 20},
+        'permission': {'KEEP_DAYS': 730, 'KEEP_LAST': 20},
+    },
 }
 
 SPECTACULAR_SETTINGS = {
@@ -164,6 +214,67 @@ SPECTACULAR_SETTINGS = {
     "SERVE_INCLUDE_SCHEMA": False,
 }
 
+# RBAC permission cache
+# Effective permission codes of each user are cached for this many seconds.
+# Role, group and permission changes invalidate them immediately, in every process
+# only if the cache is shared: by default (None) the permission cache, and the
+# permission claims, are only used when RBAC_PERMISSION_CACHE_ALIAS is not a
+# process-local backend (LocMemCache). True/False forces it on or off.
+RBAC_PERMISSION_CACHE = None
+RBAC_PERMISSION_CACHE_ALIAS = 'default'
+RBAC_PERMISSION_CACHE_TIMEOUT = int(os.getenv('RBAC_PERMISSION_CACHE_TIMEOUT', 300))
+
+# Maintain the denormalized users.UserEffectivePermission table (user -> permission).
+# Permission checks and permission holders only read it with RBAC_EFFECTIVE_PERMISSIONS_READS,
+# to be enabled once `rebuild_effective_permissions` has filled it (and `check_effective_permissions` passes).
+RBAC_EFFECTIVE_PERMISSIONS = os.getenv('RBAC_EFFECTIVE_PERMISSIONS', 'False').lower() in ('true', '1', 't')
+RBAC_EFFECTIVE_PERMISSIONS_READS = os.getenv('RBAC_EFFECTIVE_PERMISSIONS_READS', 'False').lower() in ('true', '1', 't')
+
+# Seconds the is_active/is_staff/is_superuser flags checked by
+# users.authentication.StatelessJWTAuthentication (STATELESS_JWT_AUTH) are cached
+# for. Only cached on a shared backend: with LocMemCache they are read on each request.
+USER_STATE_CACHE_TIMEOUT = int(os.getenv('USER_STATE_CACHE_TIMEOUT', 60))
+
+# Password hashing executor (users.services.hashing_service): 'thread' (for hashers
+# releasing the GIL, e.g. PBKDF2/Argon2/bcrypt), 'process' or 'inline'. At most
+# MAX_PENDING hashes are queued or running; callers wait QUEUE_TIMEOUT seconds
+# for a slot, then get a 503.
+PASSWORD_HASHING = {
+    'EXECUTOR': os.getenv('PASSWORD_HASHING_EXECUTOR', 'thread'),
+    'WORKERS': int(os.getenv('PASSWORD_HASHING_WORKERS', 0)) or None,  # Default: CPU count
+    'MAX_PENDING': int(os.getenv('PASSWORD_HASHING_MAX_PENDING', 0)) or None,  # Default: 4 x workers
+    'QUEUE_TIMEOUT': float(os.getenv('PASSWORD_HASHING_QUEUE_TIMEOUT', 5)),
+}
+
+# Rate limits (users.throttling), '<limit>/<period>' per scope, period in s/min/hour/day.
+# Sliding windows counted in the RATE_LIMIT_CACHE_ALIAS cache; remove a scope to disable it.
+RATE_LIMIT_CACHE_ALIAS = 'default'
+RATE_LIMITS = {
+    'login_ip': '30/min',
+    'login_username': '10/min',
+    'otp_ip': '20/hour',
+    'otp_email': '5/hour',
+    'reset_ip': '30/hour',
+    'reset_email': '10/hour',
+    'register_ip': '60/hour',
+    'register_user': '120/hour',
+}
+
+# Run the post-login hooks (users.services.login_service) on a background thread
+LOGIN_HOOKS_DEFERRED = True
+
+# Buffered login audit (users.services.audit_service): LoginEvent rows and
+# User.last_login are written in batches of BATCH_SIZE, at least every
+# FLUSH_INTERVAL seconds. At most MAX_BUFFER events are kept in memory, and a
+# batch that fails MAX_RETRIES times is logged and discarded.
+LOGIN_AUDIT = {
+    'ENABLED': os.getenv('LOGIN_AUDIT_ENABLED', 'True').lower() in ('true', '1', 't'),
+    'BATCH_SIZE': int(os.getenv('LOGIN_AUDIT_BATCH_SIZE', 500)),
+    'FLUSH_INTERVAL': float(os.getenv('LOGIN_AUDIT_FLUSH_INTERVAL', 2)),
+    'MAX_BUFFER': 50000,
+    'MAX_RETRIES': 3,
+}
+
 # JWT settings
 from datetime import timedelta
 SIMPLE_JWT = {
@@ -172,10 +283,52 @@ SIMPLE_JWT = {
     # Refresh token settings for logout and rotation
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
+    # Login and refresh serializers, see RBAC_JWT_PERMISSION_CLAIMS
+    "TOKEN_OBTAIN_SERIALIZER": "users.serializers.TokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.TokenRefreshSerializer",
+}
+
+# Purge of expired refresh tokens (users.services.token_flush_service) by
+# `flush_expired_tokens`, from cron or as a worker with --loop
+TOKEN_FLUSH = {
+    'BATCH_SIZE': 1000,
+    'SLEEP': 0,  # Seconds between batches
+}
+
+# Blacklisted refresh token JTIs kept in the cache (users.services.token_blacklist_service),
+# so refreshes skip the blacklist query. Needs a cache shared by every process that does
+# not evict keys early (e.g. a dedicated Redis database), not the default LocMemCache.
+TOKEN_BLACKLIST_CACHE = {
+    'ENABLED': os.getenv('TOKEN_BLACKLIST_CACHE_ENABLED', 'False').lower() in ('true', '1', 't'),
+    'ALIAS': os.getenv('TOKEN_BLACKLIST_CACHE_ALIAS', 'default'),
+    'REBUILD_SECONDS': 300,  # Reloaded this often by `rebuild_token_blacklist_cache --loop`
+}
+
+# Embed the user's effective permissions in access tokens (opt-in).
+# Requests are then authorized from the token claims without database access
+# for as long as the RBAC version they were issued under is current.
+RBAC_JWT_PERMISSION_CLAIMS = os.getenv('RBAC_JWT_PERMISSION_CLAIMS', 'False').lower() in ('true', '1', 't')
+
+# Rows accepted by POST /users/import/ (passwords are hashed in the request), larger files go through `import_users`
+USER_IMPORT_MAX_ROWS = int(os.getenv('USER_IMPORT_MAX_ROWS', 100))
+
+# Password reset OTPs (users.services.otp_service): 'db' stores hashed codes in
+# PasswordResetOTP, 'cache' keeps active codes in the default cache only.
+OTP_STORE = os.getenv('OTP_STORE', 'db')
+OTP_COOLDOWN_SECONDS = 120
+
+# Outbound email queue (users.services.email_service), delivered by `send_queued_emails`
+EMAIL_QUEUE = {
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BASE_SECONDS': 30,  # Doubled after each failed attempt
+    'RETRY_MAX_SECONDS': 3600,
+    'LEASE_SECONDS': 300,  # Claimed emails are retried after this if the worker died
 }
 
 # Email Configuration for Gmail
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Use 'django.core.mail.backends.locmem.EmailBackend' (tests) or the file backend to stand in for SMTP
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True').lower() in ('true', '1', 't')
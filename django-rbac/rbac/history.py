@@ -0,0 +1,169 @@
+"""
+Shared django-simple-history setup for the User, Permission, Role and Group histories.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models
+from django.db.models import OuterRef, Q, Subquery
+from simple_history.manager import HistoryManager
+from simple_history.models import HistoricalRecords
+
+
+class HistoricalSnapshot(models.Model):
+    """
+    Base of the historical models: `snapshot` holds the many-to-many state of
+    the object at that point (a role's permissions, a group's roles, a user's
+    roles and groups), written with the record by the signals of rbac and users.
+    """
+    snapshot = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        abstract = True
+
+
+class SnapshotHistoryManager(HistoryManager):
+    def bulk_history_create(self, objs, *args, custom_historical_attrs=None, **kwargs):
+        """
+        Bulk history skips pre_create_historical_record: takes the snapshot
+        from a `_history_snapshot` set on each object instead (like
+        `_change_reason`). Objects sharing a snapshot are inserted together.
+        """
+        batches = {}
+        for obj in objs:
+            snapshot = getattr(obj, '_history_snapshot', {})
+            batches.setdefault(json.dumps(snapshot, sort_keys=True), (snapshot, []))[1].append(obj)
+        created = []
+        for snapshot, batch in batches.values():
+            attrs = {**(custom_historical_attrs or {}), 'snapshot': snapshot}
+            created.extend(super().bulk_history_create(batch, *args, custom_historical_attrs=attrs, **kwargs) or [])
+        return created
+
+
+class IndexedHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords with the indexes behind the history endpoints' keyset
+    pagination: (history_date, history_id) for the full audit trail, and
+    (object id, history_date, history_id) for the history of one object.
+    The historical models also get the `snapshot` column of HistoricalSnapshot.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('bases', (HistoricalSnapshot,))
+        kwargs.setdefault('history_manager', SnapshotHistoryManager)
+        super().__init__(*args, **kwargs)
+
+    def get_meta_options(self, model):
+        meta_fields = super().get_meta_options(model)
+        pk = model._meta.pk.attname
+        meta_fields["indexes"] = (
+            models.Index(fields=["-history_date", "-history_id"]),
+            models.Index(fields=[pk, "-history_date", "-history_id"]),
+        )
+        return meta_fields
+
+
+def filter_snapshot(queryset, key, value):
+    """
+    Records whose snapshot list `key` contains value, e.g. the role history
+    where the role held a permission. Uses JSON containment where the
+    database has it (PostgreSQL, MySQL), a match on the JSON text otherwise.
+    """
+    if connections[queryset.db].features.supports_json_field_contains:
+        return queryset.filter(**{f'snapshot__{key}__contains': [value]})
+    return queryset.filter(**{f'snapshot__{key}__icontains': json.dumps(value)})
+
+
+def latest_records_at(queryset, object_ids, at, inclusive=True):
+    """
+    The latest record of each object at or before `at` (strictly before when
+    not inclusive), in (history_date, history_id) order: one query, each
+    object resolved by an index range lookup on (object id, history_date,
+    history_id). object_ids None: every object with a record by then.
+    """
+    model = queryset.model
+    pk = model.instance_type._meta.pk.attname
+    by_date = {'history_date__lte' if inclusive else 'history_date__lt': at}
+    latest = (
+        model.objects.filter(**by_date, **{pk: OuterRef(pk)})
+        .order_by('-history_date', '-history_id')
+        .values('history_id')[:1]
+    )
+    if object_ids is None:
+        objects = model.objects.filter(**by_date).order_by().values(pk).distinct()
+        return queryset.filter(history_id__in=objects.annotate(latest=Subquery(latest)).values('latest'))
+    return queryset.filter(**{f'{pk}__in': object_ids}).filter(history_id=Subquery(latest))
+
+
+# ----- History pages -----
+# The history serializers need, for every record, the previous record of the
+# same object (for the diff) and the user who made the change. Fetched one by
+# one (prev_record, history_user) that is one or two queries per row; the
+# history list views load them for the whole page instead.
+
+def with_previous_record(queryset):
+    """
+    Annotates each record with `previous_history_id`: the record of the same
+    object just before it in (history_date, history_id) order, so records
+    saved within the same timestamp still chain. The correlated subquery is
+    served by the (object id, history_date, history_id) index.
+    """
+    model = queryset.model
+    pk = model.instance_type._meta.pk.attname
+    previous = model.objects.filter(
+        Q(history_date__lt=OuterRef('history_date'))
+        | Q(history_date=OuterRef('history_date'), history_id__lt=OuterRef('history_id')),
+        **{pk: OuterRef(pk)},
+    ).order_by('-history_date', '-history_id').values('history_id')[:1]
+    queryset = queryset.annotate(previous_history_id=Subquery(previous))
+    if _has_history_user_fk(model):
+        queryset = queryset.select_related('history_user')
+    return queryset
+
+def prefetch_history(records):
+    """
+    Loads the previous records and the history users of a page of records
+    annotated by with_previous_record(), in one query each.
+    """
+    if not records:
+        return records
+    model = type(records[0])
+    previous_ids = {r.previous_history_id for r in records if r.previous_history_id}
+    previous = model.objects.in_bulk(previous_ids) if previous_ids else {}
+    for record in records:
+        record._previous_record = previous.get(record.previous_history_id)
+
+    if not _has_history_user_fk(model):
+        # history_user_id is a plain integer here: history_user would query per row
+        user_ids = {r.history_user_id for r in records if r.history_user_id}
+        users = get_user_model().objects.in_bulk(user_ids) if user_ids else {}
+        for record in records:
+            record._history_user = users.get(record.history_user_id)
+    return records
+
+def diff_snapshots(old, new):
+    """
+    {key: {'old': value, 'new': value}} of the snapshot keys a record changed
+    (e.g. the roles of a user). Nothing when the previous record has no
+    snapshot: it was written before snapshots were recorded.
+    """
+    if not old:
+        return {}
+    return {key: {'old': old.get(key), 'new': value} for key, value in new.items() if old.get(key) != value}
+
+def get_previous_record(record):
+    if hasattr(record, '_previous_record'):
+        return record._previous_record
+    return record.prev_record
+
+def get_history_user(record):
+    if hasattr(record, '_history_user'):
+        return record._history_user
+    return record.history_user
+
+def _has_history_user_fk(model):
+    try:
+        return model._meta.get_field('history_user').is_relation
+    except FieldDoesNotExist:
+        return False
@@ -0,0 +1,75 @@
+"""
+Management command to move the many-to-many snapshots that older history
+records kept as JSON in `history_change_reason` into the `snapshot` column.
+Records are processed in batches of history ids; converted records get their
+change reason cleared, so the command can be interrupted and run again.
+Ids are resolved from the current permission codes and role names: codes or
+names that no longer exist are kept without an id. Point-in-time
+reconstructions cached from the old snapshots are invalidated.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rbac.models import Group, Permission, Role
+from rbac.services import cache_service
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Move JSON snapshots from history_change_reason to the snapshot column"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of history records per batch.")
+
+    def handle(self, *args, **options):
+        permission_ids = dict(Permission.objects.values_list('code', 'id'))
+        role_ids = dict(Role.objects.values_list('name', 'id'))
+        ids_by_key = {
+            'permissions': ('permission_ids', permission_ids),
+            'roles': ('role_ids', role_ids),
+        }
+
+        total = 0
+        for model in (Role, Group, User):
+            converted = self.backfill(model.history.model, ids_by_key, options['batch_size'])
+            total += converted
+            self.stdout.write(self.style.SUCCESS(f"✔️  {model.__name__}: {converted} history records converted."))
+        if total:
+            cache_service.bump_history_version()
+
+    def backfill(self, history, ids_by_key, batch_size):
+        converted, last_id = 0, 0
+        while True:
+            records = list(
+                history.objects
+                .filter(history_id__gt=last_id, history_change_reason__startswith='{')
+                .order_by('history_id')
+                .only('history_id', 'snapshot', 'history_change_reason')[:batch_size]
+            )
+            if not records:
+                return converted
+            last_id = records[-1].history_id
+
+            updated = []
+            for record in records:
+                try:
+                    data = json.loads(record.history_change_reason)
+                except ValueError:
+                    continue  # A plain change reason that happens to start with '{'
+                if not isinstance(data, dict):
+                    continue
+                for key, (ids_key, ids) in ids_by_key.items():
+                    if key in data:
+                        data[ids_key] = [ids[name] for name in data[key] if name in ids]
+                record.snapshot = {**data, **record.snapshot}
+                record.history_change_reason = None
+                updated.append(record)
+
+            with transaction.atomic():
+                history.objects.bulk_update(updated, ['snapshot', 'history_change_reason'])
+            converted += len(updated)
+            self.stdout.write(f"  {history.__name__}: {converted} converted (up to history id {last_id})")
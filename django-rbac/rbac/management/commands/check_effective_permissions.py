@@ -0,0 +1,42 @@
+"""
+Management command to report drift between the materialized user -> permission
+table (users.UserEffectivePermission) and the live role/group assignments.
+With --fix, the drifted users are recomputed.
+"""
+from django.core.management.base import BaseCommand
+
+from rbac.services import effective_permission_service, permission_service
+
+
+class Command(BaseCommand):
+    help = "Report drift between the effective permission table and the role/group graph"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Recompute the rows of drifted users.")
+        parser.add_argument('--batch-size', type=int, default=effective_permission_service.SYNC_BATCH_SIZE,
+                            help="Number of users compared per batch.")
+        parser.add_argument('--limit', type=int, default=20, help="Maximum number of drifted users to print.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.NOTICE("Checking effective permissions..."))
+
+        drifted = []
+        for user_id, missing, extra in effective_permission_service.find_drift(batch_size=options['batch_size']):
+            drifted.append(user_id)
+            if len(drifted) <= options['limit']:
+                self.stdout.write(self.style.WARNING(
+                    f"⚠️  User {user_id}: missing {sorted(missing)}, extra {sorted(extra)}"
+                ))
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("✔️  No drift found."))
+            if not permission_service.effective_permissions_readable():
+                self.stdout.write(self.style.NOTICE(
+                    "Permission checks can read the table: set RBAC_EFFECTIVE_PERMISSIONS_READS=True."
+                ))
+            return
+
+        self.stdout.write(self.style.ERROR(f"❌ {len(drifted)} user(s) drifted."))
+        if options['fix']:
+            added, removed = effective_permission_service.sync_users(drifted)
+            self.stdout.write(self.style.SUCCESS(f"✔️  Fixed: {added} rows added, {removed} removed."))
@@ -0,0 +1,42 @@
+"""
+Management command to apply the history retention policies (HISTORY_RETENTION):
+compacts the user, role, group and permission histories, then archives and
+removes the records they no longer keep. Work is done in batches of history
+ids, optionally spaced out with --sleep, so the tables are never locked for long.
+"""
+from django.core.management.base import BaseCommand
+
+from rbac.services import history_retention_service
+
+
+class Command(BaseCommand):
+    help = "Compact, archive and prune the history tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append',
+                            choices=list(history_retention_service.get_models()),
+                            help="History to prune (repeatable, all by default).")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="History records per batch (default: HISTORY_RETENTION['BATCH_SIZE']).")
+        parser.add_argument('--sleep', type=float, default=0, help="Seconds to pause between batches.")
+        parser.add_argument('--dry-run', action='store_true', help="Count the records to remove without removing them.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        config = history_retention_service.get_config()
+        self.stdout.write(self.style.NOTICE(
+            f"{'Counting' if dry_run else 'Pruning'} history records (archives in {config['ARCHIVE_DIR']})..."
+        ))
+
+        def progress(model, step, count):
+            self.stdout.write(f"  {model._meta.model_name}: {count} {step}")
+
+        report = history_retention_service.run(
+            names=options['model'], dry_run=dry_run,
+            batch_size=options['batch_size'], sleep=options['sleep'], progress=progress,
+        )
+        verb = "would be removed" if dry_run else "archived and removed"
+        for name, counts in report.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"✔️  {name}: {counts['compacted']} compacted, {counts['expired']} expired records {verb}."
+            ))
@@ -0,0 +1,35 @@
+"""
+Management command to rebuild the denormalized user -> permission table
+(users.UserEffectivePermission) from the role and group assignments.
+Users are processed in batches, each one applied as a delta in its own transaction.
+"""
+from django.core.management.base import BaseCommand
+
+from rbac.services import effective_permission_service, permission_service
+
+
+class Command(BaseCommand):
+    help = "Rebuild the effective permission table from roles and groups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--truncate', action='store_true', help="Empty the table before rebuilding it.")
+        parser.add_argument('--batch-size', type=int, default=effective_permission_service.SYNC_BATCH_SIZE,
+                            help="Number of users per batch.")
+
+    def handle(self, *args, **options):
+        if not effective_permission_service.is_enabled():
+            self.stdout.write(self.style.WARNING("⚠️  RBAC_EFFECTIVE_PERMISSIONS is disabled, rebuilding anyway."))
+
+        self.stdout.write(self.style.NOTICE("Rebuilding effective permissions..."))
+
+        def progress(done, total):
+            self.stdout.write(f"  {done}/{total} users")
+
+        added, removed = effective_permission_service.rebuild(
+            truncate=options['truncate'], batch_size=options['batch_size'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f"✔️  Effective permissions rebuilt: {added} rows added, {removed} removed."))
+        if not permission_service.effective_permissions_readable():
+            self.stdout.write(self.style.NOTICE(
+                "Permission checks can now read the table: set RBAC_EFFECTIVE_PERMISSIONS_READS=True."
+            ))
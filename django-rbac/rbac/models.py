@@ -1,5 +1,5 @@
 from django.db import models
-from simple_history.models import HistoricalRecords
+from rbac.history import IndexedHistoricalRecords
 
 class Permission(models.Model):
     """
@@ -9,7 +9,7 @@ class Permission(models.Model):
     code = models.CharField(max_length=50, unique=True)   # used by the code
     label = models.CharField(max_length=255, unique=True)  # human-readable
     description = models.TextField(blank=True)
-    history = HistoricalRecords(
+    history = IndexedHistoricalRecords(
         # This will store the user's ID without creating a foreign key constraint,
         # breaking the circular dependency between 'users' and 'rbac' apps.
         history_user_id_field=models.PositiveIntegerField(null=True, blank=True),
@@ -24,7 +24,7 @@ class Role(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     permissions = models.ManyToManyField(Permission, related_name='roles', blank=True)
-    history = HistoricalRecords(
+    history = IndexedHistoricalRecords(
         history_user_id_field=models.PositiveIntegerField(null=True, blank=True),
     )
     
@@ -38,7 +38,7 @@ class Group(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     roles = models.ManyToManyField('rbac.Role', related_name='groups', blank=True)
-    history = HistoricalRecords(
+    history = IndexedHistoricalRecords(
         history_user_id_field=models.PositiveIntegerField(null=True, blank=True),
     )
 
@@ -0,0 +1,139 @@
+"""
+Keyset (cursor) pagination for the history endpoints.
+"""
+import base64
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .services.history_retention_service import ArchivedHistory
+
+
+class HistoryCursorPagination(BasePagination):
+    """
+    Pages through history records newest first, on (history_date, history_id).
+    Each page is one indexed range query, whatever its depth: there is no
+    OFFSET, and no COUNT(*) unless asked for with ?count=true (default from
+    the HISTORY_PAGINATION_COUNT setting). Links carry an opaque cursor.
+    Also pages through archived records (ArchivedHistory) the same way.
+    """
+    page_size = api_settings.PAGE_SIZE or 25
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    archived_query_param = 'archived'  # Read by BaseHistoryListView
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def include_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return getattr(settings, 'HISTORY_PAGINATION_COUNT', False)
+        return value.lower() in ('true', '1')
+
+    def encode_cursor(self, record, reverse):
+        position = f"{record.history_date.isoformat()}|{record.history_id}|{int(reverse)}"
+        cursor = base64.urlsafe_b64encode(position.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            date, history_id, reverse = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            return datetime.fromisoformat(date), int(history_id), reverse == '1'
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        self.count = queryset.count() if self.include_count(request) else None
+
+        reverse = bool(cursor and cursor[2])
+        if isinstance(queryset, ArchivedHistory):
+            # Archived records are read from the archive files in the same order
+            records = list(islice(queryset.iter(cursor[:2] if cursor else None, reverse), page_size + 1))
+        else:
+            if cursor is None:
+                queryset = queryset.order_by('-history_date', '-history_id')
+            elif not reverse:
+                date, history_id, _ = cursor
+                queryset = queryset.filter(
+                    Q(history_date__lt=date) | Q(history_date=date, history_id__lt=history_id)
+                ).order_by('-history_date', '-history_id')
+            else:
+                # Previous page: walk back up, then restore the newest-first order
+                date, history_id, _ = cursor
+                queryset = queryset.filter(
+                    Q(history_date__gt=date) | Q(history_date=date, history_id__gt=history_id)
+                ).order_by('history_date', 'history_id')
+            records = list(queryset[:page_size + 1])
+        has_more = len(records) > page_size
+        records = records[:page_size]
+        if reverse:
+            records.reverse()
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = records
+        return records
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([('next', self.get_next_link()), ('previous', self.get_previous_link())])
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': 'Only with ?count=true'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'description': 'The pagination cursor value.', 'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'description': f'Number of results per page (max {self.max_page_size}).', 'schema': {'type': 'integer'}},
+            {'name': self.count_query_param, 'required': False, 'in': 'query',
+             'description': 'Include the total number of records.', 'schema': {'type': 'boolean'}},
+            {'name': self.archived_query_param, 'required': False, 'in': 'query',
+             'description': 'List the archived records (see prune_history) instead.', 'schema': {'type': 'boolean'}},
+        ]
@@ -1,10 +1,10 @@
-import json
 from rest_framework import serializers
 from drf_spectacular.utils import extend_schema_field
 from django.contrib.auth import get_user_model
 
+from .history import diff_snapshots, get_history_user, get_previous_record
 from .models import Group, Role, Permission
-from .services import role_service, group_service
+from .services import role_service, group_service, history_export_service
 
 User = get_user_model()
 
@@ -15,6 +15,30 @@ class PermissionSerializer(serializers.ModelSerializer):
         model = Permission
         fields = ('id', 'code', 'label', 'description')
 
+class PermissionResolveSerializer(serializers.Serializer):
+    # Serializer for the bulk effective-permission resolution endpoint.
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=10000,
+        help_text="IDs of the users whose effective permissions are resolved."
+    )
+
+class PermissionsAtQuerySerializer(serializers.Serializer):
+    # Query parameters of the point-in-time permission endpoint.
+    user_id = serializers.IntegerField(min_value=1)
+    at = serializers.DateTimeField(help_text="Date (ISO 8601) at which the permissions are resolved.")
+
+class PermissionsAtSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    username = serializers.CharField()
+    at = serializers.DateTimeField()
+    is_active = serializers.BooleanField()
+    is_superuser = serializers.BooleanField()
+    roles = serializers.ListField(child=serializers.CharField(), help_text="Roles assigned directly.")
+    groups = serializers.ListField(child=serializers.CharField())
+    permissions = serializers.ListField(child=serializers.CharField(), help_text="Effective permission codes.")
+
 class RoleListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Role
@@ -45,6 +69,57 @@ class RoleAssignmentSerializer(serializers.Serializer):
     # Serializer for the role assignment/removal endpoints.
     role_id = serializers.IntegerField(required=True, help_text="The ID of the role to assign or remove.")
 
+class RoleUserPairSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(min_value=1)
+    role_id = serializers.IntegerField(min_value=1)
+
+class BulkRoleAssignmentSerializer(serializers.Serializer):
+    """
+    Serializer for the bulk role assignment/removal endpoints.
+    Accepts either explicit (user_id, role_id) pairs, or user_ids x role_ids.
+    """
+    MAX_PAIRS = 50000
+
+    pairs = RoleUserPairSerializer(many=True, required=False)
+    user_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+    role_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+
+    def validate(self, data):
+        has_pairs = 'pairs' in data
+        has_product = 'user_ids' in data or 'role_ids' in data
+        if has_pairs == has_product:
+            raise serializers.ValidationError("Provide either 'pairs', or 'user_ids' and 'role_ids'.")
+        if has_pairs:
+            pairs = [(pair['user_id'], pair['role_id']) for pair in data['pairs']]
+        else:
+            if not data.get('user_ids') or not data.get('role_ids'):
+                raise serializers.ValidationError("Both 'user_ids' and 'role_ids' are required.")
+            pairs = [(user_id, role_id) for user_id in data['user_ids'] for role_id in data['role_ids']]
+        if not pairs:
+            raise serializers.ValidationError("No assignment provided.")
+        if len(pairs) > self.MAX_PAIRS:
+            raise serializers.ValidationError(f"At most {self.MAX_PAIRS} assignments per request.")
+        data['assignments'] = pairs
+        return data
+
+class HistoryExportSerializer(serializers.Serializer):
+    """Query parameters of the history export (repeat `model` / `object_id` for several)."""
+    model = serializers.MultipleChoiceField(
+        choices=('user', 'role', 'group', 'permission'), required=False,
+        help_text="Histories to export, all of them by default."
+    )
+    object_id = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+    since = serializers.DateTimeField(required=False, help_text="Records from this date (inclusive).")
+    until = serializers.DateTimeField(required=False, help_text="Records before this date.")
+    # Not 'format': DRF reserves it for content negotiation
+    output = serializers.ChoiceField(choices=history_export_service.FORMATS, default='ndjson')
+    gzip = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if data.get('since') and data.get('until') and data['since'] >= data['until']:
+            raise serializers.ValidationError("'since' must be before 'until'.")
+        return data
+
 # --- Group Serializers ---
 class GroupListSerializer(serializers.ModelSerializer):
     roles = serializers.StringRelatedField(many=True, read_only=True)
@@ -68,9 +143,10 @@ class GroupSerializer(serializers.ModelSerializer):
 
 class UserGroupAssignmentSerializer(serializers.Serializer):
     users = serializers.StringRelatedField(many=True, read_only=True)
-    user_ids = serializers.PrimaryKeyRelatedField(
-        many=True, 
-        queryset=User.objects.all(),
+    # Plain ids: the service resolves all users with one query instead of one per id
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
         write_only=True,
         help_text="IDs of the users to assign or remove."
     )
@@ -89,6 +165,20 @@ class UserMinimalSerializer(serializers.ModelSerializer):
 
 # ----- Historical Serializers -----
 
+@extend_schema_field(serializers.CharField(allow_null=True))
+class HistoryUserField(serializers.Field):
+    """The user who made the change, as a string. Uses the page prefetch of the history list views."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        user = get_history_user(obj)
+        return str(user) if user else None
+
+
 class HistoricalChangesMixin:
     def get_changes(self, obj):
         """
@@ -97,19 +187,24 @@ class HistoricalChangesMixin:
         """
         if obj.history_type != '~':
             return {}
+        previous = get_previous_record(obj)
+        if previous is None:
+            return {}
 
-        delta = obj.diff_against(obj.prev_record)
+        delta = obj.diff_against(previous)
         changes = {}
         for change in delta.changes:
             changes[change.field] = {
                 "old": change.old,
                 "new": change.new
             }
+        # Assignment changes only show in the snapshot
+        changes.update(diff_snapshots(previous.snapshot, obj.snapshot))
         return changes
 
 
 class HistoricalPermissionSerializer(serializers.ModelSerializer, HistoricalChangesMixin):
-    history_user = serializers.StringRelatedField()
+    history_user = HistoryUserField()
     history_type_display = serializers.CharField(source='get_history_type_display', read_only=True)
     changes = serializers.SerializerMethodField()
 
@@ -126,7 +221,7 @@ class HistoricalPermissionSerializer(serializers.ModelSerializer, HistoricalChan
 
 
 class HistoricalRoleSerializer(serializers.ModelSerializer, HistoricalChangesMixin):
-    history_user = serializers.StringRelatedField()
+    history_user = HistoryUserField()
     history_type_display = serializers.CharField(source='get_history_type_display', read_only=True)
     changes = serializers.SerializerMethodField()
     permissions = serializers.SerializerMethodField()
@@ -142,16 +237,10 @@ class HistoricalRoleSerializer(serializers.ModelSerializer, HistoricalChangesMix
     def get_permissions(self, obj):
         """
         Retrieves the snapshot of permission codes stored in the history record.
-        The snapshot is saved by the `add_permissions_snapshot` signal into the
-        `history_change_reason` field as a JSON string.
+        The snapshot is kept up to date by the signals of rbac.signals in the
+        `snapshot` JSON column.
         """
-        if not obj.history_change_reason:
-            return []
-        try:
-            data = json.loads(obj.history_change_reason)
-            return data.get('permissions', [])
-        except (json.JSONDecodeError, TypeError):
-            return []
+        return obj.snapshot.get('permissions', [])
 
     @extend_schema_field(serializers.ListField(child=serializers.DictField()))
     def get_changes(self, obj):
@@ -159,7 +248,7 @@ class HistoricalRoleSerializer(serializers.ModelSerializer, HistoricalChangesMix
 
 
 class HistoricalGroupSerializer(serializers.ModelSerializer, HistoricalChangesMixin):
-    history_user = serializers.StringRelatedField()
+    history_user = HistoryUserField()
     history_type_display = serializers.CharField(source='get_history_type_display', read_only=True)
     changes = serializers.SerializerMethodField()
     roles = serializers.SerializerMethodField()
@@ -173,13 +262,7 @@ class HistoricalGroupSerializer(serializers.ModelSerializer, HistoricalChangesMi
 
     @extend_schema_field(serializers.ListField(child=serializers.CharField()))
     def get_roles(self, obj):
-        if not obj.history_change_reason:
-            return []
-        try:
-            data = json.loads(obj.history_change_reason)
-            return data.get('roles', [])
-        except (json.JSONDecodeError, TypeError):
-            return []
+        return obj.snapshot.get('roles', [])
 
     @extend_schema_field(serializers.ListField(child=serializers.DictField()))
     def get_changes(self, obj):
@@ -1,3 +1,6 @@
+from collections import Counter, defaultdict
+from django.db import transaction, router
+from django.db.models.signals import m2m_changed
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.response import Response
@@ -35,25 +38,207 @@ def remove_role_from_user(user_id, role_id):
     message = f"Role '{role.name}' removed from user '{user.username}'."
     return Response({"detail": message}, status=status.HTTP_200_OK)
 
+# Ids per IN (...) list: well below the bound parameters SQLite allows per query
+QUERY_CHUNK_SIZE = 1000
+
+def _chunks(ids, size=None):
+    ids, size = list(ids), size or QUERY_CHUNK_SIZE
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def _validate_pairs(pairs):
+    """Deduplicates the pairs and validates all user and role ids with a query per chunk of ids."""
+    pairs = list(dict.fromkeys(pairs))
+    user_ids = set()
+    for chunk in _chunks({user_id for user_id, _ in pairs}):
+        user_ids.update(User.objects.filter(id__in=chunk).values_list('id', flat=True))
+    roles = Role.objects.in_bulk({role_id for _, role_id in pairs})
+
+    outcomes, valid = {}, []
+    for user_id, role_id in pairs:
+        if user_id not in user_ids:
+            outcomes[(user_id, role_id)] = 'user_not_found'
+        elif role_id not in roles:
+            outcomes[(user_id, role_id)] = 'role_not_found'
+        else:
+            valid.append((user_id, role_id))
+    return pairs, valid, roles, outcomes
+
+def _get_existing(valid):
+    """The valid pairs already in the User.roles through-table."""
+    wanted, existing = set(valid), set()
+    for chunk in _chunks({user_id for user_id, _ in valid}):
+        rows = User.roles.through.objects.filter(user_id__in=chunk).values_list('user_id', 'role_id')
+        existing.update(pair for pair in rows if pair in wanted)
+    return existing
+
+def _send_role_users_changed(action, roles, users_by_role):
+    # bulk_create/delete on the through-table send no m2m_changed: send
+    # aggregated (reverse) signals per role and chunk of users so caches and the
+    # effective permission table are kept in sync by the usual receivers.
+    # action is e.g. "pre_add", sent before the write, or "post_add", after it.
+    through = User.roles.through
+    using = router.db_for_write(through)
+    for role_id, user_ids in users_by_role.items():
+        for chunk in _chunks(user_ids):
+            m2m_changed.send(
+                sender=through, instance=roles[role_id], action=action,
+                reverse=True, model=User, pk_set=set(chunk), using=using,
+            )
+
+def _bulk_result(pairs, outcomes):
+    return {
+        "results": [
+            {"user_id": user_id, "role_id": role_id, "status": outcomes[(user_id, role_id)]}
+            for user_id, role_id in pairs
+        ],
+        "summary": dict(Counter(outcomes.values())),
+    }
+
+def bulk_assign_roles(pairs):
+    """
+    Assigns many (user_id, role_id) pairs at once. Ids are validated with two
+    queries and new assignments are inserted in a single transaction with
+    bulk_create(ignore_conflicts=True) on the User.roles through-table.
+    Returns the outcome of each pair: assigned, already_assigned,
+    user_not_found or role_not_found.
+    """
+    pairs, valid, roles, outcomes = _validate_pairs(pairs)
+    through = User.roles.through
+
+    with transaction.atomic():
+        existing = _get_existing(valid)
+        new_pairs = [pair for pair in valid if pair not in existing]
+        users_by_role = defaultdict(list)
+        for user_id, role_id in new_pairs:
+            users_by_role[role_id].append(user_id)
+        _send_role_users_changed('pre_add', roles, users_by_role)
+        through.objects.bulk_create(
+            [through(user_id=user_id, role_id=role_id) for user_id, role_id in new_pairs],
+            batch_size=1000, ignore_conflicts=True
+        )
+        _send_role_users_changed('post_add', roles, users_by_role)
+
+    for pair in valid:
+        outcomes[pair] = 'already_assigned' if pair in existing else 'assigned'
+    return _bulk_result(pairs, outcomes)
+
+def bulk_remove_roles(pairs):
+    """
+    Removes many (user_id, role_id) pairs at once, with one delete per role
+    and chunk of users in a single transaction. Returns the outcome of each pair: removed,
+    not_assigned, user_not_found or role_not_found.
+    """
+    pairs, valid, roles, outcomes = _validate_pairs(pairs)
+    through = User.roles.through
+
+    with transaction.atomic():
+        existing = _get_existing(valid)
+        users_by_role = defaultdict(list)
+        for user_id, role_id in valid:
+            if (user_id, role_id) in existing:
+                users_by_role[role_id].append(user_id)
+        _send_role_users_changed('pre_remove', roles, users_by_role)
+        for role_id, user_ids in users_by_role.items():
+            for chunk in _chunks(user_ids):
+                through.objects.filter(role_id=role_id, user_id__in=chunk).delete()
+        _send_role_users_changed('post_remove', roles, users_by_role)
+
+    for pair in valid:
+        outcomes[pair] = 'removed' if pair in existing else 'not_assigned'
+    return _bulk_result(pairs, outcomes)
+
+def _change_group_members(group, action, user_ids):
+    # Bulk writes on the through-table, one aggregated (reverse) m2m_changed per
+    # chunk so caches and the effective permission table follow; the group sets
+    # _aggregated_history so the members get no history record each.
+    through = User.groups.through
+    using = router.db_for_write(through)
+    for chunk in _chunks(sorted(user_ids)):
+        signal = dict(sender=through, instance=group, reverse=True, model=User, pk_set=set(chunk), using=using)
+        m2m_changed.send(action=f'pre_{action}', **signal)
+        if action == 'add':
+            through.objects.bulk_create(
+                [through(group_id=group.pk, user_id=user_id) for user_id in chunk], ignore_conflicts=True
+            )
+        else:
+            through.objects.filter(group_id=group.pk, user_id__in=chunk).delete()
+        m2m_changed.send(action=f'post_{action}', **signal)
+
+def update_group_membership(group, add_ids=(), remove_ids=()):
+    """
+    Applies a set-based membership change to a group. The delta against the
+    current members is computed once (per chunk of ids), then applied with
+    bulk inserts and/or deletes on the through-table, and recorded as one
+    history entry on the group, with the ids and usernames added and removed.
+    Returns a dict of username lists: added, removed, skipped, plus the
+    not_found user ids.
+    """
+    requested_ids = set(add_ids) | set(remove_ids)
+    users = {}
+    for chunk in _chunks(requested_ids):
+        users.update(User.objects.filter(id__in=chunk).values_list('id', 'username'))
+    not_found = sorted(requested_ids - users.keys())
+
+    with transaction.atomic():
+        member_ids = set()
+        for chunk in _chunks(users.keys()):
+            member_ids.update(
+                group.users.through.objects
+                .filter(group_id=group.pk, user_id__in=chunk)
+                .values_list('user_id', flat=True)
+            )
+        to_add = {user_id for user_id in add_ids if user_id in users} - member_ids
+        to_remove = {user_id for user_id in remove_ids if user_id in users} & member_ids
+        # Already members when adding, not members when removing
+        skipped = (set(add_ids) & member_ids) | ({user_id for user_id in remove_ids if user_id in users} - member_ids)
+
+        added = sorted(users[user_id] for user_id in to_add)
+        removed = sorted(users[user_id] for user_id in to_remove)
+        group._aggregated_history = True
+        try:
+            if to_add:
+                _change_group_members(group, 'add', to_add)
+            if to_remove:
+                _change_group_members(group, 'remove', to_remove)
+            if added or removed:
+                # One history entry for the whole change, roles snapshot included
+                group._history_snapshot = {
+                    'users_added': added, 'users_removed': removed,
+                    'user_ids_added': sorted(to_add), 'user_ids_removed': sorted(to_remove),
+                }
+                group.save()
+        finally:
+            group.__dict__.pop('_aggregated_history', None)
+            group.__dict__.pop('_history_snapshot', None)
+
+    return {
+        'added': added,
+        'removed': removed,
+        'skipped': sorted(users[user_id] for user_id in skipped),
+        'not_found': not_found,
+    }
+
 def add_user_to_group(group_id, user_ids):
     """Adds users to a group."""
     group = get_object_or_404(Group, pk=group_id)
-    existing_ids = set(group.users.values_list('id', flat=True))
-    added, skipped = [], []
-
-    for user in User.objects.filter(id__in=user_ids):
-        in_group = user.id in existing_ids
-        if not in_group:
-            group.users.add(user)
-            added.append(user.username)
-        else:
-            skipped.append(user.username)
+    result = update_group_membership(group, add_ids=user_ids)
+    added, skipped = result['added'], result['skipped']
 
     status_code = 200 if added else 409
     message = f"Users added: {added}" if added else f"No users added; skipped: {skipped}"
-    return Response({"detail": message}, status=status_code)
+    return Response({
+        "detail": message, "added": added, "skipped": skipped, "not_found": result['not_found']
+    }, status=status_code)
 
 def remove_user_from_group(group_id, user_ids):
     """Removes users from a group."""
-    # Reuse the add_user_to_group function, but remove users instead
-    return add_user_to_group(group_id, user_ids)
\ No newline at end of file
+    group = get_object_or_404(Group, pk=group_id)
+    result = update_group_membership(group, remove_ids=user_ids)
+    removed, skipped = result['removed'], result['skipped']
+
+    status_code = 200 if removed else 409
+    message = f"Users removed: {removed}" if removed else f"No users removed; skipped: {skipped}"
+    return Response({
+        "detail": message, "removed": removed, "skipped": skipped, "not_found": result['not_found']
+    }, status=status_code)
@@ -0,0 +1,135 @@
+"""
+Shared cache of effective permission codes, built on Django's cache framework.
+
+Entries are stored per user under the current "RBAC version" (Django cache key
+versioning). Any change to a role, group or permission bumps that version, which
+invalidates every cached user in O(1). Entries are also keyed on the user's own
+version, which changes to a single user's roles or groups bump: an entry loaded
+before such a change can only be re-cached under the outdated user version.
+Permission claims embedded in access tokens are checked against both versions.
+
+Versions only invalidate entries for the processes that see the bump, so by
+default the cache is only used on a backend shared by every process (not
+LocMemCache); RBAC_PERMISSION_CACHE forces it on or off.
+"""
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+RBAC_VERSION_KEY = 'rbac:version'
+HISTORY_VERSION_KEY = 'rbac:history_version'
+USER_PERMISSIONS_KEY = 'rbac:user_permissions:{user_id}:{user_version}'
+USER_VERSION_KEY = 'rbac:user_version:{user_id}'
+
+def get_cache():
+    return caches[getattr(settings, 'RBAC_PERMISSION_CACHE_ALIAS', 'default')]
+
+def is_shared(cache) -> bool:
+    """Whether every process sees the same cache, unlike the process-local backends."""
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+def is_enabled() -> bool:
+    """Whether permission codes are cached (and permission claims can be checked)."""
+    enabled = getattr(settings, 'RBAC_PERMISSION_CACHE', None)
+    if enabled is None:
+        return is_shared(get_cache())
+    return enabled
+
+def get_timeout():
+    return getattr(settings, 'RBAC_PERMISSION_CACHE_TIMEOUT', 300)
+
+def _get_or_seed_version(key) -> int:
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock: if the counter is ever evicted, the new value
+        # can never match anything written under an earlier version.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+def get_rbac_version() -> int:
+    """Returns the current RBAC version, initializing it if it is missing."""
+    return _get_or_seed_version(RBAC_VERSION_KEY)
+
+def get_user_version(user_id) -> int:
+    """Returns the permission version of a single user, initializing it if it is missing."""
+    return _get_or_seed_version(USER_VERSION_KEY.format(user_id=user_id))
+
+def get_current_versions(user_id):
+    """
+    Returns the (RBAC version, user version) pair with a single cache round trip,
+    or None if either is unknown. Never initializes a missing version.
+    """
+    user_key = USER_VERSION_KEY.format(user_id=user_id)
+    versions = get_cache().get_many([RBAC_VERSION_KEY, user_key])
+    if RBAC_VERSION_KEY not in versions or user_key not in versions:
+        return None
+    return versions[RBAC_VERSION_KEY], versions[user_key]
+
+def _bump_version(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Counter missing: re-seeding it is an invalidation on its own.
+        _get_or_seed_version(key)
+
+def _bump_rbac_version():
+    _bump_version(RBAC_VERSION_KEY)
+
+def bump_rbac_version():
+    """
+    Invalidates the cached permissions of every user.
+    Runs once the current transaction commits, so readers cannot re-cache
+    the old state in between.
+    """
+    transaction.on_commit(_bump_rbac_version)
+
+def get_history_version() -> int:
+    """Version of the recorded history, for caches of past states (see point_in_time_service)."""
+    return _get_or_seed_version(HISTORY_VERSION_KEY)
+
+def bump_history_version():
+    """Invalidates what was derived from past history, once records are removed or rewritten."""
+    _bump_version(HISTORY_VERSION_KEY)
+
+def get_versions(user_id):
+    """Returns the (RBAC version, user version) pair, initializing either if it is missing."""
+    return get_current_versions(user_id) or (get_rbac_version(), get_user_version(user_id))
+
+def get_user_permission_codes(user_id, versions):
+    rbac_version, user_version = versions
+    return get_cache().get(
+        USER_PERMISSIONS_KEY.format(user_id=user_id, user_version=user_version), version=rbac_version
+    )
+
+def set_user_permission_codes(user_id, codes, versions):
+    rbac_version, user_version = versions
+    get_cache().set(
+        USER_PERMISSIONS_KEY.format(user_id=user_id, user_version=user_version), codes,
+        timeout=get_timeout(), version=rbac_version
+    )
+
+def _invalidate_user_permissions(user_ids):
+    cache = get_cache()
+    for user_id in user_ids:
+        try:
+            cache.incr(USER_VERSION_KEY.format(user_id=user_id))
+        except ValueError:
+            # No version yet: nothing was cached or issued against it, and
+            # the version seeded by the next reader is a new one.
+            pass
+
+def invalidate_user_permissions(user_ids):
+    """
+    Invalidates the cached permissions of the given users once the
+    transaction commits, by bumping their user versions.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    transaction.on_commit(lambda: _invalidate_user_permissions(user_ids))
@@ -0,0 +1,91 @@
+"""
+Permission claims embedded in JWT access tokens.
+
+When RBAC_JWT_PERMISSION_CLAIMS is enabled, access tokens carry the user's
+effective permission codes as a bitmap plus the versions they were resolved
+under. While both the RBAC version and the user's own version are unchanged,
+requests are authorized from the token alone, without database access.
+
+Bit positions follow the permissions ordered by id. Creating or deleting a
+permission bumps the RBAC version, so the positions are stable per version.
+"""
+import base64
+from django.conf import settings
+from rest_framework_simplejwt.settings import api_settings
+
+from rbac.models import Permission
+from rbac.services import cache_service, permission_service
+
+PERMISSIONS_CLAIM = 'perms'
+RBAC_VERSION_CLAIM = 'rbac_v'
+PERMISSION_INDEX_KEY = 'rbac:permission_index'
+
+# Process-local copy of the index for the last seen RBAC version
+_local_index = (None, None)
+
+def is_enabled() -> bool:
+    # The versions in the claims are only current when checked against a shared cache
+    return getattr(settings, 'RBAC_JWT_PERMISSION_CLAIMS', False) and cache_service.is_enabled()
+
+def get_permission_index(version) -> dict:
+    """Returns the {code: bit position} mapping for the given RBAC version."""
+    global _local_index
+    local_version, index = _local_index
+    if local_version == version:
+        return index
+
+    cache = cache_service.get_cache()
+    index = cache.get(PERMISSION_INDEX_KEY, version=version)
+    if index is None:
+        codes = Permission.objects.order_by('id').values_list('code', flat=True)
+        index = {code: position for position, code in enumerate(codes)}
+        cache.set(PERMISSION_INDEX_KEY, index, timeout=None, version=version)
+    _local_index = (version, index)
+    return index
+
+def encode_bitmap(positions) -> str:
+    bitmap = 0
+    for position in positions:
+        bitmap |= 1 << position
+    raw = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+def decode_bitmap(value: str) -> int:
+    raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    return int.from_bytes(raw, 'little')
+
+def add_permission_claims(token, user_id):
+    """Embeds the user's effective permissions and their versions in the token."""
+    rbac_version = cache_service.get_rbac_version()
+    user_version = cache_service.get_user_version(user_id)
+    codes = permission_service.get_user_permission_codes(user_id)
+    index = get_permission_index(rbac_version)
+
+    token[RBAC_VERSION_CLAIM] = f"{rbac_version}.{user_version}"
+    token[PERMISSIONS_CLAIM] = encode_bitmap(index[code] for code in codes if code in index)
+
+def check_token_permissions(token, codes):
+    """
+    Checks the required permission codes against the token claims.
+    Returns True or False when the claims are current, or None when
+    the caller has to fall back to resolving the user's permissions.
+    """
+    if token is None or not is_enabled():
+        return None
+    bitmap_claim = token.get(PERMISSIONS_CLAIM)
+    version_claim = token.get(RBAC_VERSION_CLAIM)
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    if bitmap_claim is None or version_claim is None or user_id is None:
+        return None
+
+    versions = cache_service.get_current_versions(user_id)
+    if versions is None or version_claim != "{}.{}".format(*versions):
+        return None
+
+    index = get_permission_index(versions[0])
+    bitmap = decode_bitmap(bitmap_claim)
+    for code in codes:
+        position = index.get(code)
+        if position is None or not (bitmap >> position) & 1:
+            return False
+    return True
@@ -0,0 +1,181 @@
+"""
+Maintenance of the denormalized UserEffectivePermission table.
+
+New grants (a role gaining permissions, a user or group gaining roles) only
+ever add rows, so they are inserted directly. Removals are translated into the
+set of affected users, whose rows are recomputed with resolve_user_permissions()
+and updated by delta (only missing rows are inserted, only stale rows deleted),
+since a permission may still be granted through another path. Removals
+affecting more than SYNC_INLINE_LIMIT users are synced once the change commits,
+one batch per transaction, so the change itself stays short; the RBAC version
+is bumped again once they are synced, since permissions read from the table in
+between were cached under the version bumped by the change.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.contrib.auth import get_user_model
+
+from rbac.models import Permission, Role, Group
+from rbac.services import cache_service
+from rbac.services.permission_service import (
+    effective_permissions_enabled, effective_permissions_readable, resolve_user_permissions,
+)
+from users.models import UserEffectivePermission
+
+User = get_user_model()
+
+SYNC_BATCH_SIZE = 1000
+SYNC_INLINE_LIMIT = SYNC_BATCH_SIZE
+
+def is_enabled() -> bool:
+    return effective_permissions_enabled()
+
+def get_role_user_ids(role_ids) -> set:
+    """Users holding any of the roles, directly or through a group."""
+    group_ids = Group.roles.through.objects.filter(role_id__in=role_ids).values('group_id')
+    direct = Role.users.through.objects.filter(role_id__in=role_ids).values_list('user_id', flat=True)
+    via_groups = Group.users.through.objects.filter(group_id__in=group_ids).values_list('user_id', flat=True)
+    return set(direct) | set(via_groups)
+
+def get_group_user_ids(group_ids) -> set:
+    """Members of any of the groups."""
+    return set(Group.users.through.objects.filter(group_id__in=group_ids).values_list('user_id', flat=True))
+
+def get_group_role_ids(group_ids) -> set:
+    """Roles assigned to any of the groups."""
+    return set(Group.roles.through.objects.filter(group_id__in=group_ids).values_list('role_id', flat=True))
+
+def grant_permissions(user_ids, permission_ids):
+    """Adds the rows for permissions newly granted to the given users."""
+    if not is_enabled() or not user_ids or not permission_ids:
+        return 0
+    permissions = list(Permission.objects.filter(id__in=permission_ids).values_list('id', 'code'))
+    rows = [
+        UserEffectivePermission(user_id=user_id, permission_id=permission_id, code=code)
+        for user_id in user_ids for permission_id, code in permissions
+    ]
+    UserEffectivePermission.objects.bulk_create(rows, batch_size=SYNC_BATCH_SIZE, ignore_conflicts=True)
+    return len(rows)
+
+def grant_roles(user_ids, role_ids):
+    """Adds the rows for roles newly granted to the given users."""
+    if not role_ids:
+        return 0
+    permission_ids = set(
+        Role.permissions.through.objects.filter(role_id__in=role_ids).values_list('permission_id', flat=True)
+    )
+    return grant_permissions(user_ids, permission_ids)
+
+def _sync_batch(user_ids):
+    wanted = resolve_user_permissions(user_ids)
+    permission_ids = dict(Permission.objects.values_list('code', 'id'))
+
+    existing = {}
+    for row_id, user_id, permission_id in (
+        UserEffectivePermission.objects.filter(user_id__in=user_ids).values_list('id', 'user_id', 'permission_id')
+    ):
+        existing[(user_id, permission_id)] = row_id
+
+    wanted_pairs = {
+        (user_id, permission_ids[code]): code
+        for user_id, codes in wanted.items() for code in codes if code in permission_ids
+    }
+    stale_ids = [row_id for pair, row_id in existing.items() if pair not in wanted_pairs]
+    missing = [
+        UserEffectivePermission(user_id=user_id, permission_id=permission_id, code=code)
+        for (user_id, permission_id), code in wanted_pairs.items() if (user_id, permission_id) not in existing
+    ]
+    if stale_ids:
+        UserEffectivePermission.objects.filter(id__in=stale_ids).delete()
+    if missing:
+        UserEffectivePermission.objects.bulk_create(missing, ignore_conflicts=True)
+    return len(missing), len(stale_ids)
+
+def sync_users(user_ids):
+    """
+    Recomputes the effective permission rows of the given users and applies the delta.
+    Returns the (added, removed) row counts.
+    """
+    if not is_enabled():
+        return 0, 0
+    user_ids = sorted(set(user_ids))
+    added = removed = 0
+    for start in range(0, len(user_ids), SYNC_BATCH_SIZE):
+        with transaction.atomic():
+            batch_added, batch_removed = _sync_batch(user_ids[start:start + SYNC_BATCH_SIZE])
+        added += batch_added
+        removed += batch_removed
+    return added, removed
+
+def schedule_sync(user_ids):
+    """
+    Recomputes the rows of the users affected by a removal: at once for up to
+    SYNC_INLINE_LIMIT users, otherwise once the current transaction commits.
+    """
+    if not is_enabled():
+        return
+    user_ids = list(user_ids)
+    if len(user_ids) <= SYNC_INLINE_LIMIT:
+        sync_users(user_ids)
+    else:
+        transaction.on_commit(lambda: _sync_users_after_commit(user_ids))
+
+def _sync_users_after_commit(user_ids):
+    sync_users(user_ids)
+    # Drops the permissions cached from the stale rows since the commit
+    cache_service.bump_rbac_version()
+
+def iter_user_id_batches(batch_size=SYNC_BATCH_SIZE):
+    """Yields the user ids in ascending batches (keyset pagination)."""
+    last_id = 0
+    while True:
+        batch = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+def rebuild(truncate=False, batch_size=SYNC_BATCH_SIZE, progress=None):
+    """
+    Rebuilds the whole table from the role/group graph, one batch of users at a time.
+    With truncate=True the table is emptied first (readers briefly see no rows).
+    """
+    if truncate:
+        UserEffectivePermission.objects.all().delete()
+    total = User.objects.count() if progress else None
+    added = removed = done = 0
+    for batch in iter_user_id_batches(batch_size):
+        with transaction.atomic():
+            batch_added, batch_removed = _sync_batch(batch)
+        added += batch_added
+        removed += batch_removed
+        done += len(batch)
+        if progress:
+            progress(done, max(done, total))
+    return added, removed
+
+def rename_permission(permission):
+    """Keeps the denormalized code in sync after a permission code change."""
+    UserEffectivePermission.objects.filter(permission=permission).exclude(code=permission.code).update(code=permission.code)
+
+def find_drift(batch_size=SYNC_BATCH_SIZE):
+    """
+    Compares the table with the live role/group graph, one batch of users at a time.
+    Yields (user_id, missing codes, extra codes) for every user whose rows differ.
+    """
+    for batch in iter_user_id_batches(batch_size):
+        wanted = resolve_user_permissions(batch)
+        stored = {user_id: set() for user_id in batch}
+        for user_id, code in UserEffectivePermission.objects.filter(user_id__in=batch).values_list('user_id', 'code'):
+            stored[user_id].add(code)
+        for user_id in batch:
+            if wanted[user_id] != stored[user_id]:
+                yield user_id, wanted[user_id] - stored[user_id], stored[user_id] - wanted[user_id]
+
+def get_permission_holders(code):
+    """Queryset of the users holding the permission code through direct roles or group roles."""
+    if effective_permissions_readable():
+        return User.objects.filter(effective_permissions__code=code)
+    return User.objects.filter(
+        Q(roles__permissions__code=code) | Q(groups__roles__permissions__code=code)
+    ).distinct()
@@ -0,0 +1,315 @@
+"""
+History retention, compaction and archival (HISTORY_RETENTION setting).
+
+compact() removes '~' records that changed nothing (same tracked fields and
+snapshot as the previous record of the object). With COLLAPSE_SECONDS, it also
+removes the earlier records of a run of '~' changes made by the same user in
+quick succession: the last record of the run holds the resulting state, and
+its diff is then taken against the record before the run.
+expire() removes the records older than KEEP_DAYS, except the last KEEP_LAST
+records of each object; the latest record of an object is always kept.
+
+Removed records are first appended to gzipped JSONL archives,
+<ARCHIVE_DIR>/<model>/<YYYY-MM>.jsonl.gz (by UTC history date), then deleted
+by primary key. A manifest.json next to them holds the row count of each
+partition, so counting the archived records reads no archive. Both passes work in batches of history ids, each a short
+statement, so the history tables are never locked for long. ArchivedHistory
+reads the archives back for the history endpoints (?archived=true).
+"""
+import gzip
+import json
+import os
+import time
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from rbac.history import with_previous_record
+from rbac.services import cache_service
+from rbac.services.history_export_service import get_models, get_tracked_fields
+
+
+def get_config():
+    config = getattr(settings, 'HISTORY_RETENTION', {})
+    return {
+        'ARCHIVE_DIR': config.get('ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'history_archive')),
+        'BATCH_SIZE': config.get('BATCH_SIZE', 1000),
+        'COMPACT': config.get('COMPACT', True),
+        'COLLAPSE_SECONDS': config.get('COLLAPSE_SECONDS', 0),
+        'POLICIES': config.get('POLICIES', {}),
+    }
+
+def get_archive_dir(model, config=None):
+    config = config or get_config()
+    return os.path.join(config['ARCHIVE_DIR'], model._meta.model_name)
+
+MANIFEST = 'manifest.json'
+
+def read_manifest(directory):
+    """{partition: archived rows} of an archive directory."""
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+def write_manifest(directory, manifest):
+    # Written aside, then renamed: readers never see a partial manifest
+    path = os.path.join(directory, MANIFEST)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as tmp:
+        json.dump(manifest, tmp, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+def _count_archived(path):
+    # Distinct records: an interrupted run may have archived some twice
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        return len({json.loads(line)['history_id'] for line in archive})
+
+def get_partition(date):
+    """Archive partition (YYYY-MM, UTC) of a history date."""
+    if timezone.is_aware(date):
+        date = date.astimezone(dt_timezone.utc)
+    return date.strftime('%Y-%m')
+
+def archive_rows(model, rows, config=None):
+    """
+    Appends history rows (dicts of column values) to the monthly archives.
+    Returns {partition: rows appended}, for update_manifest() once the rows
+    are deleted.
+    """
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(get_partition(row['history_date']), []).append(row)
+    directory = get_archive_dir(model, config)
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    for partition, partition_rows in partitions.items():
+        path = os.path.join(directory, f'{partition}.jsonl.gz')
+        if partition not in manifest:
+            # Archived before the manifest existed: counted once
+            manifest[partition] = _count_archived(path) if os.path.exists(path) else 0
+        # Appending adds a gzip member: the file remains one valid gzip stream
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for row in partition_rows:
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+    write_manifest(directory, manifest)
+    return {partition: len(partition_rows) for partition, partition_rows in partitions.items()}
+
+def update_manifest(model, counts, config=None):
+    """Adds the rows of archive_rows() to the manifest."""
+    directory = get_archive_dir(model, config)
+    manifest = read_manifest(directory)
+    for partition, count in counts.items():
+        manifest[partition] = manifest.get(partition, 0) + count
+    write_manifest(directory, manifest)
+
+def remove_records(model, history_ids, config=None):
+    """Archives, then deletes, history records. Returns the number removed."""
+    history = model.history.model
+    columns = [field.attname for field in history._meta.concrete_fields]
+    rows = list(history.objects.filter(history_id__in=history_ids).values(*columns))
+    counts = archive_rows(model, rows, config)
+    # A failure past this point leaves the rows archived twice at most: readers skip duplicates,
+    # and the manifest only counts them once they are deleted
+    history.objects.filter(history_id__in=[row['history_id'] for row in rows]).delete()
+    update_manifest(model, counts, config)
+    # Past dates may now resolve differently (point_in_time_service)
+    transaction.on_commit(cache_service.bump_history_version)
+    return len(rows)
+
+def compact(model, config=None, dry_run=False, batch_size=None, sleep=0, progress=None):
+    """Removes no-op '~' records (and collapses quick runs of changes). Returns the number removed."""
+    config = config or get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    window = timedelta(seconds=config['COLLAPSE_SECONDS'])
+    history = model.history.model
+    fields = get_tracked_fields(history) + ['snapshot']
+    columns = ('history_id', 'history_type', 'history_date', 'history_user_id', *fields)
+
+    removed, last_id = 0, 0
+    while True:
+        batch = list(
+            with_previous_record(history.objects.filter(history_id__gt=last_id, history_type='~'))
+            .order_by('history_id')
+            .values('previous_history_id', *columns)[:batch_size]
+        )
+        if not batch:
+            return removed
+        last_id = batch[-1]['history_id']
+        previous = history.objects.in_bulk(
+            [row['previous_history_id'] for row in batch if row['previous_history_id']]
+        )
+
+        to_remove = set()
+        for row in batch:
+            prev = previous.get(row['previous_history_id'])
+            if prev is None:
+                continue
+            if all(row[field] == getattr(prev, field) for field in fields):
+                to_remove.add(row['history_id'])
+            elif (window and prev.history_type == '~' and prev.history_user_id == row['history_user_id']
+                  and row['history_date'] - prev.history_date <= window):
+                to_remove.add(prev.history_id)
+
+        if to_remove:
+            removed += len(to_remove) if dry_run else remove_records(model, to_remove, config)
+            if progress:
+                progress(model, 'compacted', removed)
+            time.sleep(sleep)
+
+def get_expired(model, policy, now=None):
+    """
+    History records of model outside its retention policy, None if it keeps
+    everything. The latest record of each object is kept whatever the policy:
+    it is the current state of a live object, or the deletion of a removed one.
+    """
+    keep_days, keep_last = policy.get('KEEP_DAYS'), policy.get('KEEP_LAST')
+    if keep_days is None and not keep_last:
+        return None
+    keep_last = max(keep_last or 0, 1)
+    history = model.history.model
+    queryset = history.objects.all()
+    if keep_days is not None:
+        queryset = queryset.filter(history_date__lt=(now or timezone.now()) - timedelta(days=keep_days))
+    # Older than the keep_last-th most recent record of the same object
+    kth = (
+        history.objects.filter(id=OuterRef('id'))
+        .order_by('-history_id')
+        .values('history_id')[keep_last - 1:keep_last]
+    )
+    return queryset.annotate(kth_history_id=Subquery(kth)).filter(history_id__lt=F('kth_history_id'))
+
+def expire(model, policy, config=None, dry_run=False, batch_size=None, sleep=0, progress=None):
+    """Archives and removes the records outside the policy. Returns the number removed."""
+    config = config or get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    expired = get_expired(model, policy)
+    if expired is None:
+        return 0
+
+    removed, last_id = 0, 0
+    while True:
+        history_ids = list(
+            expired.filter(history_id__gt=last_id).order_by('history_id')
+            .values_list('history_id', flat=True)[:batch_size]
+        )
+        if not history_ids:
+            return removed
+        last_id = history_ids[-1]
+        removed += len(history_ids) if dry_run else remove_records(model, history_ids, config)
+        if progress:
+            progress(model, 'expired', removed)
+        time.sleep(sleep)
+
+def run(names=None, dry_run=False, batch_size=None, sleep=0, progress=None):
+    """
+    Compacts, then applies the retention policy to, each history (all of them
+    by default). Returns {name: {'compacted': n, 'expired': n}}.
+    """
+    config = get_config()
+    report = {}
+    for name, model in get_models().items():
+        if names and name not in names:
+            continue
+        options = dict(config=config, dry_run=dry_run, batch_size=batch_size, sleep=sleep, progress=progress)
+        report[name] = {
+            'compacted': compact(model, **options) if config['COMPACT'] else 0,
+            'expired': expire(model, config['POLICIES'].get(name, {}), **options),
+        }
+    return report
+
+
+class ArchivedHistory:
+    """
+    The archived records of a history (optionally of one object), as unsaved
+    historical instances. Partitions are read on demand, one at a time, and
+    records archived twice by an interrupted run are skipped.
+    """
+
+    def __init__(self, model, object_id=None, snapshot_filters=None, config=None):
+        self.history = model.history.model
+        self.directory = get_archive_dir(model, config)
+        self.object_id = object_id
+        self.snapshot_filters = snapshot_filters or {}
+        self.fields = {field.attname: field for field in self.history._meta.concrete_fields}
+
+    def partitions(self):
+        try:
+            return sorted(name for name in os.listdir(self.directory) if name.endswith('.jsonl.gz'))
+        except FileNotFoundError:
+            return []
+
+    def matches(self, row):
+        if self.object_id is not None and row['id'] != self.object_id:
+            return False
+        snapshot = row.get('snapshot') or {}
+        return all(value in snapshot.get(key, []) for key, value in self.snapshot_filters.items())
+
+    def load(self, partition):
+        """Records of a partition, oldest first."""
+        records, seen = [], set()
+        with gzip.open(os.path.join(self.directory, partition), 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                row = json.loads(line)
+                if row['history_id'] in seen or not self.matches(row):
+                    continue
+                seen.add(row['history_id'])
+                records.append(self.history(**{
+                    name: self.fields[name].to_python(value) for name, value in row.items() if name in self.fields
+                }))
+        records.sort(key=lambda record: (record.history_date, record.history_id))
+        return records
+
+    def iter(self, position=None, reverse=False):
+        """
+        Records newest first, older than position (history_date, history_id);
+        with reverse, oldest first and newer than position.
+        """
+        partitions = self.partitions() if reverse else self.partitions()[::-1]
+        start = get_partition(position[0]) if position else None
+        for partition in partitions:
+            if start and (partition[:7] < start if reverse else partition[:7] > start):
+                continue
+            records = self.load(partition)
+            if not reverse:
+                records.reverse()
+            for record in records:
+                key = (record.history_date, record.history_id)
+                if position is None or (key > position if reverse else key < position):
+                    yield record
+
+    def count(self):
+        if self.object_id is not None or self.snapshot_filters:
+            return sum(len(self.load(partition)) for partition in self.partitions())
+        # Unfiltered: from the manifest, partitions archived before it are read
+        manifest = read_manifest(self.directory)
+        return sum(
+            manifest[partition[:7]] if partition[:7] in manifest else len(self.load(partition))
+            for partition in self.partitions()
+        )
+
+    def prefetch(self, page):
+        """Attaches the previous records and history users of a page (newest first)."""
+        waiting = {}
+        for record in page:
+            record._previous_record = None
+            if record.id in waiting:
+                waiting.pop(record.id)._previous_record = record
+            waiting[record.id] = record
+        if waiting:
+            for record in self.iter(position=(page[-1].history_date, page[-1].history_id)):
+                if record.id in waiting:
+                    waiting.pop(record.id)._previous_record = record
+                    if not waiting:
+                        break
+
+        user_ids = {record.history_user_id for record in page if record.history_user_id}
+        users = get_user_model().objects.in_bulk(user_ids) if user_ids else {}
+        for record in page:
+            record._history_user = users.get(record.history_user_id)
+        return page
@@ -1,10 +1,12 @@
 # Generic DRF permissions
 from rest_framework.permissions import BasePermission
 from rest_framework.permissions import IsAuthenticated
+from django.apps import apps
+from django.conf import settings
 from django.db.models import Q
 
-from users.models import User
-from rbac.models import Permission
+from rbac.models import Permission, Role, Group
+from rbac.services import cache_service, claims_service
 
 class HasPermission(BasePermission):
     # Custom permission to check if the user has a specific permission code.
@@ -20,7 +22,13 @@ class HasPermission(BasePermission):
         user = request.user 
         if not user or not user.is_authenticated:
             return False
-        return user.is_superuser or all(user.has_permission(perm) for perm in self.required_permissions)
+        if user.is_superuser:
+            return True
+        # Authorize from the access token claims while they are still current
+        granted = claims_service.check_token_permissions(request.auth, self.required_permissions)
+        if granted is not None:
+            return granted
+        return all(user.has_permission(perm) for perm in self.required_permissions)
 
 DEFAULT_ACTION_MAP = {
     # DRF ViewSets / GenericAPIView "actions"
@@ -58,6 +66,24 @@ class AutoPermissionMixin:
         # Merge DEFAULT_ACTION_MAP with view-specific permission_code_map
         return {**DEFAULT_ACTION_MAP, **self.permission_code_map}
 
+    @classmethod
+    def get_permission_plan(cls, view):
+        """
+        Returns the {action key: permission instances} table of this view class.
+        It is compiled once per class, on first use, so requests neither merge
+        the action maps nor build permission classes. HasPermission instances
+        hold no request state and are shared between requests.
+        """
+        plan = cls.__dict__.get('_permission_plan')
+        if plan is None:
+            plan = {
+                action_key: (HasPermission.with_perms(f"{cls.resource}.{perm_suffix}")(),)
+                for action_key, perm_suffix in view.get_permission_code_map().items()
+                if perm_suffix
+            }
+            cls._permission_plan = plan
+        return plan
+
     def get_permissions(self):
         # If the view is a fake swagger view, return the default permissions
         if getattr(self, 'swagger_fake_view', False):
@@ -73,24 +99,106 @@ class AutoPermissionMixin:
             or (self.request.method if hasattr(self, 'request') else None)
         )
 
-        # 1 : Try merged map (custom overrides default)
-        perm_cod_map = self.get_permission_code_map()
-        perm_suffix = perm_cod_map.get(action_key)
-
-         # If custom code already fully qualified, use as is
-        if perm_suffix:
-            return [HasPermission.with_perms(f"{self.resource}.{perm_suffix}")()]
+        # 1 : Look up the compiled plan (custom map overrides default)
+        permissions = self.get_permission_plan(self).get(action_key)
+        if permissions:
+            return list(permissions)
 
-        
         # 2 : Fallback to default permission classes
         return [cls() for cls in getattr(self, 'permission_classes', self.default_permission_classes)]
 
-def get_user_permissions(user: User):
+def effective_permissions_enabled() -> bool:
+    # Whether users.UserEffectivePermission is maintained
+    return getattr(settings, 'RBAC_EFFECTIVE_PERMISSIONS', False)
+
+def effective_permissions_readable() -> bool:
+    # Whether permission reads use users.UserEffectivePermission: only once it
+    # is maintained and has been rebuilt, an empty table would grant nothing
+    return effective_permissions_enabled() and getattr(settings, 'RBAC_EFFECTIVE_PERMISSIONS_READS', False)
+
+def get_user_permissions(user):
     """
-    Retrieves a distinct queryset of all permissions for a given user,
+    Retrieves a distinct queryset of all permissions for a given user (or user id),
     derived from their directly assigned roles and the roles of the groups
     they belong to.
     """
+    if effective_permissions_readable():
+        # Single indexed lookup on the materialized table
+        return Permission.objects.filter(holders__user=user)
     return Permission.objects.filter(
         Q(roles__users=user) | Q(roles__groups__users=user)
-    ).distinct()
\ No newline at end of file
+    ).distinct()
+
+def get_user_permission_codes(user) -> frozenset:
+    """
+    Returns the effective permission codes of a user (or user id) as a frozenset.
+    Served from the shared permission cache when possible, otherwise
+    resolved with a single query and cached under the current RBAC and user versions.
+    """
+    user_id = getattr(user, 'pk', user)
+    if not cache_service.is_enabled():
+        return frozenset(_load_user_permission_codes(user_id))
+    # Read the versions before querying so that a concurrent change can
+    # only leave behind an entry under an already outdated version.
+    versions = cache_service.get_versions(user_id)
+    codes = cache_service.get_user_permission_codes(user_id, versions)
+    if codes is None:
+        codes = frozenset(_load_user_permission_codes(user_id))
+        cache_service.set_user_permission_codes(user_id, codes, versions)
+    return codes
+
+def _load_user_permission_codes(user_id):
+    if effective_permissions_readable():
+        # Covered by the (user, code) index, no join needed
+        UserEffectivePermission = apps.get_model('users', 'UserEffectivePermission')
+        return UserEffectivePermission.objects.filter(user_id=user_id).values_list('code', flat=True)
+    return get_user_permissions(user_id).values_list('code', flat=True)
+
+RESOLVE_CHUNK_SIZE = 500
+
+def resolve_user_permissions(user_ids) -> dict:
+    """
+    Resolves the effective permission codes of many users at once.
+    Walks the User.roles, User.groups, Group.roles and Role.permissions
+    through-tables with one query each and joins the rows in Python, for
+    RESOLVE_CHUNK_SIZE users at a time, so IN lists stay within the database
+    limits (e.g. SQLite's number of parameters) and the number of queries
+    only grows by four per chunk.
+    Returns {user_id: set of codes}; users without roles map to an empty set.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    result = {}
+    for start in range(0, len(user_ids), RESOLVE_CHUNK_SIZE):
+        result.update(_resolve_chunk(set(user_ids[start:start + RESOLVE_CHUNK_SIZE])))
+    return result
+
+def _resolve_chunk(user_ids):
+    user_roles = list(
+        Role.users.through.objects.filter(user_id__in=user_ids).values_list('user_id', 'role_id')
+    )
+    user_groups = list(
+        Group.users.through.objects.filter(user_id__in=user_ids).values_list('user_id', 'group_id')
+    )
+    group_roles = list(
+        Group.roles.through.objects
+        .filter(group_id__in={group_id for _, group_id in user_groups})
+        .values_list('group_id', 'role_id')
+    )
+    role_ids = {role_id for _, role_id in user_roles} | {role_id for _, role_id in group_roles}
+    role_codes = {}
+    for role_id, code in (
+        Role.permissions.through.objects.filter(role_id__in=role_ids).values_list('role_id', 'permission__code')
+    ):
+        role_codes.setdefault(role_id, set()).add(code)
+
+    group_role_ids = {}
+    for group_id, role_id in group_roles:
+        group_role_ids.setdefault(group_id, set()).add(role_id)
+
+    result = {user_id: set() for user_id in user_ids}
+    for user_id, role_id in user_roles:
+        result[user_id] |= role_codes.get(role_id, set())
+    for user_id, group_id in user_groups:
+        for role_id in group_role_ids.get(group_id, ()):
+            result[user_id] |= role_codes.get(role_id, set())
+    return result
@@ -0,0 +1,100 @@
+"""
+Point-in-time RBAC: the effective permissions a user had at a past date.
+
+The state of each object at a date is its latest history record at or before
+that date (rbac.history.latest_records_at), whose snapshot holds its
+assignments: the user's roles and groups, then the groups' roles, then the
+roles' permissions. The permission codes of that date come from the
+permission history. Bulk membership changes are recorded once on the group
+rather than on each user, so the user's groups are those of its record,
+updated by the group records written since. That is five queries, joined in
+memory.
+
+Past states only change when their history does, so reconstructions of
+dates in the past are kept in an in-process LRU cache
+(RBAC_POINT_IN_TIME_CACHE_SIZE entries), keyed on the shared history version
+(cache_service.get_history_version): prune_history and
+backfill_history_snapshots bump it, which invalidates the entries of every
+process. History removed by prune_history is not consulted: dates older than
+the retention window may resolve to fewer assignments.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from rbac.history import latest_records_at
+from rbac.models import Group, Permission, Role
+from rbac.services import cache_service
+
+
+def _latest(model, object_ids, at):
+    """{object_id: record} of the objects that existed at `at`."""
+    if not object_ids:
+        return {}
+    records = latest_records_at(model.history.all(), object_ids, at)
+    return {record.id: record for record in records if record.history_type != '-'}
+
+def _group_ids_at(user, at):
+    """Groups of the user record, changed by the bulk membership changes up to `at`."""
+    group_ids = set(user.snapshot.get('group_ids', []))
+    changes = (
+        Group.history.filter(
+            history_date__gt=user.history_date, history_date__lte=at, snapshot__has_key='user_ids_added',
+        )
+        .order_by('history_date', 'history_id')
+        .values_list('id', 'snapshot')
+    )
+    for group_id, snapshot in changes:
+        if user.id in snapshot['user_ids_added']:
+            group_ids.add(group_id)
+        elif user.id in snapshot['user_ids_removed']:
+            group_ids.discard(group_id)
+    return group_ids
+
+def _reconstruct(user_id, at):
+    user = _latest(get_user_model(), [user_id], at).get(user_id)
+    if user is None:
+        return None
+
+    groups = _latest(Group, _group_ids_at(user, at), at)
+    direct_role_ids = user.snapshot.get('role_ids', [])
+    group_role_ids = {role_id for group in groups.values() for role_id in group.snapshot.get('role_ids', [])}
+    roles = _latest(Role, set(direct_role_ids) | group_role_ids, at)
+
+    permission_ids = {pid for role in roles.values() for pid in role.snapshot.get('permission_ids', [])}
+    permissions = _latest(Permission, permission_ids, at)
+    codes = {record.code for record in permissions.values()}
+
+    return {
+        'user_id': user_id,
+        'username': user.username,
+        'at': at,
+        'is_active': user.is_active,
+        'is_superuser': user.is_superuser,
+        'roles': sorted(roles[role_id].name for role_id in direct_role_ids if role_id in roles),
+        'groups': sorted(group.name for group in groups.values()),
+        'permissions': sorted(codes),
+    }
+
+@lru_cache(maxsize=getattr(settings, 'RBAC_POINT_IN_TIME_CACHE_SIZE', 1024))
+def _cached_reconstruct(user_id, at, history_version):
+    # history_version only keys the entry: pruned or rewritten history is read again
+    return _reconstruct(user_id, at)
+
+def get_user_permissions_at(user_id, at):
+    """
+    The roles, groups and effective permission codes of a user at `at`, or
+    None if the user did not exist then. The result is shared: do not modify it.
+    """
+    if at >= timezone.now():
+        # The present can still change
+        return _reconstruct(user_id, at)
+    return _cached_reconstruct(user_id, at, cache_service.get_history_version())
+
+def clear_cache():
+    _cached_reconstruct.cache_clear()
+
+def get_cache_info():
+    return _cached_reconstruct.cache_info()._asdict()
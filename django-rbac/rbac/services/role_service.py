@@ -0,0 +1,15 @@
+from rbac.models import Role
+
+def create_role(name, description, permissions):
+    """Creates a new role with the given name, description, and permissions."""
+    role = Role.objects.create(name=name, description=description)
+    role.permissions.set(permissions)
+    return role
+
+def update_role(role, name=None, description=None, permissions=None):
+    """Updates the given role with the provided data."""
+    if name: role.name = name
+    if description: role.description = description
+    role.save()
+    if permissions is not None: role.permissions.set(permissions)
+    return role
@@ -0,0 +1,97 @@
+"""
+Many-to-many snapshots of the history records (the `snapshot` column of
+rbac.history.HistoricalSnapshot).
+
+A record gets its snapshot when it is created (pre_create_historical_record).
+Many-to-many changes add a '~' record carrying the new snapshot, dated at the
+change, so the latest record of an object at or before any date tells its
+assignments at that date (see point_in_time_service). The records of many
+objects are inserted together with bulk_history_create.
+"""
+from django.contrib.auth import get_user_model
+
+from rbac.models import Group, Role
+
+
+def role_snapshots(role_ids):
+    """{role_id: {'permissions': [codes], 'permission_ids': [ids]}} in one query."""
+    snapshots = {role_id: {'permissions': [], 'permission_ids': []} for role_id in role_ids}
+    rows = (
+        Role.permissions.through.objects
+        .filter(role_id__in=snapshots.keys())
+        .order_by('permission__code')
+        .values_list('role_id', 'permission_id', 'permission__code')
+    )
+    for role_id, permission_id, code in rows:
+        snapshots[role_id]['permissions'].append(code)
+        snapshots[role_id]['permission_ids'].append(permission_id)
+    return snapshots
+
+def group_snapshots(group_ids):
+    """{group_id: {'roles': [names], 'role_ids': [ids]}} in one query."""
+    snapshots = {group_id: {'roles': [], 'role_ids': []} for group_id in group_ids}
+    rows = (
+        Group.roles.through.objects
+        .filter(group_id__in=snapshots.keys())
+        .order_by('role__name')
+        .values_list('group_id', 'role_id', 'role__name')
+    )
+    for group_id, role_id, name in rows:
+        snapshots[group_id]['roles'].append(name)
+        snapshots[group_id]['role_ids'].append(role_id)
+    return snapshots
+
+def user_snapshots(user_ids):
+    """{user_id: {'roles': [names], 'role_ids': [ids], 'group_ids': [ids]}} in two queries."""
+    User = get_user_model()
+    snapshots = {user_id: {'roles': [], 'role_ids': [], 'group_ids': []} for user_id in user_ids}
+    roles = (
+        User.roles.through.objects
+        .filter(user_id__in=snapshots.keys())
+        .order_by('role__name')
+        .values_list('user_id', 'role_id', 'role__name')
+    )
+    for user_id, role_id, name in roles:
+        snapshots[user_id]['roles'].append(name)
+        snapshots[user_id]['role_ids'].append(role_id)
+    groups = (
+        User.groups.through.objects
+        .filter(user_id__in=snapshots.keys())
+        .order_by('group_id')
+        .values_list('user_id', 'group_id')
+    )
+    for user_id, group_id in groups:
+        snapshots[user_id]['group_ids'].append(group_id)
+    return snapshots
+
+def build_snapshot(instance):
+    """Snapshot of a Role, Group or User for a new history record."""
+    if isinstance(instance, Role):
+        snapshot = role_snapshots([instance.pk])[instance.pk]
+    elif isinstance(instance, Group):
+        snapshot = group_snapshots([instance.pk])[instance.pk]
+    elif isinstance(instance, get_user_model()):
+        snapshot = user_snapshots([instance.pk])[instance.pk]
+    else:
+        snapshot = {}
+    # Extra keys describing the change, e.g. the users added to a group
+    snapshot.update(getattr(instance, '_history_snapshot', {}))
+    return snapshot
+
+def record_snapshots(model, snapshots):
+    """Adds a '~' history record with the new snapshot of each object."""
+    if not snapshots:
+        return
+    instances = list(model.objects.filter(pk__in=snapshots.keys()))
+    for instance in instances:
+        instance._history_snapshot = snapshots[instance.pk]
+    model.history.bulk_history_create(instances, update=True)
+
+def record_roles(role_ids):
+    record_snapshots(Role, role_snapshots(role_ids))
+
+def record_groups(group_ids):
+    record_snapshots(Group, group_snapshots(group_ids))
+
+def record_users(user_ids):
+    record_snapshots(get_user_model(), user_snapshots(user_ids))
@@ -1,30 +1,135 @@
-import json
 from django.dispatch import receiver
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from simple_history.signals import pre_create_historical_record
 
-from .models import Role
+from .models import Role, Group, Permission
+from .services import cache_service, effective_permission_service, snapshot_service
 
 
+# Snapshots of the permissions of a role and the roles of a group, stored in
+# the `snapshot` column of their history records (see snapshot_service).
+@receiver(pre_create_historical_record)
+def add_m2m_snapshot(sender, instance, history_instance, **kwargs):
+    if isinstance(instance, (Role, Group)):
+        history_instance.snapshot = snapshot_service.build_snapshot(instance)
+
+
+# Assignment changes add a history record with the new snapshot to each changed
+# role or group. Reverse changes (permission.roles.add) carry the role ids in
+# pk_set; the ids of a reverse clear are captured on pre_clear by the effective
+# permission receivers below.
 @receiver(m2m_changed, sender=Role.permissions.through)
-def save_permissions_in_role_history(sender, instance, action, **kwargs):
+def save_permissions_in_role_history(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        snapshot_service.record_roles([instance.pk])
+    elif action == "post_clear":
+        snapshot_service.record_roles(getattr(instance, '_cleared_role_ids', []))
+    else:
+        snapshot_service.record_roles(pk_set)
+
+
+@receiver(m2m_changed, sender=Group.roles.through)
+def save_roles_in_group_history(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        snapshot_service.record_groups([instance.pk])
+    elif action == "post_clear":
+        snapshot_service.record_groups(getattr(instance, '_cleared_group_ids', []))
+    else:
+        snapshot_service.record_groups(pk_set)
+
+
+# Any change in the role/permission graph can affect many users at once:
+# bump the RBAC version instead of looking up who is affected.
+@receiver(m2m_changed, sender=Role.permissions.through)
+@receiver(m2m_changed, sender=Group.roles.through)
+def invalidate_permissions_on_m2m_change(sender, action, **kwargs):
     if action in ("post_add", "post_remove", "post_clear"):
-        # The 'instance' is the Role object whose permissions were changed.
-        
-        # Get the most recent historical record for this role.
-        # For a new role, this will be the '+' record created just before.
-        # For an updated role, this will be the '~' record.
-        latest_history = instance.history.first()
-        if not latest_history:
-            return
-
-        # Get the current, up-to-date list of permission codes.
-        current_permission_codes = list(instance.permissions.values_list('code', flat=True))
-        # Safely load any existing data from history_change_reason.
-        try:
-            data = json.loads(latest_history.history_change_reason or '{}')
-        except (json.JSONDecodeError, TypeError):
-            data = {}
-        # Update the permissions snapshot and save it back as JSON.
-        data['permissions'] = current_permission_codes
-        latest_history.history_change_reason = json.dumps(data)
-        latest_history.save(update_fields=['history_change_reason'])
+        cache_service.bump_rbac_version()
+
+
+# Deleting a role, group or permission removes its through rows without
+# sending m2m_changed. Renaming a permission code changes effective codes.
+@receiver(post_delete, sender=Role)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+@receiver(post_save, sender=Permission)
+def invalidate_permissions_on_change(sender, **kwargs):
+    cache_service.bump_rbac_version()
+
+
+# ----- Effective permission table (users.UserEffectivePermission) -----
+# Additions are applied directly as new rows (a new grant can only add
+# permissions). Removals are turned into the set of affected users, whose rows
+# are recomputed by delta (after the commit when there are many). Reverse clears do not report the cleared ids, so
+# they are captured on pre_clear.
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+def sync_effective_permissions_on_role_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # instance is the Role, pk_set holds permission ids
+        if action == "post_add":
+            user_ids = effective_permission_service.get_role_user_ids([instance.pk])
+            effective_permission_service.grant_permissions(user_ids, pk_set)
+        elif action in ("post_remove", "post_clear"):
+            effective_permission_service.schedule_sync(effective_permission_service.get_role_user_ids([instance.pk]))
+        return
+    # instance is the Permission, pk_set holds role ids
+    if action == "pre_clear":
+        instance._cleared_role_ids = list(instance.roles.values_list('id', flat=True))
+    elif action == "post_add":
+        user_ids = effective_permission_service.get_role_user_ids(pk_set)
+        effective_permission_service.grant_permissions(user_ids, [instance.pk])
+    elif action == "post_remove":
+        effective_permission_service.schedule_sync(effective_permission_service.get_role_user_ids(pk_set))
+    elif action == "post_clear":
+        role_ids = getattr(instance, '_cleared_role_ids', [])
+        effective_permission_service.schedule_sync(effective_permission_service.get_role_user_ids(role_ids))
+
+
+@receiver(m2m_changed, sender=Group.roles.through)
+def sync_effective_permissions_on_group_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # instance is the Group, pk_set holds role ids
+        if action == "post_add":
+            user_ids = effective_permission_service.get_group_user_ids([instance.pk])
+            effective_permission_service.grant_roles(user_ids, pk_set)
+        elif action in ("post_remove", "post_clear"):
+            effective_permission_service.schedule_sync(effective_permission_service.get_group_user_ids([instance.pk]))
+        return
+    # instance is the Role, pk_set holds group ids
+    if action == "pre_clear":
+        instance._cleared_group_ids = list(instance.groups.values_list('id', flat=True))
+    elif action == "post_add":
+        user_ids = effective_permission_service.get_group_user_ids(pk_set)
+        effective_permission_service.grant_roles(user_ids, [instance.pk])
+    elif action == "post_remove":
+        effective_permission_service.schedule_sync(effective_permission_service.get_group_user_ids(pk_set))
+    elif action == "post_clear":
+        group_ids = getattr(instance, '_cleared_group_ids', [])
+        effective_permission_service.schedule_sync(effective_permission_service.get_group_user_ids(group_ids))
+
+
+# Deleting a role or group drops its through rows without m2m_changed:
+# remember who held it, then recompute once it is gone.
+@receiver(pre_delete, sender=Role)
+def collect_role_users_before_delete(sender, instance, **kwargs):
+    instance._affected_user_ids = effective_permission_service.get_role_user_ids([instance.pk])
+
+@receiver(pre_delete, sender=Group)
+def collect_group_users_before_delete(sender, instance, **kwargs):
+    instance._affected_user_ids = effective_permission_service.get_group_user_ids([instance.pk])
+
+@receiver(post_delete, sender=Role)
+@receiver(post_delete, sender=Group)
+def sync_effective_permissions_on_delete(sender, instance, **kwargs):
+    effective_permission_service.schedule_sync(getattr(instance, '_affected_user_ids', []))
+
+
+@receiver(post_save, sender=Permission)
+def sync_effective_permission_code(sender, instance, created, **kwargs):
+    if not created:
+        effective_permission_service.rename_permission(instance)
@@ -1,3 +1,558 @@
-from django.test import TestCase
+import base64
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import m2m_changed
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from rbac.history import get_history_user, get_previous_record, prefetch_history, with_previous_record
+from rbac.models import Group, Permission, Role
+from rbac.pagination import HistoryCursorPagination
+from rbac.serializers import HistoricalRoleSerializer
+from rbac.services import (
+    assignment_service, cache_service, claims_service, effective_permission_service, history_export_service,
+    history_retention_service, permission_service, point_in_time_service,
+)
+from rbac.services.permission_service import AutoPermissionMixin, HasPermission
+from rbac.views import AllRoleHistoryListView, RoleHistoryListView
+from users.models import User, UserEffectivePermission
+from users.serializers import HistoricalUserSerializer
+from users.tokens import PermissionClaimsRefreshToken
+
+
+class RBACTestCase(TestCase):
+    def setUp(self):
+        self.view = Permission.objects.create(code='smoke.view', label='View')
+        self.edit = Permission.objects.create(code='smoke.edit', label='Edit')
+        self.role = Role.objects.create(name='Viewer')
+        self.role.permissions.add(self.view)
+        self.user = User.objects.create_user(
+            username='alice', email='alice@example.com', password='x', birthday='2000-01-01'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.roles.add(self.role)
+
+
+@override_settings(RBAC_PERMISSION_CACHE=True)
+class PermissionCacheTests(RBACTestCase):
+    def test_stale_reader_cannot_recache_after_user_change(self):
+        # A reader loads the codes, then the user's roles change before it caches them
+        versions = cache_service.get_versions(self.user.pk)
+        stale = permission_service.get_user_permission_codes(self.user.pk)
+        other = Role.objects.create(name='Editor')
+        other.permissions.add(self.edit)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.roles.add(other)
+        cache_service.set_user_permission_codes(self.user.pk, stale, versions)
+
+        self.assertEqual(
+            permission_service.get_user_permission_codes(self.user.pk), {'smoke.view', 'smoke.edit'}
+        )
+
+    @override_settings(RBAC_PERMISSION_CACHE=None)
+    def test_process_local_cache_is_not_used(self):
+        # A bump in one process would not reach the LocMemCache of the others
+        self.assertFalse(cache_service.is_enabled())
+        permission_service.get_user_permission_codes(self.user.pk)
+        # The version bump only runs on commit: like one made in another process, it is never seen here
+        self.role.permissions.remove(self.view)
+        self.assertEqual(permission_service.get_user_permission_codes(self.user.pk), frozenset())
+
+
+class GroupMembershipTests(RBACTestCase):
+    def test_one_history_entry_per_change(self):
+        group = Group.objects.create(name='Editors')
+        editor = Role.objects.create(name='Editor')
+        editor.permissions.add(self.edit)
+        group.roles.add(editor)
+        users = User.objects.bulk_create(
+            User(username=f'user{index}', email=f'user{index}@example.com', birthday='2000-01-01')
+            for index in range(5)
+        )
+        user_ids = [user.pk for user in users]
+        group_records, user_records = group.history.count(), User.history.count()
+        before = timezone.now()
+
+        with mock.patch.object(assignment_service, 'QUERY_CHUNK_SIZE', 2):
+            result = assignment_service.update_group_membership(group, add_ids=user_ids + [self.user.pk, 0])
+        self.assertEqual(len(result['added']), 6)
+        self.assertEqual(result['not_found'], [0])
+        self.assertEqual((group.history.count(), User.history.count()), (group_records + 1, user_records))
+        self.assertEqual(group.history.latest('history_id').snapshot['user_ids_added'], sorted(user_ids + [self.user.pk]))
+        self.assertFalse(hasattr(group, '_history_snapshot'))
+        self.assertEqual(
+            permission_service.get_user_permission_codes(self.user.pk), {'smoke.view', 'smoke.edit'}
+        )
+
+        result = assignment_service.update_group_membership(group, remove_ids=[self.user.pk])
+        self.assertEqual((result['removed'], result['skipped']), (['alice'], []))
+        self.assertEqual(list(group.users.values_list('pk', flat=True).order_by('pk')), sorted(user_ids))
+
+        # The member's groups at a date come from the group records
+        reconstructed = point_in_time_service._reconstruct(
+            self.user.pk, group.history.order_by('history_id')[group_records].history_date
+        )
+        self.assertEqual((reconstructed['groups'], reconstructed['permissions']), (['Editors'], ['smoke.edit', 'smoke.view']))
+        self.assertEqual(point_in_time_service._reconstruct(self.user.pk, timezone.now())['groups'], [])
+        self.assertEqual(point_in_time_service._reconstruct(self.user.pk, before)['groups'], [])
+
+
+class ResolvePermissionsTests(RBACTestCase):
+    def test_matches_the_single_user_resolution(self):
+        group = Group.objects.create(name='Editors')
+        editor = Role.objects.create(name='Editor')
+        editor.permissions.add(self.edit)
+        group.roles.add(editor)
+        users = [self.user] + [
+            User.objects.create_user(
+                username=f'user{index}', email=f'user{index}@example.com', password='x', birthday='2000-01-01'
+            )
+            for index in range(4)
+        ]
+        users[1].roles.add(self.role)
+        users[2].groups.add(group)
+        users[3].roles.add(self.role)
+        users[3].groups.add(group)
+
+        user_ids = [user.pk for user in users]
+        with mock.patch.object(permission_service, 'RESOLVE_CHUNK_SIZE', 2):
+            resolved = permission_service.resolve_user_permissions(user_ids + user_ids[:1])
+        self.assertEqual(resolved, {
+            user_id: set(permission_service.get_user_permission_codes(user_id)) for user_id in user_ids
+        })
+        self.assertEqual(resolved[users[3].pk], {'smoke.view', 'smoke.edit'})
+
+
+@override_settings(RBAC_EFFECTIVE_PERMISSIONS=True)
+class EffectivePermissionSyncTests(RBACTestCase):
+    def test_large_removal_is_synced_after_commit(self):
+        other = User.objects.create_user(
+            username='bob', email='bob@example.com', password='x', birthday='2000-01-01'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            other.roles.add(self.role)
+        self.assertEqual(UserEffectivePermission.objects.filter(permission=self.view).count(), 2)
+
+        with mock.patch.object(effective_permission_service, 'SYNC_INLINE_LIMIT', 1):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                self.role.permissions.remove(self.view)
+                self.assertEqual(UserEffectivePermission.objects.filter(permission=self.view).count(), 2)
+        self.assertTrue(callbacks)
+        self.assertFalse(UserEffectivePermission.objects.filter(permission=self.view).exists())
+
+    @override_settings(RBAC_EFFECTIVE_PERMISSIONS_READS=True, RBAC_PERMISSION_CACHE=True)
+    def test_permissions_read_before_a_deferred_sync_are_not_kept(self):
+        sync_users = effective_permission_service.sync_users
+
+        def read_then_sync(user_ids):
+            # A request between the commit (and its version bump) and the sync
+            permission_service.get_user_permission_codes(self.user.pk)
+            return sync_users(user_ids)
+
+        with mock.patch.object(effective_permission_service, 'SYNC_INLINE_LIMIT', 0), \
+                mock.patch.object(effective_permission_service, 'sync_users', side_effect=read_then_sync):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.role.permissions.remove(self.view)
+        self.assertEqual(permission_service.get_user_permission_codes(self.user.pk), frozenset())
+
+    def test_rebuild_in_batches(self):
+        for index in range(5):
+            User.objects.create_user(
+                username=f'user{index}', email=f'user{index}@example.com', password='x', birthday='2000-01-01'
+            )
+        UserEffectivePermission.objects.all().delete()
+        batches = list(effective_permission_service.iter_user_id_batches(batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+
+        effective_permission_service.rebuild(batch_size=2)
+        self.assertEqual(list(effective_permission_service.find_drift(batch_size=2)), [])
+        self.assertTrue(UserEffectivePermission.objects.filter(user=self.user, permission=self.view).exists())
+
+
+@override_settings(RBAC_EFFECTIVE_PERMISSIONS=True)
+class EffectivePermissionReadTests(RBACTestCase):
+    def get_codes(self):
+        cache_service._invalidate_user_permissions([self.user.pk])
+        return permission_service.get_user_permission_codes(self.user.pk)
+
+    def test_reads_resolve_roles_until_enabled(self):
+        UserEffectivePermission.objects.all().delete()
+        self.assertEqual(self.get_codes(), {'smoke.view'})
+        self.assertEqual(list(effective_permission_service.get_permission_holders('smoke.view')), [self.user])
+
+    @override_settings(RBAC_EFFECTIVE_PERMISSIONS_READS=True)
+    def test_reads_use_the_table_once_enabled(self):
+        self.assertEqual(self.get_codes(), {'smoke.view'})
+        UserEffectivePermission.objects.all().delete()
+        self.assertEqual(self.get_codes(), frozenset())
+        self.assertFalse(effective_permission_service.get_permission_holders('smoke.view').exists())
+
+    @override_settings(RBAC_EFFECTIVE_PERMISSIONS=False, RBAC_EFFECTIVE_PERMISSIONS_READS=True)
+    def test_reads_need_the_table_maintained(self):
+        UserEffectivePermission.objects.all().delete()
+        self.assertEqual(self.get_codes(), {'smoke.view'})
+
+
+class BulkAssignmentTests(RBACTestCase):
+    def test_pre_signals_see_the_state_before_the_change(self):
+        other = Role.objects.create(name='Other')
+        seen = []
+
+        def receiver(sender, instance, action, pk_set, **kwargs):
+            assigned = User.roles.through.objects.filter(role_id=instance.pk, user_id__in=pk_set).exists()
+            seen.append((action, assigned))
+
+        m2m_changed.connect(receiver, sender=User.roles.through)
+        try:
+            assignment_service.bulk_assign_roles([(self.user.pk, other.pk)])
+            assignment_service.bulk_remove_roles([(self.user.pk, other.pk)])
+        finally:
+            m2m_changed.disconnect(receiver, sender=User.roles.through)
+        self.assertEqual(seen, [
+            ('pre_add', False), ('post_add', True), ('pre_remove', True), ('post_remove', False),
+        ])
+
+    def test_large_requests_are_chunked(self):
+        users = User.objects.bulk_create(
+            User(username=f'user{index}', email=f'user{index}@example.com', birthday='2000-01-01')
+            for index in range(25)
+        )
+        pairs = [(user.pk, self.role.pk) for user in users]
+        chunks = []
+
+        def receiver(sender, action, pk_set, **kwargs):
+            if action == 'post_add':
+                chunks.append(len(pk_set))
+
+        m2m_changed.connect(receiver, sender=User.roles.through)
+        try:
+            with mock.patch.object(assignment_service, 'QUERY_CHUNK_SIZE', 10):
+                result = assignment_service.bulk_assign_roles(pairs)
+        finally:
+            m2m_changed.disconnect(receiver, sender=User.roles.through)
+        self.assertEqual(result['summary'], {'assigned': 25})
+        self.assertEqual(chunks, [10, 10, 5])
+        with mock.patch.object(assignment_service, 'QUERY_CHUNK_SIZE', 10):
+            result = assignment_service.bulk_remove_roles(pairs)
+        self.assertEqual(result['summary'], {'removed': 25})
+
+
+class HistoryExportTests(RBACTestCase):
+    def test_diff_base_follows_history_date(self):
+        now = timezone.now()
+        self.role.history.update(history_date=now - timedelta(hours=3))
+        self.role.name = 'Reader'
+        self.role.save()
+        renamed = self.role.history.latest('history_id')
+        Role.history.filter(pk=renamed.pk).update(history_date=now - timedelta(hours=1))
+        # The last record written is dated before the rename (e.g. a backdated bulk record)
+        self.role.name = 'Auditor'
+        self.role.save()
+        backdated = self.role.history.latest('history_id')
+        Role.history.filter(pk=backdated.pk).update(history_date=now - timedelta(hours=2))
+        self.role.name = 'Admin'
+        self.role.save()
+
+        records = history_export_service.iter_records(
+            'role', Role, since=now - timedelta(minutes=30), object_ids=[self.role.pk]
+        )
+        changes = [record['changes'] for record in records]
+        self.assertEqual(changes[-1]['name'], {'old': 'Reader', 'new': 'Admin'})
+
+    def test_assignment_changes_are_exported(self):
+        self.role.permissions.add(self.edit)
+        record = list(history_export_service.iter_records('role', Role, object_ids=[self.role.pk]))[-1]
+        self.assertEqual(
+            record['changes']['permissions'], {'old': ['smoke.view'], 'new': ['smoke.edit', 'smoke.view']}
+        )
+
+
+class HistoryChangesTests(RBACTestCase):
+    def test_assignment_changes_are_listed(self):
+        self.role.permissions.add(self.edit)
+        changes = HistoricalRoleSerializer(self.role.history.latest('history_id')).data['changes']
+        self.assertEqual(changes['permissions'], {'old': ['smoke.view'], 'new': ['smoke.edit', 'smoke.view']})
+
+        changes = HistoricalUserSerializer(self.user.history.latest('history_id')).data['changes']
+        self.assertIn({'field': 'roles', 'old': [], 'new': ['Viewer']}, changes)
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        for index in range(5):
+            Role.objects.create(name=f'Role {index}')
+        # Records written in the same instant: ties are broken by history_id
+        Role.history.update(history_date=timezone.now())
+        self.ids = list(Role.history.order_by('-history_id').values_list('history_id', flat=True))
+
+    def paginate(self, link='/history/?page_size=2', **params):
+        paginator = HistoryCursorPagination()
+        # Links keep page_size, params would replace their query string
+        request = Request(APIRequestFactory().get(link, params or None))
+        page = paginator.paginate_queryset(Role.history.all(), request)
+        return [record.history_id for record in page], paginator
+
+    def test_pages_forward_and_back_through_ties(self):
+        pages, links, link = [], [], '/history/?page_size=2'
+        while link and len(pages) < 5:
+            page, paginator = self.paginate(link)
+            pages.append(page)
+            links.append(paginator.get_previous_link())
+            link = paginator.get_next_link()
+        self.assertEqual(pages, [self.ids[0:2], self.ids[2:4], self.ids[4:]])
+        self.assertIsNone(links[0])
+
+        # Back from the last page, the same pages in the same order
+        page, paginator = self.paginate(links[2])
+        self.assertEqual(page, self.ids[2:4])
+        page, paginator = self.paginate(paginator.get_previous_link())
+        self.assertEqual(page, self.ids[0:2])
+        self.assertIsNone(paginator.get_previous_link())
+        self.assertEqual(self.paginate(paginator.get_next_link())[0], self.ids[2:4])
+
+    def test_cursor_encodes_the_position(self):
+        page, paginator = self.paginate()
+        cursor = parse_qs(urlparse(paginator.get_next_link()).query)['cursor'][0]
+        date, history_id, reverse = base64.urlsafe_b64decode(cursor).decode().split('|')
+        record = Role.history.get(history_id=page[-1])
+        self.assertEqual((date, int(history_id), reverse), (record.history_date.isoformat(), record.history_id, '0'))
+        self.assertIsNone(paginator.count)
+        self.assertEqual(self.paginate(page_size=2, count='true')[1].count, 5)
+        with self.assertRaises(NotFound):
+            self.paginate(cursor='not-a-cursor')
+
+
+class HistoryPageTests(RBACTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ('Reader', 'Auditor', 'Admin'):
+            self.role.name = name
+            self.role._history_user = self.user
+            self.role.save()
+        # Records saved within the same timestamp still chain on history_id
+        Role.history.update(history_date=timezone.now())
+
+    def test_previous_records_and_users_are_loaded_per_page(self):
+        queryset = with_previous_record(self.role.history.order_by('-history_date', '-history_id'))
+        records = prefetch_history(list(queryset))
+        with self.assertNumQueries(0):
+            previous = [get_previous_record(record) for record in records]
+            users = [get_history_user(record) for record in records]
+        ids = [record.history_id for record in records]
+        self.assertEqual([record and record.history_id for record in previous], ids[1:] + [None])
+        self.assertEqual(users[:3], [self.user] * 3)
+
+    def get(self, view_class, page_size, **kwargs):
+        request = APIRequestFactory().get('/history/', {'page_size': page_size})
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = view_class.as_view()(request, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_list_queries_do_not_depend_on_the_page_size(self):
+        User.objects.filter(pk=self.user.pk).update(is_superuser=True)
+        self.user.refresh_from_db()
+        small, small_queries = self.get(RoleHistoryListView, 2, pk=self.role.pk)
+        large, large_queries = self.get(RoleHistoryListView, 10, pk=self.role.pk)
+        self.assertEqual((len(small), len(large)), (2, 5))
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large[0]['changes']['name'], {'old': 'Auditor', 'new': 'Admin'})
+        self.assertEqual(large[0]['history_user'], str(self.user))
+
+        results, _ = self.get(AllRoleHistoryListView, 10)
+        self.assertEqual([result['history_id'] for result in results], [result['history_id'] for result in large])
+
+
+class BackfillSnapshotsTests(RBACTestCase):
+    def backfill(self):
+        call_command('backfill_history_snapshots', batch_size=1, stdout=StringIO())
+
+    def test_snapshots_are_moved_once(self):
+        role_record = self.role.history.earliest('history_id')
+        Role.history.filter(pk=role_record.pk).update(
+            snapshot={}, history_change_reason=json.dumps({'permissions': ['smoke.view', 'gone.code']}),
+        )
+        user_record = self.user.history.earliest('history_id')
+        User.history.filter(pk=user_record.pk).update(
+            snapshot={}, history_change_reason=json.dumps({'roles': ['Viewer'], 'groups': []}),
+        )
+        plain = self.role.history.latest('history_id')
+        Role.history.filter(pk=plain.pk).update(history_change_reason='{not a snapshot')
+        version = cache_service.get_history_version()
+
+        self.backfill()
+        role_record.refresh_from_db()
+        self.assertEqual(role_record.snapshot, {
+            'permissions': ['smoke.view', 'gone.code'], 'permission_ids': [self.view.pk],
+        })
+        self.assertIsNone(role_record.history_change_reason)
+        user_record.refresh_from_db()
+        self.assertEqual(user_record.snapshot, {'roles': ['Viewer'], 'groups': [], 'role_ids': [self.role.pk]})
+        plain.refresh_from_db()
+        self.assertEqual(plain.history_change_reason, '{not a snapshot')
+        self.assertNotEqual(cache_service.get_history_version(), version)
+        version = cache_service.get_history_version()
+
+        # Nothing left to convert: no write, the cached reconstructions stay valid
+        with CaptureQueriesContext(connection) as queries:
+            self.backfill()
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(cache_service.get_history_version(), version)
+
+
+class HistoryRetentionTests(RBACTestCase):
+    def setUp(self):
+        super().setUp()
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.config = {**history_retention_service.get_config(), 'ARCHIVE_DIR': archive_dir.name}
+
+    def rename(self, *names):
+        for name in names:
+            self.role.name = name
+            self.role.save()
+
+    def test_compaction_removes_no_op_records(self):
+        self.rename('Reader', 'Reader', 'Auditor')
+        names = [record.name for record in self.role.history.order_by('history_id')]
+        self.assertEqual(history_retention_service.compact(Role, self.config), 1)
+        self.assertEqual(
+            [record.name for record in self.role.history.order_by('history_id')],
+            names[:-2] + ['Auditor'],
+        )
+
+        # Only the changes made in quick succession collapse
+        Role.history.update(history_date=timezone.now() - timedelta(hours=1))
+        collapsing = {**self.config, 'COLLAPSE_SECONDS': 60}
+        self.rename('Editor', 'Admin')
+        history_retention_service.compact(Role, collapsing)
+        self.assertEqual(
+            [record.name for record in self.role.history.order_by('history_id')][-2:], ['Auditor', 'Admin']
+        )
+
+    def test_expiry_keeps_the_latest_record(self):
+        self.rename('Reader', 'Auditor')
+        Role.history.update(history_date=timezone.now() - timedelta(days=10))
+        latest = self.role.history.latest('history_id')
+        removed = history_retention_service.expire(Role, {'KEEP_DAYS': 1, 'KEEP_LAST': None}, self.config)
+        self.assertGreater(removed, 0)
+        self.assertEqual(list(self.role.history.all()), [latest])
+
+        self.rename('Admin')
+        self.assertEqual(history_retention_service.expire(Role, {'KEEP_LAST': 1}, self.config), 1)
+        self.assertEqual(self.role.history.get().name, 'Admin')
+
+    def test_removed_records_are_archived(self):
+        self.rename('Reader', 'Auditor')
+        ids = list(self.role.history.order_by('-history_id').values_list('history_id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            history_retention_service.expire(Role, {'KEEP_LAST': 1}, self.config)
+
+        archived = history_retention_service.ArchivedHistory(Role, config=self.config)
+        self.assertEqual([record.history_id for record in archived.iter()], ids[1:])
+        # Counted from the manifest, without reading the archives
+        with mock.patch.object(history_retention_service.ArchivedHistory, 'load', side_effect=AssertionError):
+            self.assertEqual(archived.count(), len(ids) - 1)
+        # Archives written before the manifest are counted once
+        manifest_path = f"{archived.directory}/{history_retention_service.MANIFEST}"
+        with open(manifest_path, 'w') as manifest:
+            manifest.write('{}')
+        self.assertEqual(archived.count(), len(ids) - 1)
+        self.rename('Admin')
+        history_retention_service.expire(Role, {'KEEP_LAST': 1}, self.config)
+        with mock.patch.object(history_retention_service.ArchivedHistory, 'load', side_effect=AssertionError):
+            self.assertEqual(archived.count(), len(ids))
+
+
+class PointInTimeCacheTests(RBACTestCase):
+    def test_rewritten_history_is_read_again(self):
+        at = timezone.now()
+        self.assertEqual(point_in_time_service.get_user_permissions_at(self.user.pk, at)['roles'], ['Viewer'])
+        # e.g. prune_history removing the records
+        self.user.history.all().delete()
+        self.assertEqual(point_in_time_service.get_user_permissions_at(self.user.pk, at)['roles'], ['Viewer'])
+        cache_service.bump_history_version()
+        self.assertIsNone(point_in_time_service.get_user_permissions_at(self.user.pk, at))
+
+
+class AutoPermissionTests(RBACTestCase):
+    class SmokeView(AutoPermissionMixin, APIView):
+        resource = 'smoke'
+        permission_code_map = {'POST': 'edit'}
+        permission_classes = [IsAuthenticated]
+
+    def check(self, method):
+        request = getattr(APIRequestFactory(), method.lower())('/')
+        request.user = User.objects.get(pk=self.user.pk)
+        request.auth = None
+        view = self.SmokeView()
+        view.request = request
+        permissions = view.get_permissions()
+        return [type(permission) for permission in permissions], all(
+            permission.has_permission(request, view) for permission in permissions
+        )
+
+    def test_actions_map_to_permission_codes(self):
+        self.assertTrue(self.check('GET')[1])  # Default map: smoke.view
+        self.assertFalse(self.check('POST')[1])  # Custom map: smoke.edit
+        self.assertFalse(self.check('DELETE')[1])  # smoke.delete
+
+    def test_unmapped_actions_use_the_permission_classes(self):
+        self.assertEqual(self.check('OPTIONS'), ([IsAuthenticated], True))
+
+
+class PermissionPlanTests(TestCase):
+    def get_codes(self, view_class, action):
+        return [permission.required_permissions for permission in view_class.get_permission_plan(view_class())[action]]
+
+    def test_subclasses_compile_their_own_plan(self):
+        class ParentView(AutoPermissionMixin):
+            resource = 'thing'
+            permission_code_map = {'list': 'browse'}
+
+        class ChildView(ParentView):
+            permission_code_map = {'list': 'index'}
+
+        self.assertEqual(self.get_codes(ParentView, 'list'), [('thing.browse',)])
+        self.assertEqual(self.get_codes(ChildView, 'list'), [('thing.index',)])
+        self.assertIs(ParentView.get_permission_plan(ParentView()), ParentView.get_permission_plan(ParentView()))
+
+
+@override_settings(RBAC_JWT_PERMISSION_CLAIMS=True, RBAC_PERMISSION_CACHE=True)
+class PermissionClaimsTests(RBACTestCase):
+    def get_token(self):
+        return PermissionClaimsRefreshToken.for_user(self.user).access_token
+
+    def test_bitmap_round_trip(self):
+        bitmap = claims_service.decode_bitmap(claims_service.encode_bitmap([0, 3, 70]))
+        self.assertEqual(bitmap, 1 | 1 << 3 | 1 << 70)
+        self.assertEqual(claims_service.decode_bitmap(claims_service.encode_bitmap([])), 0)
+
+    def test_current_claims_are_checked_without_queries(self):
+        token = self.get_token()
+        with self.assertNumQueries(0):
+            self.assertTrue(claims_service.check_token_permissions(token, ['smoke.view']))
+            self.assertFalse(claims_service.check_token_permissions(token, ['smoke.view', 'smoke.edit']))
+
+    def test_stale_claims_fall_back_to_the_database(self):
+        token = self.get_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.role.permissions.add(self.edit)
+        self.assertIsNone(claims_service.check_token_permissions(token, ['smoke.edit']))
+
+        request = mock.Mock(user=User.objects.get(pk=self.user.pk), auth=token)
+        self.assertTrue(HasPermission.with_perms('smoke.edit')().has_permission(request, None))
@@ -4,6 +4,9 @@ from .views import *
 urlpatterns = [
     # Permissions
     path('permissions/', PermissionListView.as_view(), name='permission-list'),
+    path('permissions/resolve/', PermissionResolveView.as_view(), name='permission-resolve'),
+    path('permissions/at/', PermissionsAtView.as_view(), name='permission-at'),
+    path('permissions/<str:code>/users/', PermissionHoldersListView.as_view(), name='permission-holders'),
     path('permissions/<int:pk>/', PermissionRetrieveUpdateView.as_view(), name='permission-ru'),
     path('permissions/history/<int:pk>/', PermissionHistoryListView.as_view(), name='permission-history-detail'),
     path('permissions/history/', AllPermissionHistoryListView.as_view(), name='permission-history-list'),
@@ -21,7 +24,12 @@ urlpatterns = [
     path('groups/history/', AllGroupHistoryListView.as_view(), name='group-history-list'),
     path('groups/<int:group_id>/users/', GroupUsersListView.as_view(), name='group-users-list'),
 
+    # History export
+    path('history/export/', HistoryExportView.as_view(), name='history-export'),
+
     # Assignations
+    path('roles/assign/bulk/', BulkAssignRolesView.as_view(), name='bulk-assign-roles'),
+    path('roles/remove/bulk/', BulkRemoveRolesView.as_view(), name='bulk-remove-roles'),
     path('roles/assign/<int:user_id>/', AssignRoleToUserView.as_view(), name='assign-role'),
     path('roles/remove/<int:user_id>/', RemoveRoleFromUserView.as_view(), name='remove-role'),
     path('groups/add_user/<int:group_id>/', AddUserToGroupView.as_view(), name='add-user-to-group'),
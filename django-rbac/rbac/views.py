@@ -1,15 +1,19 @@
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework import generics, status
 from rest_framework.response import Response
 
 from .models import Group, Role, Permission
 from .serializers import *
-from .services.permission_service import (
-    AutoPermissionMixin, role_service, 
-    group_service, assignment_service
-)
+from .services.permission_service import AutoPermissionMixin, resolve_user_permissions
+from .pagination import HistoryCursorPagination
+from .history import filter_snapshot, with_previous_record, prefetch_history
+from .services import role_service, group_service, assignment_service, effective_permission_service, history_export_service, point_in_time_service
+from .services.history_retention_service import ArchivedHistory
 
 from django.contrib.auth import get_user_model
-from drf_spectacular.utils import extend_schema_view, extend_schema
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter
 
 User = get_user_model()
 
@@ -27,6 +31,65 @@ class PermissionRetrieveUpdateView(AutoPermissionMixin, generics.RetrieveUpdateA
     serializer_class = PermissionSerializer
     resource = "permission"
 
+@extend_schema(tags=["Permissions"])
+class PermissionResolveView(AutoPermissionMixin, generics.GenericAPIView):
+    """
+    Returns the effective permission codes of many users at once,
+    with a fixed number of queries whatever the number of users.
+    """
+    serializer_class = PermissionResolveSerializer
+    resource = "permission"
+    permission_code_map = {'POST': 'resolve'}
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = list(dict.fromkeys(serializer.validated_data['user_ids']))
+
+        existing_ids = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        permissions = resolve_user_permissions(existing_ids)
+        return Response({
+            "results": [
+                {"user_id": user_id, "permissions": sorted(permissions[user_id])}
+                for user_id in user_ids if user_id in existing_ids
+            ],
+            "not_found": [user_id for user_id in user_ids if user_id not in existing_ids],
+        }, status=status.HTTP_200_OK)
+
+@extend_schema(parameters=[PermissionsAtQuerySerializer], responses=PermissionsAtSerializer, tags=["Permissions"])
+class PermissionsAtView(AutoPermissionMixin, generics.GenericAPIView):
+    """
+    Returns the roles, groups and effective permissions a user had at a past
+    date, rebuilt from the history tables.
+    """
+    serializer_class = PermissionsAtSerializer
+    resource = "permission"
+    permission_code_map = {'GET': 'resolve_at'}
+
+    def get(self, request, *args, **kwargs):
+        query = PermissionsAtQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        result = point_in_time_service.get_user_permissions_at(
+            query.validated_data['user_id'], query.validated_data['at']
+        )
+        if result is None:
+            return Response({"detail": "User did not exist at this date."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(result).data, status=status.HTTP_200_OK)
+
+@extend_schema(tags=["Permissions"])
+class PermissionHoldersListView(AutoPermissionMixin, generics.ListAPIView):
+    """
+    Lists the users holding a permission code, through direct roles or group roles.
+    Backed by the denormalized effective permission table.
+    """
+    serializer_class = UserMinimalSerializer
+    resource = "permission"
+    permission_code_map = {'GET': 'holders'}
+
+    def get_queryset(self):
+        permission = get_object_or_404(Permission, code=self.kwargs['code'])
+        return effective_permission_service.get_permission_holders(permission.code).order_by('id')
+
 # ----- Roles CRUD -----
 @extend_schema(tags=["Roles"])
 class RoleListCreateView(AutoPermissionMixin, generics.ListCreateAPIView):
@@ -98,10 +161,31 @@ class BaseRoleAssignmentView(AutoPermissionMixin, generics.GenericAPIView):
 
         if self.action_type == "assign":
             return assignment_service.assign_role_to_user(user_id, role_id)
-        elif self.action_type == "remove":
-            return assignment_service.remove_role_from_user(user_id, role_id)
+        return assignment_service.remove_role_from_user(user_id, role_id)
 
-        return Response({"detail": message}, status=status.HTTP_200_OK)
+class BaseBulkRoleAssignmentView(AutoPermissionMixin, generics.GenericAPIView):
+    """
+    Base class to assign/remove many roles to/from many users in one request.
+    Subclasses define `action_type` as "assign" or "remove".
+    """
+    serializer_class = BulkRoleAssignmentSerializer
+    resource = 'rbac'
+    action_type = None  # "assign" or "remove"
+    permission_suffix = None  # ex: "assign_role" or "remove_role"
+
+    def get_permission_code_map(self):
+        return {'POST': f"{self.permission_suffix}"}
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        pairs = serializer.validated_data['assignments']
+
+        if self.action_type == "assign":
+            result = assignment_service.bulk_assign_roles(pairs)
+        else:
+            result = assignment_service.bulk_remove_roles(pairs)
+        return Response(result, status=status.HTTP_200_OK)
 
 class BaseUserGroupView(AutoPermissionMixin, generics.GenericAPIView):
     """
@@ -125,14 +209,7 @@ class BaseUserGroupView(AutoPermissionMixin, generics.GenericAPIView):
         users = serializer.validated_data['user_ids']
         if self.action_type == 'add':
             return assignment_service.add_user_to_group(group.id, users)
-        elif self.action_type == 'remove':
-            return assignment_service.remove_user_from_group(group.id, users)
-
-        status_code = 200 if added else 409
-        action_word = "added" if self.action_type == 'add' else "removed"
-        message = f"Users {action_word}: {added}" if added else f"No users {action_word}; skipped: {skipped}"
-    
-        return Response({"detail": message}, status=status_code)
+        return assignment_service.remove_user_from_group(group.id, users)
 
 @extend_schema(tags=["Assignments"])
 class AssignRoleToUserView(BaseRoleAssignmentView):
@@ -145,6 +222,17 @@ class RemoveRoleFromUserView(BaseRoleAssignmentView):
     permission_suffix = "remove_role"
 
 
+@extend_schema(tags=["Assignments"])
+class BulkAssignRolesView(BaseBulkRoleAssignmentView):
+    action_type = "assign"
+    permission_suffix = "assign_role"
+
+@extend_schema(tags=["Assignments"])
+class BulkRemoveRolesView(BaseBulkRoleAssignmentView):
+    action_type = "remove"
+    permission_suffix = "remove_role"
+
+
 @extend_schema(tags=["Assignments"])
 class AddUserToGroupView(BaseUserGroupView):
     action_type = 'add'
@@ -163,15 +251,36 @@ class BaseHistoryListView(generics.ListAPIView):
     """
     Base view to handle historical listing by primary key (for single object)
     or for all objects if `get_all` is set to True.
+    The previous records and history users of a page are loaded together,
+    so a page takes the same few queries whatever its size.
+    With ?archived=true, lists the records archived by prune_history instead.
     """
     model = None  # Must be defined in subclass
     get_all = False
+    pagination_class = HistoryCursorPagination
+    # Query parameter -> snapshot list it filters on, e.g. {'permission': 'permissions'}
+    snapshot_filters = {}
 
     def get_queryset(self):
+        filters = {key: self.request.query_params.get(param) for param, key in self.snapshot_filters.items()}
+        filters = {key: value for key, value in filters.items() if value}
+        if self.request.query_params.get('archived', '').lower() in ('true', '1'):
+            object_id = None if self.get_all else self.kwargs['pk']
+            return ArchivedHistory(self.model, object_id=object_id, snapshot_filters=filters)
+
         if self.get_all:
-            return self.model.history.all().order_by('-history_date')
-        obj_pk = self.kwargs['pk']
-        return self.model.history.filter(id=obj_pk).order_by('-history_date')
+            queryset = self.model.history.all()
+        else:
+            queryset = self.model.history.filter(id=self.kwargs['pk'])
+        for key, value in filters.items():
+            queryset = filter_snapshot(queryset, key, value)
+        return with_previous_record(queryset.order_by('-history_date'))
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if isinstance(queryset, ArchivedHistory):
+            return queryset.prefetch(page)
+        return prefetch_history(page)
 
     # Permissions
 @extend_schema(tags=["Permissions"])
@@ -190,30 +299,88 @@ class AllPermissionHistoryListView(AutoPermissionMixin, BaseHistoryListView):
     resource = "permission_history"
 
     # Roles
-@extend_schema(tags=["Roles"])
+ROLE_HISTORY_PARAMETERS = [
+    OpenApiParameter(
+        name='permission',
+        type=str,
+        location=OpenApiParameter.QUERY,
+        description='Only show the records where the role held this permission code'
+    ),
+]
+
+@extend_schema(parameters=ROLE_HISTORY_PARAMETERS, tags=["Roles"])
 class RoleHistoryListView(AutoPermissionMixin, BaseHistoryListView):
     # Retrieves the change history for a specific role.
     serializer_class = HistoricalRoleSerializer
     model = Role
     resource = "role_history"
+    snapshot_filters = {'permission': 'permissions'}
 
-@extend_schema_view(get=extend_schema(operation_id="all_role_history", tags=["Roles"]))
-class AllRoleHistoryListView(AutoPermissionMixin, generics.ListAPIView):
+@extend_schema_view(get=extend_schema(operation_id="all_role_history", parameters=ROLE_HISTORY_PARAMETERS, tags=["Roles"]))
+class AllRoleHistoryListView(AutoPermissionMixin, BaseHistoryListView):
     serializer_class = HistoricalRoleSerializer
+    get_all = True
+    model = Role
     resource = "role_history"
-    queryset = Role.history.all().order_by('-history_date')
+    snapshot_filters = {'permission': 'permissions'}
 
     # Groups
-@extend_schema(tags=["Groups"])
+ROLE_SNAPSHOT_PARAMETERS = [
+    OpenApiParameter(
+        name='role',
+        type=str,
+        location=OpenApiParameter.QUERY,
+        description='Only show the records where this role (name) was assigned'
+    ),
+]
+
+@extend_schema(parameters=ROLE_SNAPSHOT_PARAMETERS, tags=["Groups"])
 class GroupHistoryListView(AutoPermissionMixin, BaseHistoryListView):
     # Retrieves the change history for a specific Group.
     serializer_class = HistoricalGroupSerializer
     model = Group
     resource = "group_history"
+    snapshot_filters = {'role': 'roles'}
 
 @extend_schema_view(get=extend_schema( operation_id="all_group_history" ))
-@extend_schema(tags=["Groups"])
-class AllGroupHistoryListView(AutoPermissionMixin, generics.ListAPIView):
+@extend_schema(parameters=ROLE_SNAPSHOT_PARAMETERS, tags=["Groups"])
+class AllGroupHistoryListView(AutoPermissionMixin, BaseHistoryListView):
     serializer_class = HistoricalGroupSerializer
+    get_all = True
+    model = Group
     resource = "group_history"
-    queryset = Group.history.all().order_by('-history_date')
\ No newline at end of file
+    snapshot_filters = {'role': 'roles'}
+
+
+# ----- History export -----
+@extend_schema(
+    parameters=[HistoryExportSerializer],
+    responses={(200, 'application/x-ndjson'): OpenApiTypes.BINARY, (200, 'text/csv'): OpenApiTypes.BINARY},
+    tags=["History"]
+)
+class HistoryExportView(AutoPermissionMixin, generics.GenericAPIView):
+    """
+    Streams the audit trail (user, role, group and permission history) as
+    NDJSON or CSV, optionally gzip-compressed, with the changes of each record.
+    The export is read through a database cursor and never held in memory.
+    """
+    serializer_class = HistoryExportSerializer
+    resource = 'rbac'
+    permission_code_map = {'GET': 'export_history'}
+    pagination_class = None
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        fmt, compress = data['output'], data['gzip']
+
+        stream = history_export_service.export(
+            models=data.get('model'), fmt=fmt, compress=compress,
+            since=data.get('since'), until=data.get('until'), object_ids=data.get('object_id'),
+        )
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(stream, content_type='application/gzip' if compress else content_type)
+        filename = history_export_service.get_filename(fmt, compress)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
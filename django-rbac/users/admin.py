@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User
+from .models import User, LoginEvent, OutboundEmail
 
 from simple_history.admin import SimpleHistoryAdmin
 # Import the token models from simplejwt
@@ -33,6 +33,22 @@ class CustomUserAdmin(SimpleHistoryAdmin, UserAdmin):
 
 
 
+@admin.register(LoginEvent)
+class LoginEventAdmin(admin.ModelAdmin):
+    list_display = ('timestamp', 'user', 'ip_address', 'user_agent')
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'ip_address')
+    ordering = ('-timestamp',)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'expires_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    exclude = ('secret',)  # Sealed OTP
+    ordering = ('-created_at',)
+
+
 # This code registers the AuditLog model with the Django admin interface.
 # It customizes the admin display for AuditLog entries:
 # - Shows columns: timestamp, user, action, and details in the list view.
@@ -0,0 +1,112 @@
+from functools import lru_cache
+
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from rbac.services import permission_service
+from .services import user_service
+
+
+@lru_cache(maxsize=None)
+def get_user_field_names():
+    return frozenset(
+        name for field in get_user_model()._meta.concrete_fields for name in (field.name, field.attname)
+    )
+
+
+class StatelessUser(TokenUser):
+    """
+    Lightweight user built from the access token claims and the cached user state.
+    The full User row is only loaded (once) when a view touches an attribute
+    or method the claims don't provide, e.g. ORM fields or set_password().
+    Writes to model fields go to that User row too, so save() persists them.
+    """
+
+    def __init__(self, token, state):
+        super().__init__(token)
+        # Set on the proxy itself: forwarding them would load the User row
+        self.__dict__.update(
+            is_active=state['is_active'], is_staff=state['is_staff'], is_superuser=state['is_superuser'],
+        )
+
+    def __str__(self):
+        return self.username
+
+    @cached_property
+    def db_user(self):
+        return user_service.get_user_by_id(self.pk)
+
+    @cached_property
+    def username(self):
+        return self.token.get('username') or self.db_user.username
+
+    @cached_property
+    def permission_codes(self) -> frozenset:
+        return permission_service.get_user_permission_codes(self.pk)
+
+    def has_permission(self, code: str) -> bool:
+        return code in self.permission_codes
+
+    # Model-backed operations are delegated to the real User instance
+    @property
+    def groups(self):
+        return self.db_user.groups
+
+    @property
+    def user_permissions(self):
+        return self.db_user.user_permissions
+
+    def save(self, *args, **kwargs):
+        return self.db_user.save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.db_user.delete(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        return self.db_user.set_password(raw_password)
+
+    def check_password(self, raw_password):
+        return self.db_user.check_password(raw_password)
+
+    def __setattr__(self, attr, value):
+        if attr in get_user_field_names():
+            setattr(self.db_user, attr, value)
+            if attr in self.__dict__:
+                # Keep the claim-backed copy in step
+                self.__dict__[attr] = value
+            return
+        super().__setattr__(attr, value)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.db_user, attr)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that does not fetch the User row on every request.
+    is_active and the admin flags are checked through the user-state cache,
+    which is dropped whenever the user is saved (including soft deletes).
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        state = user_service.get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return StatelessUser(validated_token, state)
@@ -0,0 +1,80 @@
+"""
+Benchmark of the login endpoint throughput.
+Compares the current TokenObtainPairView (one authentication per login) with
+the previous behaviour (validating the credentials a second time after
+super().post()). Logins go through the view directly, without the HTTP stack.
+The login throttles are disabled for the run: every login comes from the same
+client and username. A temporary user is created for the run and removed
+afterwards, history included.
+"""
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from rest_framework.test import APIRequestFactory
+
+from users.models import User
+from users.services import hashing_service
+from users.views import TokenObtainPairView
+
+
+class LegacyTokenObtainPairView(TokenObtainPairView):
+    # Previous TokenObtainPairView.post, kept for comparison
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        if response.status_code == 200:
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+        return response
+
+
+class Command(BaseCommand):
+    help = "Benchmark the login (token obtain) endpoint"
+
+    PASSWORD = 'Bench@login1'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Logins per variant.")
+        parser.add_argument('--threads', type=int, default=1, help="Concurrent logins.")
+
+    def handle(self, *args, **options):
+        iterations, threads = options['iterations'], options['threads']
+        user = User(username=f"bench-{uuid.uuid4().hex[:12]}", first_name='Bench', last_name='Login',
+                    birthday='2000-01-01')
+        user.email = f"{user.username}@example.com"
+        user.set_password(self.PASSWORD)
+        user.save()
+        factory = APIRequestFactory()
+
+        def login(view):
+            request = factory.post('/api/login/', {'username': user.username, 'password': self.PASSWORD}, format='json')
+            try:
+                response = view(request)
+                if response.status_code != 200:
+                    raise CommandError(f"Login failed: {response.data}")
+            finally:
+                close_old_connections()
+
+        try:
+            self.stdout.write(f"{iterations} logins, {threads} thread(s), "
+                              f"{hashing_service.get_config()['EXECUTOR']} hashing executor")
+            self.stdout.write(f"{'variant':<12}{'total (s)':>12}{'logins/s':>12}{'ms/login':>12}")
+            results = {}
+            for name, view_class in (('before', LegacyTokenObtainPairView), ('after', TokenObtainPairView)):
+                view = view_class.as_view(throttle_classes=[])
+                login(view)  # Warm up
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    list(executor.map(lambda _: login(view), range(iterations)))
+                elapsed = time.perf_counter() - started
+                results[name] = elapsed
+                self.stdout.write(
+                    f"{name:<12}{elapsed:>12.2f}{iterations / elapsed:>12.1f}{elapsed / iterations * 1000:>12.1f}"
+                )
+            self.stdout.write(self.style.SUCCESS(f"✔️  Speedup: {results['before'] / results['after']:.2f}x"))
+        finally:
+            user_id = user.pk
+            user.delete()
+            User.history.filter(id=user_id).delete()
@@ -0,0 +1,89 @@
+"""
+Benchmark of the token refresh endpoint throughput.
+Compares the blacklist check against the database (TOKEN_BLACKLIST_CACHE
+disabled) with the cached blacklist. Refreshes go through the view directly,
+without the HTTP stack, each with its own refresh token, so every refresh also
+blacklists the token it rotates. A temporary user is created for the run, with
+--blacklisted expired-later tokens already blacklisted, and removed afterwards
+with its tokens and history.
+"""
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.views import TokenRefreshView
+
+from users.models import User
+from users.services import token_blacklist_service
+from users.tokens import PermissionClaimsRefreshToken
+
+
+class Command(BaseCommand):
+    help = "Benchmark the token refresh endpoint, with and without the cached blacklist"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help="Refreshes per variant.")
+        parser.add_argument('--threads', type=int, default=1, help="Concurrent refreshes.")
+        parser.add_argument('--blacklisted', type=int, default=10000,
+                            help="Tokens blacklisted beforehand, to size the blacklist tables.")
+
+    def handle(self, *args, **options):
+        iterations, threads = options['iterations'], options['threads']
+        user = User(username=f"bench-{uuid.uuid4().hex[:12]}", first_name='Bench', last_name='Refresh',
+                    birthday='2000-01-01')
+        user.email = f"{user.username}@example.com"
+        user.set_unusable_password()
+        user.save()
+        factory = APIRequestFactory()
+        view = TokenRefreshView.as_view()
+
+        def refresh(token):
+            request = factory.post('/api/token/refresh/', {'refresh': token}, format='json')
+            try:
+                response = view(request)
+                if response.status_code != 200:
+                    raise CommandError(f"Refresh failed: {response.data}")
+            finally:
+                close_old_connections()
+
+        try:
+            expires_at = timezone.now() + timedelta(days=1)
+            outstanding = OutstandingToken.objects.bulk_create(
+                OutstandingToken(user=user, jti=uuid.uuid4().hex, token='', expires_at=expires_at)
+                for _ in range(options['blacklisted'])
+            )
+            BlacklistedToken.objects.bulk_create(BlacklistedToken(token=token) for token in outstanding)
+
+            self.stdout.write(f"{iterations} refreshes, {threads} thread(s), "
+                              f"{options['blacklisted']} blacklisted tokens")
+            self.stdout.write(f"{'variant':<12}{'total (s)':>12}{'refresh/s':>12}{'ms/refresh':>12}")
+            results = {}
+            for name, enabled in (('database', False), ('cache', True)):
+                config = {**getattr(settings, 'TOKEN_BLACKLIST_CACHE', {}), 'ENABLED': enabled}
+                with override_settings(TOKEN_BLACKLIST_CACHE=config):
+                    if enabled:
+                        token_blacklist_service.rebuild()
+                    tokens = [str(PermissionClaimsRefreshToken.for_user(user)) for _ in range(iterations + 1)]
+                    refresh(tokens.pop())  # Warm up
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=threads) as executor:
+                        list(executor.map(refresh, tokens))
+                    elapsed = time.perf_counter() - started
+                results[name] = elapsed
+                self.stdout.write(
+                    f"{name:<12}{elapsed:>12.2f}{iterations / elapsed:>12.1f}{elapsed / iterations * 1000:>12.1f}"
+                )
+            self.stdout.write(self.style.SUCCESS(f"✔️  Speedup: {results['database'] / results['cache']:.2f}x"))
+        finally:
+            user_id = user.pk
+            OutstandingToken.objects.filter(user_id=user_id).delete()
+            user.delete()
+            User.history.filter(id=user_id).delete()
@@ -1,15 +1,59 @@
+"""
+Management command to purge the expired refresh tokens: the expired
+blacklisted tokens, then the expired outstanding tokens (see
+users.services.token_flush_service). Rows are deleted in batches of primary
+keys, optionally spaced out with --sleep. Run it periodically (e.g. from
+cron), or with --loop as a long-running process.
+"""
+import time
+
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from django.db import close_old_connections
+
+from users.services import token_flush_service
+
 
 class Command(BaseCommand):
-    help = 'Deletes all expired tokens from the blacklist.'
+    help = 'Deletes the expired tokens from the blacklist and the outstanding token list.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Rows per batch (default: TOKEN_FLUSH['BATCH_SIZE']).")
+        parser.add_argument('--sleep', type=float, default=None,
+                            help="Seconds to pause between batches (default: TOKEN_FLUSH['SLEEP']).")
+        parser.add_argument('--dry-run', action='store_true', help="Count the expired tokens without deleting them.")
+        parser.add_argument('--loop', action='store_true', help="Keep purging instead of exiting.")
+        parser.add_argument('--interval', type=float, default=3600,
+                            help="Seconds between purges (with --loop).")
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.NOTICE('Flushing expired tokens...'))
-        
-        expired_tokens = BlacklistedToken.objects.filter(token__expires_at__lt=timezone.now())
-        count = expired_tokens.count()
-        expired_tokens.delete()
-        
-        self.stdout.write(self.style.SUCCESS(f'✔️  Successfully flushed {count} expired tokens.'))
\ No newline at end of file
+        if not options['loop']:
+            self.flush(options)
+            return
+
+        self.stdout.write(self.style.NOTICE("Flushing expired tokens periodically (Ctrl+C to stop)..."))
+        try:
+            while True:
+                self.flush(options)
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("⚠️  Stopped."))
+
+    def flush(self, options):
+        dry_run = options['dry_run']
+        self.stdout.write(self.style.NOTICE('Counting expired tokens...' if dry_run else 'Flushing expired tokens...'))
+
+        def progress(model, removed, elapsed):
+            rate = removed / elapsed if elapsed else 0
+            self.stdout.write(f"  {model._meta.model_name}: {removed} ({rate:.0f} rows/s)")
+
+        started = time.monotonic()
+        counts = token_flush_service.flush_expired(
+            dry_run=dry_run, batch_size=options['batch_size'], sleep=options['sleep'], progress=progress,
+        )
+        verb = 'would be deleted' if dry_run else 'deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"✔️  {counts['blacklisted']} blacklisted and {counts['outstanding']} outstanding expired tokens "
+            f"{verb} in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,73 @@
+"""
+Management command to import users in bulk from a CSV or JSONL file.
+The file is streamed in chunks (see users.services.import_service): invalid
+rows are reported and skipped, valid ones are inserted with bulk_create.
+"""
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.services import import_service
+
+
+class Command(BaseCommand):
+    help = "Import users from a CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import ('-' for stdin).")
+        parser.add_argument('--format', choices=import_service.FORMATS,
+                            help="File format (guessed from the extension by default).")
+        parser.add_argument('--chunk-size', type=int, default=import_service.CHUNK_SIZE,
+                            help="Number of rows validated and inserted per transaction.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Password hashing processes (default: CPU count, 0 hashes inline).")
+        parser.add_argument('--skip-password-validation', action='store_true',
+                            help="Do not run AUTH_PASSWORD_VALIDATORS on imported passwords.")
+        parser.add_argument('--errors', help="Write the row errors to this file (JSONL).")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or import_service.detect_format(options['path'])
+        if not fmt:
+            raise CommandError("Cannot guess the file format, use --format.")
+
+        self.stdout.write(self.style.NOTICE(f"Importing users from {options['path']}..."))
+
+        def progress(report):
+            self.stdout.write(f"  {report['created']} created, {report['failed']} failed")
+
+        errors_file = open(options['errors'], 'w', encoding='utf-8') if options['errors'] else None
+
+        def write_errors(errors):
+            for error in errors:
+                errors_file.write(json.dumps(error) + '\n')
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8-sig', newline='')
+        try:
+            with import_service.UserImporter(
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                validate_passwords=not options['skip_password_validation'],
+            ) as importer:
+                report = importer.run(
+                    import_service.read_rows(stream, fmt),
+                    progress=progress,
+                    on_errors=write_errors if errors_file else None,
+                )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if errors_file:
+                errors_file.close()
+
+        if not errors_file:
+            for error in report['errors']:
+                self.stdout.write(self.style.ERROR(f"  line {error['line']}: {json.dumps(error['errors'])}"))
+            if report['failed'] > len(report['errors']):
+                self.stdout.write(self.style.ERROR(
+                    f"  ... and {report['failed'] - len(report['errors'])} more (use --errors to write them all)"
+                ))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✔️  Import finished: {report['created']} users created, {report['failed']} rows rejected."
+        ))
@@ -0,0 +1,43 @@
+"""
+Worker reloading the cached refresh token blacklist (TOKEN_BLACKLIST_CACHE)
+from the database, so that refreshes never rebuild it themselves (see
+users.services.token_blacklist_service). Run it with --loop as a long-running
+process: each rebuild keeps the cache complete for twice REBUILD_SECONDS, and
+refreshes check the database while it is not.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from users.services import token_blacklist_service
+
+
+class Command(BaseCommand):
+    help = "Reload the cached refresh token blacklist from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep rebuilding instead of exiting.")
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Seconds between rebuilds, with --loop "
+                                 "(default: TOKEN_BLACKLIST_CACHE['REBUILD_SECONDS']).")
+
+    def handle(self, *args, **options):
+        config = token_blacklist_service.get_config()
+        if not config['ENABLED']:
+            raise CommandError("TOKEN_BLACKLIST_CACHE is not enabled.")
+        if not options['loop']:
+            count = token_blacklist_service.rebuild(config)
+            self.stdout.write(self.style.SUCCESS(f"✔️  {count} blacklisted tokens cached."))
+            return
+
+        interval = options['interval'] or config['REBUILD_SECONDS']
+        self.stdout.write(self.style.NOTICE("Rebuilding the cached blacklist (Ctrl+C to stop)..."))
+        try:
+            while True:
+                count = token_blacklist_service.rebuild(config)
+                self.stdout.write(f"  {count} blacklisted tokens cached")
+                close_old_connections()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("⚠️  Stopped."))
@@ -0,0 +1,40 @@
+"""
+Worker delivering the outbound email queue (users.OutboundEmail).
+Due emails are sent in batches over one connection of EMAIL_BACKEND and
+failures are retried with exponential backoff (see users.services.email_service).
+Run it with --loop as a long-running process, OTP emails wait for it.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.services import email_service
+
+
+class Command(BaseCommand):
+    help = "Send the queued outbound emails"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Emails per batch (default: EMAIL_QUEUE['BATCH_SIZE']).")
+        parser.add_argument('--loop', action='store_true', help="Keep polling the queue instead of exiting.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds between polls when the queue is empty (with --loop).")
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            sent, failed = email_service.process_queue(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"✔️  {sent} emails sent, {failed} failed."))
+            return
+
+        self.stdout.write(self.style.NOTICE("Sending queued emails (Ctrl+C to stop)..."))
+        try:
+            while True:
+                sent, failed = email_service.process_queue(batch_size=options['batch_size'])
+                if sent or failed:
+                    self.stdout.write(f"  {sent} sent, {failed} failed")
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("⚠️  Stopped."))
@@ -1,11 +1,18 @@
 from datetime import timedelta
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from simple_history.models import HistoricalRecords
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
-from rbac.services import permission_servie
+from rbac.history import IndexedHistoricalRecords
+from rbac.services import permission_service
+from users.services import hashing_service
+
+def get_history_user(request=None, **kwargs):
+    # StatelessUser (users.authentication) is a proxy: record the real User row.
+    user = getattr(request, 'user', None)
+    return getattr(user, 'db_user', user)
 
 # Create your models here.
 class User(AbstractUser):
@@ -18,7 +25,7 @@ class User(AbstractUser):
     roles = models.ManyToManyField('rbac.Role', related_name='users', blank=True)
     groups = models.ManyToManyField('rbac.Group', related_name='users', blank=True)
 
-    history = HistoricalRecords(excluded_fields=['last_login'])
+    history = IndexedHistoricalRecords(excluded_fields=['last_login'], get_user=get_history_user)
     
     # The default REQUIRED_FIELDS for AbstractUser is ['email'].
     # We are keeping it and adding first_name and last_name. The USERNAME_FIELD ('username')
@@ -27,31 +34,148 @@ class User(AbstractUser):
 
     @property
     def all_permissions(self):
-        return permission_servie.get_user_permissions(self)
-    
+        return permission_service.get_user_permissions(self)
+
+    @cached_property
+    def permission_codes(self) -> frozenset:
+        # Resolved with a single query, then memoized on the instance.
+        # request.user is rebuilt on every request, so this lives for one request.
+        return permission_service.get_user_permission_codes(self)
+
     def has_permission(self, code: str) -> bool:
-        return self.all_permissions.filter(code=code).exists()
+        return code in self.permission_codes
+
+    # Hash and verify on the bounded hashing executor instead of the request thread
+    def set_password(self, raw_password):
+        self.password = hashing_service.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        valid, must_update = hashing_service.verify_password(raw_password, self.password)
+        if valid and must_update:
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return valid
+
+    def refresh_from_db(self, *args, **kwargs):
+        # Roles or groups may have changed since the codes were memoized.
+        self.__dict__.pop('permission_codes', None)
+        super().refresh_from_db(*args, **kwargs)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.username})"
 
+class UserEffectivePermission(models.Model):
+    """
+    Denormalized user -> permission rows, one per effective permission of a user
+    (through direct roles or group roles). Kept in sync incrementally by
+    rbac.services.effective_permission_service; answers "who holds X" with an
+    indexed lookup instead of scanning every user.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='effective_permissions')
+    permission = models.ForeignKey('rbac.Permission', on_delete=models.CASCADE, related_name='holders')
+    code = models.CharField(max_length=50)  # Copy of permission.code
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'permission'], name='unique_user_effective_permission'),
+        ]
+        indexes = [
+            models.Index(fields=['code', 'user'], name='effective_perm_code_user_idx'),
+            models.Index(fields=['user', 'code'], name='effective_perm_user_code_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.code}"
+
+class LoginEvent(models.Model):
+    """
+    One successful login. Written in batches by users.services.audit_service,
+    off the request path.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_events')
+    timestamp = models.DateTimeField()
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    user_agent = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='login_event_user_ts_idx'),
+            models.Index(fields=['-timestamp'], name='login_event_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} logged in at {self.timestamp}"
+
+class OutboundEmail(models.Model):
+    """
+    Outbox of emails to send. The request path only inserts rows; the
+    send_queued_emails worker delivers them in batches (see
+    users.services.email_service). Secrets such as an OTP are only stored
+    sealed (encrypted with a key derived from SECRET_KEY) and cleared once
+    the email is done with. An email not delivered by expires_at is dropped.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+        EXPIRED = 'expired', 'Expired'
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    template = models.CharField(max_length=255)  # HTML template, the text part is derived from it
+    context = models.JSONField(default=dict, blank=True)
+    secret = models.TextField(blank=True)  # Sealed secret context, see email_service.seal()
+    expires_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Worker polling: due pending emails, oldest first
+            models.Index(fields=['status', 'next_attempt_at'], name='outbound_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
+
 class PasswordResetOTP(models.Model):
+    """
+    A password reset code. Only an HMAC of the code is stored (see
+    users.services.otp_service); the latest unused code of a user is the
+    active one.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    code = models.CharField(max_length=6)
+    code_hash = models.CharField(max_length=64)
     created_at = models.DateTimeField(auto_now_add=True)
     is_used = models.BooleanField(default=False)
+    failed_attempts = models.PositiveSmallIntegerField(default=0)
 
     EXPIRATION_MINUTES = 5
+    MAX_ATTEMPTS = 5
 
     class Meta:
         verbose_name = "Password Reset OTP"
         verbose_name_plural = "Password Reset OTPs"
         ordering = ['-created_at']
+        indexes = [
+            # Active code lookups: (user, is_used=False) latest first
+            models.Index(fields=['user', 'is_used', 'created_at'], name='otp_user_used_created_idx'),
+        ]
+
+    @property
+    def expires_at(self):
+        return self.created_at + timedelta(minutes=self.EXPIRATION_MINUTES)
 
     def is_valid(self):
         # OTP is valid for 5 minutes
-        expiration_time = self.created_at + timedelta(minutes=self.EXPIRATION_MINUTES)
-        return timezone.now() < expiration_time and not self.is_used
+        return timezone.now() < self.expires_at and not self.is_used and self.failed_attempts < self.MAX_ATTEMPTS
     
     def __str__(self):
         return f"OTP for {self.user} created at {self.created_at}"
@@ -2,15 +2,20 @@
 # - Validating incoming data (e.g., from forms or API requests)
 # - Transforming Python/Django objects (models) to and from JSON
 # - Defining the structure of data exposed or expected by the API
-import json
 from rest_framework import serializers
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer as SimpleJWTTokenObtainPairSerializer,
+    TokenRefreshSerializer as SimpleJWTTokenRefreshSerializer,
+)
 from django.contrib.auth.password_validation import validate_password
 from drf_spectacular.utils import extend_schema_field
 
-from .models import User
+from .models import User, LoginEvent
 from rbac.models import Group, Role
-from .services import user_service
+from rbac.history import diff_snapshots, get_previous_record
+from rbac.serializers import HistoryUserField
+from .services import user_service, import_service
+from .tokens import PermissionClaimsRefreshToken
 
 # Show the User model without exposing the password field
 class UserSerializer(serializers.ModelSerializer):
@@ -101,6 +106,28 @@ class ResetPasswordSerializer(serializers.Serializer):
         return data
 
 
+# Login and refresh serializers (set in SIMPLE_JWT) issuing access tokens
+# with permission claims when RBAC_JWT_PERMISSION_CLAIMS is enabled
+class TokenObtainPairSerializer(SimpleJWTTokenObtainPairSerializer):
+    token_class = PermissionClaimsRefreshToken
+
+class TokenRefreshSerializer(SimpleJWTTokenRefreshSerializer):
+    token_class = PermissionClaimsRefreshToken
+
+
+# Serializer for the bulk import endpoint (CSV or JSONL upload)
+class UserImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=import_service.FORMATS, required=False)
+    validate_passwords = serializers.BooleanField(default=True)
+
+    def validate(self, attrs):
+        attrs['format'] = attrs.get('format') or import_service.detect_format(attrs['file'].name)
+        if not attrs['format']:
+            raise serializers.ValidationError({"format": "Cannot guess the file format from its name."})
+        return attrs
+
+
 # Serializer for the logout endpoint to ensure refresh token is provided
 class LogoutSerializer(serializers.Serializer):
     refresh = serializers.CharField()
@@ -115,16 +142,25 @@ class LogoutSerializer(serializers.Serializer):
 
     def save(self, **kwargs):
         try:
-            RefreshToken(self.token).blacklist()
+            PermissionClaimsRefreshToken(self.token).blacklist()
         except Exception:
             self.fail('bad_token')
 
 
 
+# Serializer for the login audit log
+class LoginEventSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = LoginEvent
+        fields = ['id', 'user', 'username', 'timestamp', 'ip_address', 'user_agent']
+
+
 # Serializer for the historical records of the User model
 class HistoricalUserSerializer(serializers.ModelSerializer):
     # The user who made the change, represented by their username for clarity.
-    history_user = serializers.StringRelatedField()
+    history_user = HistoryUserField()
     # Add a human-readable field for the history type (+, ~, -)
     history_type_display = serializers.CharField(source='get_history_type_display', read_only=True)
     changes = serializers.SerializerMethodField()
@@ -140,18 +176,13 @@ class HistoricalUserSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(serializers.ListField(child=serializers.CharField()))
     def get_roles(self, obj):
-        if not obj.history_change_reason:
-            return []
-        try:
-            data = json.loads(obj.history_change_reason)
-            return data.get('roles', [])
-        except (json.JSONDecodeError, TypeError):
-            return []
+        return obj.snapshot.get('roles', [])
         
     @extend_schema_field(serializers.ListField(child=serializers.DictField()))
     def get_changes(self, obj):
-        if obj.history_type == '~' and obj.prev_record:
-            delta = obj.diff_against(obj.prev_record)
+        previous = get_previous_record(obj) if obj.history_type == '~' else None
+        if previous:
+            delta = obj.diff_against(previous)
             changes_list = []
             for change in delta.changes:
                 if change.field == 'date_joined':
@@ -161,5 +192,7 @@ class HistoricalUserSerializer(serializers.ModelSerializer):
                     changes_list.append({'field': 'password', 'old': '********', 'new': '********'})
                 else:
                     changes_list.append({'field': change.field, 'old': change.old, 'new': change.new})
+            for field, change in diff_snapshots(previous.snapshot, obj.snapshot).items():
+                changes_list.append({'field': field, **change})
             return changes_list
         return None
\ No newline at end of file
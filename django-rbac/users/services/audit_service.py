@@ -0,0 +1,166 @@
+"""
+Buffered login-audit writer.
+
+Login events (see users.services.login_service) are appended to an in-memory
+buffer and written by a background thread in batches: one bulk_create of
+LoginEvent rows and one bulk_update of User.last_login per batch. A batch is
+flushed every FLUSH_INTERVAL seconds, or as soon as BATCH_SIZE events are
+waiting. bulk_update sends no post_save, so logins no longer write User
+history rows. A batch that fails MAX_RETRIES flushes in a row is logged and
+dropped, so one bad event cannot block the ones behind it. The buffer is
+drained on interpreter shutdown.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from users.models import User, LoginEvent
+
+logger = logging.getLogger(__name__)
+
+
+def get_config():
+    config = getattr(settings, 'LOGIN_AUDIT', {})
+    return {
+        'ENABLED': config.get('ENABLED', True),
+        'BATCH_SIZE': config.get('BATCH_SIZE', 500),
+        'FLUSH_INTERVAL': config.get('FLUSH_INTERVAL', 2.0),
+        'MAX_BUFFER': config.get('MAX_BUFFER', 50000),
+        'MAX_RETRIES': config.get('MAX_RETRIES', 3),
+    }
+
+
+class LoginAuditWriter:
+    """Thread-safe buffer of login events, flushed by a background thread."""
+
+    def __init__(self, batch_size, flush_interval, max_buffer, max_retries=3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_retries = max_retries
+        self.failed_attempts = 0  # Consecutive failures of the batch at the head of the buffer
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'discarded': 0, 'flushes': 0, 'failures': 0}
+
+    def record(self, event):
+        """Queues one login event, {'user_id', 'timestamp', 'ip', 'user_agent'}."""
+        with self.lock:
+            if len(self.buffer) >= self.max_buffer:
+                # The database cannot keep up: keep the most recent events
+                self.buffer.popleft()
+                self.stats['dropped'] += 1
+            self.buffer.append(event)
+            self.stats['recorded'] += 1
+            size = len(self.buffer)
+        self._ensure_started()
+        if size >= self.batch_size:
+            self.wakeup.set()
+
+    def _ensure_started(self):
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, name='login-audit-writer', daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def _take_batch(self):
+        with self.lock:
+            return [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+
+    def flush(self):
+        """Writes every buffered event, one batch at a time. Returns the number written."""
+        written = 0
+        with self.flush_lock:
+            while batch := self._take_batch():
+                try:
+                    self._write(batch)
+                except Exception:
+                    self.failed_attempts += 1
+                    with self.lock:
+                        self.stats['failures'] += 1
+                    if self.failed_attempts < self.max_retries:
+                        logger.exception("Failed to write %s login events, they will be retried.", len(batch))
+                        with self.lock:
+                            self.buffer.extendleft(reversed(batch))
+                        break
+                    logger.exception("Failed to write %s login events %s times, discarding them: %r",
+                                     len(batch), self.failed_attempts, batch)
+                    self.failed_attempts = 0
+                    with self.lock:
+                        self.stats['discarded'] += len(batch)
+                    continue
+                self.failed_attempts = 0
+                written += len(batch)
+                with self.lock:
+                    self.stats['written'] += len(batch)
+                    self.stats['flushes'] += 1
+        return written
+
+    def _write(self, batch):
+        # Users hard-deleted since their login would fail the whole batch
+        existing = set(User.objects.filter(pk__in={event['user_id'] for event in batch}).values_list('pk', flat=True))
+        batch = [event for event in batch if event['user_id'] in existing]
+        last_login = {}
+        for event in batch:
+            if event['user_id'] not in last_login or event['timestamp'] > last_login[event['user_id']]:
+                last_login[event['user_id']] = event['timestamp']
+        with transaction.atomic():
+            LoginEvent.objects.bulk_create([
+                LoginEvent(user_id=event['user_id'], timestamp=event['timestamp'],
+                           ip_address=event['ip'], user_agent=event['user_agent'])
+                for event in batch
+            ])
+            User.objects.bulk_update(
+                [User(pk=user_id, last_login=timestamp) for user_id, timestamp in last_login.items()],
+                ['last_login'],
+            )
+
+    def close(self):
+        """Stops the background thread and drains the buffer."""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def get_metrics(self):
+        with self.lock:
+            return {'buffered': len(self.buffer), **self.stats}
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = get_config()
+                _writer = LoginAuditWriter(
+                    config['BATCH_SIZE'], config['FLUSH_INTERVAL'], config['MAX_BUFFER'], config['MAX_RETRIES']
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+def record_login(event):
+    if get_config()['ENABLED']:
+        get_writer().record(event)
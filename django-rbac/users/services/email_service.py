@@ -0,0 +1,233 @@
+"""
+Outbound email queue.
+
+Requests only enqueue an OutboundEmail row. The send_queued_emails worker
+claims due emails in batches, renders them (each template is loaded and
+compiled once per batch) and sends the batch over a single connection of
+the configured EMAIL_BACKEND, so the locmem or file backends can stand in
+for SMTP. Failed emails are retried with exponential backoff, up to
+MAX_ATTEMPTS. Claiming pushes next_attempt_at forward by LEASE_SECONDS, so
+emails claimed by a worker that died become due again.
+
+Secrets such as an OTP are never written to the outbox in clear: enqueue_email
+seals the secret context (encrypted and authenticated with a key derived from
+SECRET_KEY), the worker opens it at send time and the sealed value is cleared
+once the email is done with. The worker needs the same SECRET_KEY, nothing
+else is shared with the web processes. An email not delivered before it
+expires is dropped rather than retried.
+"""
+import base64
+import hmac
+import json
+import logging
+import random
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from django.utils.html import strip_tags
+
+from users.models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def get_config():
+    config = getattr(settings, 'EMAIL_QUEUE', {})
+    return {
+        'BATCH_SIZE': config.get('BATCH_SIZE', 100),
+        'MAX_ATTEMPTS': config.get('MAX_ATTEMPTS', 5),
+        'RETRY_BASE_SECONDS': config.get('RETRY_BASE_SECONDS', 30),
+        'RETRY_MAX_SECONDS': config.get('RETRY_MAX_SECONDS', 3600),
+        'LEASE_SECONDS': config.get('LEASE_SECONDS', 300),
+    }
+
+SEAL_SALT = 'users.email.secret'
+NONCE_BYTES = 16
+TAG_BYTES = 32
+
+class InvalidSeal(Exception):
+    pass
+
+def _keystream(nonce, length, secret):
+    # HMAC-SHA256 in counter mode: one 32-byte block per counter value
+    blocks = (
+        salted_hmac(SEAL_SALT, nonce + counter.to_bytes(4, 'big'), secret=secret, algorithm='sha256').digest()
+        for counter in range((length + 31) // 32)
+    )
+    return b''.join(blocks)[:length]
+
+def _tag(data, secret):
+    return salted_hmac(f'{SEAL_SALT}.tag', data, secret=secret, algorithm='sha256').digest()
+
+def seal(secret_context):
+    """Encrypts and authenticates a JSON-serializable dict, keyed with SECRET_KEY."""
+    nonce = secrets.token_bytes(NONCE_BYTES)
+    plaintext = json.dumps(secret_context).encode()
+    ciphertext = bytes(a ^ b for a, b in zip(plaintext, _keystream(nonce, len(plaintext), settings.SECRET_KEY)))
+    return base64.urlsafe_b64encode(nonce + ciphertext + _tag(nonce + ciphertext, settings.SECRET_KEY)).decode()
+
+def unseal(sealed):
+    """Opens a value produced by seal(). Raises InvalidSeal if it was altered or the key changed."""
+    try:
+        data = base64.urlsafe_b64decode(sealed.encode())
+    except ValueError:
+        raise InvalidSeal("The secret context is not a sealed value.")
+    if len(data) < NONCE_BYTES + TAG_BYTES:
+        raise InvalidSeal("The secret context is not a sealed value.")
+    nonce, ciphertext, tag = data[:NONCE_BYTES], data[NONCE_BYTES:-TAG_BYTES], data[-TAG_BYTES:]
+    for secret in [settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS]:
+        if hmac.compare_digest(tag, _tag(nonce + ciphertext, secret)):
+            plaintext = bytes(a ^ b for a, b in zip(ciphertext, _keystream(nonce, len(ciphertext), secret)))
+            return json.loads(plaintext)
+    raise InvalidSeal("The secret context does not match SECRET_KEY.")
+
+def enqueue_email(to, subject, template, context=None, secret_context=None, expires_in=None):
+    """
+    Queues an email rendered from an HTML template. Returns the OutboundEmail.
+    secret_context is stored sealed and only opened at send time, and the
+    email is dropped if not sent within expires_in seconds (required with
+    secret_context).
+    """
+    if secret_context and not expires_in:
+        raise ValueError("A secret context needs expires_in.")
+    email = OutboundEmail(to=to, subject=subject, template=template, context=context or {})
+    if expires_in:
+        email.expires_at = timezone.now() + timedelta(seconds=expires_in)
+    if secret_context:
+        email.secret = seal(secret_context)
+    email.save()
+    return email
+
+def get_retry_delay(attempts, config=None):
+    """Exponential backoff with jitter: base * 2^(attempts - 1), capped."""
+    config = config or get_config()
+    delay = min(config['RETRY_BASE_SECONDS'] * 2 ** (attempts - 1), config['RETRY_MAX_SECONDS'])
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+def claim_batch(batch_size, config=None):
+    """
+    Claims up to batch_size due emails. Rows locked by another worker are
+    skipped (on databases supporting SKIP LOCKED).
+    """
+    config = config or get_config()
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=config['LEASE_SECONDS'])
+        )
+    return emails
+
+def build_messages(emails, connection):
+    """
+    Renders the emails, loading each template once and opening their
+    sealed secrets. Returns [(email, message or error)].
+    """
+    templates, built = {}, []
+    from_email = settings.EMAIL_HOST_USER  # None falls back to DEFAULT_FROM_EMAIL
+    for email in emails:
+        try:
+            context = email.context
+            if email.secret:
+                context = {**context, **unseal(email.secret)}
+            if email.template not in templates:
+                templates[email.template] = get_template(email.template)
+            html_message = templates[email.template].render(context)
+            message = EmailMultiAlternatives(
+                email.subject, strip_tags(html_message), from_email, [email.to], connection=connection
+            )
+            message.attach_alternative(html_message, 'text/html')
+            built.append((email, message))
+        except Exception as e:
+            built.append((email, e))
+    return built
+
+def send_batch(emails, config=None):
+    """
+    Sends claimed emails over one connection and records the outcome of each.
+    Returns (sent, failed) counts.
+    """
+    config = config or get_config()
+    connection = get_connection(fail_silently=False)
+    now = timezone.now()
+    sent, failed = [], []
+    expired = [email for email in emails if email.expires_at and email.expires_at <= now]
+    emails = [email for email in emails if email not in expired]
+    try:
+        connection.open()
+        for email, message in build_messages(emails, connection):
+            if isinstance(message, Exception):
+                failed.append((email, message))
+                continue
+            try:
+                connection.send_messages([message])
+                sent.append(email)
+            except Exception as e:
+                failed.append((email, e))
+                # The connection may be broken: start a fresh one for the rest
+                connection.close()
+                connection.open()
+    except Exception as e:
+        # Cannot (re)connect: every email not sent yet is retried later
+        done = {email.pk for email in sent + expired} | {email.pk for email, _ in failed}
+        failed.extend((email, e) for email in emails if email.pk not in done)
+    finally:
+        connection.close()
+
+    for email in sent:
+        email.status = OutboundEmail.Status.SENT
+        email.sent_at = now
+        email.attempts += 1
+        email.context = {}
+        email.secret = ''
+        email.last_error = ''
+    for email, error in failed:
+        email.attempts += 1
+        email.last_error = str(error)[:1000]
+        next_attempt_at = now + get_retry_delay(email.attempts, config)
+        if email.expires_at and next_attempt_at >= email.expires_at:
+            # A retry would come too late, e.g. for an OTP that is no longer valid
+            expired.append(email)
+        elif email.attempts >= config['MAX_ATTEMPTS']:
+            logger.error("Giving up on email %s to %s: %s", email.pk, email.to, error)
+            email.status = OutboundEmail.Status.FAILED
+            email.context = {}
+            email.secret = ''
+        else:
+            email.next_attempt_at = next_attempt_at
+    for email in expired:
+        logger.warning("Dropping expired email %s to %s.", email.pk, email.to)
+        email.status = OutboundEmail.Status.EXPIRED
+        email.context = {}
+        email.secret = ''
+    OutboundEmail.objects.bulk_update(
+        sent + expired + [email for email, _ in failed if email not in expired],
+        ['status', 'sent_at', 'attempts', 'context', 'secret', 'last_error', 'next_attempt_at'],
+    )
+    return len(sent), len(failed)
+
+def process_queue(batch_size=None, max_batches=None):
+    """Sends due emails batch by batch until none is left. Returns (sent, failed) counts."""
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    total_sent = total_failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        emails = claim_batch(batch_size, config)
+        if not emails:
+            break
+        sent, failed = send_batch(emails, config)
+        total_sent += sent
+        total_failed += failed
+        batches += 1
+    return total_sent, total_failed
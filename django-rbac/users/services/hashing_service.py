@@ -0,0 +1,163 @@
+"""
+Password hashing off the request thread.
+
+Hashing is deliberately CPU-expensive. Hashes are computed on a dedicated,
+bounded executor (PASSWORD_HASHING setting): a thread pool, enough for hashers
+that release the GIL (PBKDF2, Argon2, bcrypt), or a process pool. At most
+MAX_PENDING hashes are queued or running at once; beyond that callers wait up
+to QUEUE_TIMEOUT seconds for a slot and then get a 503, so a burst of logins
+or registrations cannot take every worker away from the read endpoints.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ('thread', 'process', 'inline')
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The server is busy, please retry shortly.'
+    default_code = 'password_hashing_busy'
+
+
+def get_config():
+    config = getattr(settings, 'PASSWORD_HASHING', {})
+    workers = config.get('WORKERS') or os.cpu_count() or 1
+    return {
+        'EXECUTOR': config.get('EXECUTOR', 'thread'),
+        'WORKERS': workers,
+        'MAX_PENDING': config.get('MAX_PENDING') or workers * 4,
+        'QUEUE_TIMEOUT': config.get('QUEUE_TIMEOUT', 5),
+    }
+
+def init_worker_process():
+    # Spawned workers (non-fork start methods) need the Django settings.
+    if not apps.ready:
+        django.setup()
+
+def _verify(raw_password, encoded):
+    # Runs in the executor: report whether the hash should be upgraded,
+    # the caller saves it (a worker process has no access to the instance).
+    must_update = []
+    valid = hashers.check_password(raw_password, encoded, setter=lambda raw: must_update.append(True))
+    return valid, bool(must_update)
+
+
+class HashingExecutor:
+    """Bounded executor with queue-depth metrics. One instance per process."""
+
+    def __init__(self, kind, workers, max_pending, queue_timeout):
+        if kind not in EXECUTORS:
+            raise ValueError(f"PASSWORD_HASHING['EXECUTOR'] must be one of {', '.join(EXECUTORS)}.")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'rejected': 0, 'peak_pending': 0,
+                      'wait_seconds': 0.0, 'run_seconds': 0.0}
+        if kind == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+        elif kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker_process)
+        else:
+            self.executor = None
+
+    def run(self, fn, *args):
+        """Runs fn(*args) on the executor and waits for its result."""
+        if self.executor is None:
+            return fn(*args)
+
+        started = time.monotonic()
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            with self.lock:
+                self.stats['rejected'] += 1
+            logger.warning("Password hashing queue full (%s pending), rejecting request.", self.max_pending)
+            raise PasswordHashingBusy()
+        queued = time.monotonic()
+        with self.lock:
+            self.pending += 1
+            self.stats['submitted'] += 1
+            self.stats['wait_seconds'] += queued - started
+            self.stats['peak_pending'] = max(self.stats['peak_pending'], self.pending)
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.stats['completed'] += 1
+                self.stats['run_seconds'] += time.monotonic() - queued
+            self.slots.release()
+
+    def get_metrics(self):
+        with self.lock:
+            completed = self.stats['completed']
+            return {
+                'executor': self.kind,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                **self.stats,
+                'avg_run_ms': round(self.stats['run_seconds'] / completed * 1000, 2) if completed else None,
+            }
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                config = get_config()
+                _executor = HashingExecutor(
+                    config['EXECUTOR'], config['WORKERS'], config['MAX_PENDING'], config['QUEUE_TIMEOUT']
+                )
+    return _executor
+
+def reset_executor():
+    """Shuts down the executor, the next call creates one from the current settings."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = None
+
+def make_password(raw_password):
+    """Hashes a password on the hashing executor."""
+    if raw_password is None:
+        # Unusable password: no hashing involved
+        return hashers.make_password(None)
+    return get_executor().run(hashers.make_password, raw_password)
+
+def verify_password(raw_password, encoded):
+    """
+    Checks a password against an encoded hash on the hashing executor.
+    Returns (valid, must_update); must_update means the hash should be
+    re-computed with the preferred hasher.
+    """
+    if raw_password is None or not encoded:
+        return False, False
+    return get_executor().run(_verify, raw_password, encoded)
+
+def get_metrics():
+    return get_executor().get_metrics()
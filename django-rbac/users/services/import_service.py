@@ -0,0 +1,292 @@
+"""
+Bulk user import, for migrating whole tenants at once.
+
+Rows are streamed from a CSV or JSONL file through a generator pipeline:
+parse -> chunk -> validate -> hash passwords -> insert. Each chunk is
+validated with two uniqueness queries, its passwords are hashed (in a process
+pool for the import_users command, inline for the upload endpoint, which is
+capped at USER_IMPORT_MAX_ROWS rows) and users, history records and role/group
+through-rows are written with bulk_create in one transaction. Invalid rows are
+reported (with their line number) and skipped; they never abort the rest of
+the import.
+"""
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+from simple_history.utils import bulk_create_with_history
+
+from users.models import User
+from rbac.models import Role, Group
+from rbac.services import effective_permission_service
+from users.services.hashing_service import init_worker_process
+
+CHUNK_SIZE = 1000
+DEFAULT_ROLE = "USER"
+LIST_SEPARATOR = ";"  # Separates role/group names in a CSV cell
+FORMATS = ('csv', 'jsonl')
+MAX_REPORTED_ERRORS = 100  # Row errors kept in the report; 'failed' counts all of them
+
+
+class UserImportRowSerializer(serializers.ModelSerializer):
+    """
+    Validates one imported row. Uniqueness is checked per chunk by the
+    pipeline (two queries per chunk), not per row by DRF's validators.
+    """
+    password = serializers.CharField(write_only=True)
+    roles = serializers.ListField(child=serializers.CharField(), required=False)
+    groups = serializers.ListField(child=serializers.CharField(), required=False)
+
+    class Meta:
+        model = User
+        fields = ['username', 'email', 'first_name', 'last_name', 'birthday', 'address', 'password', 'roles', 'groups']
+        extra_kwargs = {
+            'username': {'validators': [UnicodeUsernameValidator()]},
+            'email': {'validators': []},
+            'first_name': {'required': True, 'allow_blank': False},
+            'last_name': {'required': True, 'allow_blank': False},
+        }
+
+    def validate_password(self, value):
+        if self.context.get('validate_passwords', True):
+            validate_password(value)
+        return value
+
+
+def detect_format(filename):
+    """Guesses the file format from its extension ('csv' or 'jsonl')."""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+def read_rows(stream, fmt):
+    """
+    Yields (line number, row dict or parse error message) from a text stream.
+    CSV cells for roles/groups hold names separated by ';'.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            row = {key: value for key, value in row.items() if key and value not in (None, '')}
+            for field in ('roles', 'groups'):
+                if field in row:
+                    row[field] = [name.strip() for name in row[field].split(LIST_SEPARATOR) if name.strip()]
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_num, "Each line must be a JSON object."
+                continue
+            yield line_num, row
+    else:
+        raise ValueError(f"Unsupported format: {fmt}. Expected one of {', '.join(FORMATS)}.")
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class UserImporter:
+    """
+    Runs the import pipeline. One importer holds the role/group name lookups,
+    the usernames/emails already imported from the file and the hashing pool,
+    so it is meant for a single import (use it as a context manager).
+    Passwords are hashed inline unless workers is set (None: CPU count).
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, workers=0, validate_passwords=True, history_user=None):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.validate_passwords = validate_passwords
+        self.history_user = history_user
+        self.roles = {role.name: role for role in Role.objects.all()}
+        self.groups = {group.name: group for group in Group.objects.all()}
+        self.seen_usernames = set()
+        self.seen_emails = set()
+        self.executor = None
+
+    def __enter__(self):
+        if self.workers != 0:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker_process)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor:
+            self.executor.shutdown()
+
+    def run(self, rows, progress=None, on_errors=None, max_errors=MAX_REPORTED_ERRORS):
+        """
+        Imports (line number, row) pairs as produced by read_rows().
+        Returns {'created': n, 'failed': n, 'errors': [{'line': n, 'errors': ...}]}
+        where 'errors' holds the first max_errors row errors only. on_errors, if
+        given, is called with the errors of every chunk (e.g. to write them all out).
+        """
+        report = {'created': 0, 'failed': 0, 'errors': []}
+        for chunk in chunked(rows, self.chunk_size):
+            valid, errors = self.validate_chunk(chunk)
+            created, insert_errors = self.insert_chunk(valid)
+            errors.extend(insert_errors)
+            report['created'] += created
+            report['failed'] += len(errors)
+            report['errors'].extend(errors[:max(max_errors - len(report['errors']), 0)])
+            if on_errors and errors:
+                on_errors(errors)
+            if progress:
+                progress(report)
+        return report
+
+    def validate_chunk(self, chunk):
+        """Returns the (line number, validated data) of valid rows, and the errors of the others."""
+        valid, errors = [], []
+        for line, row in chunk:
+            if isinstance(row, str):
+                errors.append({'line': line, 'errors': {'non_field_errors': [row]}})
+                continue
+            serializer = UserImportRowSerializer(data=row, context={'validate_passwords': self.validate_passwords})
+            if not serializer.is_valid():
+                errors.append({'line': line, 'errors': serializer.errors})
+                continue
+            data = serializer.validated_data
+            unknown = {
+                field: [f"Unknown {field[:-1]}: {name}" for name in data.get(field, []) if name not in lookup]
+                for field, lookup in (('roles', self.roles), ('groups', self.groups))
+            }
+            unknown = {field: messages for field, messages in unknown.items() if messages}
+            if unknown:
+                errors.append({'line': line, 'errors': unknown})
+                continue
+            valid.append((line, data))
+
+        # Uniqueness: within the file, then against the database (one query per field)
+        taken_usernames = set(
+            User.objects.filter(username__in=[data['username'] for _, data in valid]).values_list('username', flat=True)
+        )
+        taken_emails = set(
+            User.objects.filter(email__in=[data['email'] for _, data in valid]).values_list('email', flat=True)
+        )
+        # Earlier rows only count once inserted (see insert_chunk)
+        taken_usernames |= self.seen_usernames
+        taken_emails |= self.seen_emails
+        unique, chunk_usernames, chunk_emails = [], set(), set()
+        for line, data in valid:
+            row_errors = {}
+            if data['username'] in taken_usernames or data['username'] in chunk_usernames:
+                row_errors['username'] = ["A user with that username already exists."]
+            if data['email'] in taken_emails or data['email'] in chunk_emails:
+                row_errors['email'] = ["User with this email address already exists."]
+            if row_errors:
+                errors.append({'line': line, 'errors': row_errors})
+                continue
+            chunk_usernames.add(data['username'])
+            chunk_emails.add(data['email'])
+            unique.append((line, data))
+        return unique, errors
+
+    def mark_imported(self, rows):
+        for _, data, _ in rows:
+            self.seen_usernames.add(data['username'])
+            self.seen_emails.add(data['email'])
+
+    def hash_passwords(self, passwords):
+        if not self.executor:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // ((self.workers or os.cpu_count() or 1) * 4))
+        return list(self.executor.map(make_password, passwords, chunksize=chunksize))
+
+    def insert_chunk(self, valid):
+        """
+        Inserts validated rows in one transaction. If the batch hits a
+        constraint (e.g. a concurrent registration), rows are retried one by
+        one so that only the conflicting ones are reported.
+        """
+        if not valid:
+            return 0, []
+        hashes = self.hash_passwords([data['password'] for _, data in valid])
+        rows = [(line, data, password) for (line, data), password in zip(valid, hashes)]
+        try:
+            with transaction.atomic():
+                self._insert(rows)
+            self.mark_imported(rows)
+            return len(rows), []
+        except IntegrityError:
+            pass
+
+        created, errors = 0, []
+        for row in rows:
+            try:
+                with transaction.atomic():
+                    self._insert([row])
+                self.mark_imported([row])
+                created += 1
+            except IntegrityError as e:
+                errors.append({'line': row[0], 'errors': {'non_field_errors': [str(e)]}})
+        return created, errors
+
+    def _insert(self, rows):
+        users, assignments = [], {}
+        for _, data, password in rows:
+            fields = {key: value for key, value in data.items() if key not in ('password', 'roles', 'groups')}
+            user = User(password=password, **fields)
+            role_names = sorted(set(data.get('roles') or ([DEFAULT_ROLE] if DEFAULT_ROLE in self.roles else [])))
+            role_ids = [self.roles[name].pk for name in role_names]
+            group_ids = sorted({self.groups[name].pk for name in data.get('groups', [])})
+            # Same snapshot as users.signals.add_roles_snapshot, which bulk history skips
+            user._history_snapshot = {'roles': role_names, 'role_ids': role_ids, 'group_ids': group_ids}
+            users.append(user)
+            assignments[user.username] = (role_ids, group_ids)
+
+        # bulk_create_with_history may re-fetch the users: match them by username
+        users = bulk_create_with_history(users, User, batch_size=self.chunk_size, default_user=self.history_user)
+        role_rows, group_rows = [], []
+        for user in users:
+            role_ids, group_ids = assignments[user.username]
+            role_rows.extend(User.roles.through(user_id=user.pk, role_id=role_id) for role_id in role_ids)
+            group_rows.extend(User.groups.through(user_id=user.pk, group_id=group_id) for group_id in group_ids)
+        User.roles.through.objects.bulk_create(role_rows, batch_size=self.chunk_size)
+        User.groups.through.objects.bulk_create(group_rows, batch_size=self.chunk_size)
+        # Through-table bulk_create sends no m2m_changed: fill the effective
+        # permission table here. New users have no cached permissions yet.
+        effective_permission_service.sync_users([user.pk for user in users])
+
+
+def read_upload(uploaded_file, fmt, max_rows=None):
+    """
+    Reads the rows of an uploaded file, at most max_rows (default USER_IMPORT_MAX_ROWS).
+    Raises a ValidationError for larger files, which belong to import_users.
+    """
+    max_rows = max_rows or getattr(settings, 'USER_IMPORT_MAX_ROWS', 100)
+    rows = list(islice(read_rows(open_upload(uploaded_file), fmt), max_rows + 1))
+    if len(rows) > max_rows:
+        raise serializers.ValidationError(
+            {"file": [f"At most {max_rows} rows per upload, use the import_users command for larger files."]}
+        )
+    return rows
+
+def import_users(stream, fmt, **options):
+    """Imports users from a text stream, see UserImporter."""
+    with UserImporter(**options) as importer:
+        return importer.run(read_rows(stream, fmt))
+
+def open_upload(uploaded_file):
+    """Wraps an uploaded (binary) file as a text stream for read_rows()."""
+    return io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
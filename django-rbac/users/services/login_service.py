@@ -0,0 +1,79 @@
+"""
+Post-login side effects (audit, last_login, ...) run off the request path.
+
+The token endpoint authenticates once, then calls dispatch_login(). Receivers
+of the login_succeeded signal are run on a single background thread, after
+the response is built, with (user_id, event) where event holds the login
+timestamp, the client IP and its user agent. A failing receiver is logged and
+never affects the login itself. Set LOGIN_HOOKS_DEFERRED = False to run them
+inline (e.g. in tests).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.dispatch import Signal
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+# Sent with user_id and event (see build_login_event)
+login_succeeded = Signal()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_client_ip(request):
+    """
+    The client address, by the same rule as the throttles: X-Forwarded-For is
+    only read behind REST_FRAMEWORK['NUM_PROXIES'] trusted proxies, taking the
+    address the outermost of them saw. Otherwise (the default), REMOTE_ADDR.
+    """
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    num_proxies = api_settings.NUM_PROXIES
+    if not num_proxies or not forwarded:
+        return request.META.get('REMOTE_ADDR')
+    addresses = forwarded.split(',')
+    return addresses[-min(num_proxies, len(addresses))].strip()
+
+def build_login_event(request, user):
+    return {
+        'user_id': user.pk,
+        'timestamp': timezone.now(),
+        'ip': get_client_ip(request),
+        'user_agent': request.META.get('HTTP_USER_AGENT', '')[:255],
+    }
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='post-login')
+    return _executor
+
+def _run_hooks(event):
+    for receiver, response in login_succeeded.send_robust(sender=None, user_id=event['user_id'], event=event):
+        if isinstance(response, Exception):
+            logger.error("Post-login hook %r failed: %s", receiver, response, exc_info=response)
+
+def _run_hooks_in_background(event):
+    try:
+        _run_hooks(event)
+    finally:
+        # The background thread has its own database connection
+        close_old_connections()
+
+def dispatch_login(request, user):
+    """Runs the post-login hooks for a successful login, in the background by default."""
+    event = build_login_event(request, user)
+    if not login_succeeded.has_listeners():
+        return event
+    if getattr(settings, 'LOGIN_HOOKS_DEFERRED', True):
+        _get_executor().submit(_run_hooks_in_background, event)
+    else:
+        _run_hooks(event)
+    return event
@@ -1,48 +1,163 @@
+"""
+Password reset OTPs.
+
+Codes are never stored in clear: only an HMAC bound to the user (keyed with
+SECRET_KEY) is kept, and submitted codes are compared with
+hmac.compare_digest. Only the latest unused code of a user is active; it
+expires after PasswordResetOTP.EXPIRATION_MINUTES and after MAX_ATTEMPTS
+guesses. Each guess first takes one attempt with an atomic increment, so
+concurrent guesses cannot exceed MAX_ATTEMPTS, then validates and consumes the
+code in a single conditional UPDATE (or cache delete), so two concurrent
+resets cannot both use it. The cooldown runs from the latest code requested,
+used or not; it is started with an atomic cache.add, so of concurrent requests
+only one gets a code.
+
+OTP_STORE selects where active codes live: 'db' (PasswordResetOTP, indexed
+on user/is_used/created_at) or 'cache' (the default cache, keeping OTPs out
+of the main database entirely).
+"""
+import hmac
 from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
+from django.utils.crypto import salted_hmac
 from rest_framework.exceptions import ValidationError
 from users.models import User, PasswordResetOTP
 from users.utils import generate_otp, send_otp_email
 from django.contrib.auth.password_validation import validate_password
 
-COOLDOWN_SECONDS = 120
+OTP_KEY = 'otp:active:{user_id}'
+OTP_ATTEMPTS_KEY = 'otp:attempts:{user_id}'
+OTP_COOLDOWN_KEY = 'otp:cooldown:{user_id}'
+
+def get_cooldown_seconds():
+    return getattr(settings, 'OTP_COOLDOWN_SECONDS', 120)
+
+def use_cache_store():
+    return getattr(settings, 'OTP_STORE', 'db') == 'cache'
+
+def hash_code(user_id, code):
+    """HMAC of a code, bound to the user so it cannot be replayed for another account."""
+    return salted_hmac('users.otp', f"{user_id}:{code}", algorithm='sha256').hexdigest()
+
+def _expiration():
+    return timedelta(minutes=PasswordResetOTP.EXPIRATION_MINUTES)
+
+def _get_active_otp(user):
+    # Served by the (user, is_used, created_at) index
+    return PasswordResetOTP.objects.filter(user=user, is_used=False).order_by('-created_at').first()
+
+def get_cooldown_remaining(user: User) -> int:
+    """Seconds before the user may request a new OTP (0 if allowed now)."""
+    # Separate from the code itself, which is deleted once used
+    created_at = cache.get(OTP_COOLDOWN_KEY.format(user_id=user.pk))
+    if not use_cache_store():
+        # The latest code also counts, the cooldown survives a cache flush
+        otp = PasswordResetOTP.objects.filter(user=user).order_by('-created_at').first()
+        if otp and (created_at is None or otp.created_at > created_at):
+            created_at = otp.created_at
+    if created_at is None:
+        return 0
+    remaining = (created_at + timedelta(seconds=get_cooldown_seconds()) - timezone.now()).total_seconds()
+    return max(0, int(remaining))
 
 def can_request_new_otp(user: User):
     """Check if the user can request a new OTP based on a cooldown period."""
-    last_otp = PasswordResetOTP.objects.filter(user=user).order_by('-created_at').first()
-    if not last_otp:
-        return True, 0
+    remaining = get_cooldown_remaining(user)
+    return remaining == 0, remaining
 
-    next_allowed_time = last_otp.created_at + timedelta(seconds=COOLDOWN_SECONDS)
-    if timezone.now() < next_allowed_time:
-        remaining = int((next_allowed_time - timezone.now()).total_seconds())
-        return False, remaining
-    return True, 0
+def _start_cooldown(user, now):
+    """Starts the cooldown of the user, False if one is running."""
+    if not use_cache_store() and get_cooldown_remaining(user):
+        return False
+    # Atomic: of concurrent requests, only one adds the key
+    return cache.add(OTP_COOLDOWN_KEY.format(user_id=user.pk), now, get_cooldown_seconds())
 
 def request_password_reset_otp(user: User):
     """Generate, save, and send a new password reset OTP for a user."""
-    can_request, remaining = can_request_new_otp(user)
-    if not can_request:
+    now = timezone.now()
+    if not _start_cooldown(user, now):
+        # At least 1: the cooldown may have ended since the failed add
+        remaining = max(get_cooldown_remaining(user), 1)
         raise ValidationError(
             {"detail": f"Please wait {remaining} seconds before requesting a new OTP."}
         )
-    
+
     code = generate_otp()
-    PasswordResetOTP.objects.create(user=user, code=code)
+    code_hash = hash_code(user.pk, code)
+    if use_cache_store():
+        timeout = int(_expiration().total_seconds())
+        cache.set(OTP_KEY.format(user_id=user.pk), {'hash': code_hash, 'created_at': now}, timeout)
+        cache.set(OTP_ATTEMPTS_KEY.format(user_id=user.pk), 0, timeout)
+    else:
+        PasswordResetOTP.objects.create(user=user, code_hash=code_hash)
     send_otp_email(user.email, code)
 
-def reset_password_with_otp(user: User, otp_code: str, new_password: str):
-    """Validate the OTP and reset the user's password."""
-    otp_qs = PasswordResetOTP.objects.filter(user=user, code=otp_code, is_used=False)
-    if not otp_qs.exists():
+def _take_db_attempt(user):
+    """Takes one attempt on the active code and returns it."""
+    otp = _get_active_otp(user)
+    if otp is None:
         raise ValidationError({"otp": "Invalid or used OTP."})
-    
-    otp_obj = otp_qs.latest('created_at')
-    if not otp_obj.is_valid():
+    if timezone.now() >= otp.expires_at:
         raise ValidationError({"otp": "OTP expired."})
+    # Only MAX_ATTEMPTS increments can succeed, however many guesses run concurrently
+    taken = PasswordResetOTP.objects.filter(
+        pk=otp.pk, is_used=False, failed_attempts__lt=PasswordResetOTP.MAX_ATTEMPTS,
+    ).update(failed_attempts=F('failed_attempts') + 1)
+    if not taken:
+        raise ValidationError({"otp": "Too many attempts, please request a new OTP."})
+    return otp
+
+def _consume_db_otp(otp, code_hash):
+    # Validates and consumes in one statement: loses against a concurrent reset
+    consumed = PasswordResetOTP.objects.filter(
+        pk=otp.pk, code_hash=code_hash, is_used=False,
+        created_at__gt=timezone.now() - _expiration(),
+        failed_attempts__lte=PasswordResetOTP.MAX_ATTEMPTS,
+    ).update(is_used=True)
+    return consumed == 1
+
+def _take_cached_attempt(user):
+    """Takes one attempt on the active code and returns it."""
+    entry = cache.get(OTP_KEY.format(user_id=user.pk))
+    if entry is None:
+        # Expired entries are evicted by the cache itself
+        raise ValidationError({"otp": "Invalid, used or expired OTP."})
+    try:
+        attempts = cache.incr(OTP_ATTEMPTS_KEY.format(user_id=user.pk))
+    except ValueError:
+        raise ValidationError({"otp": "Invalid, used or expired OTP."})  # Expired meanwhile
+    if attempts > PasswordResetOTP.MAX_ATTEMPTS:
+        raise ValidationError({"otp": "Too many attempts, please request a new OTP."})
+    return entry
+
+def _consume_cached_otp(user, entry, code_hash):
+    # cache.delete reports whether the key existed: only one reset wins
+    return hmac.compare_digest(entry['hash'], code_hash) and cache.delete(OTP_KEY.format(user_id=user.pk))
 
+def reset_password_with_otp(user: User, otp_code: str, new_password: str):
+    """Validate the OTP and reset the user's password."""
+    # Before taking an attempt: a rejected password does not use one up
     validate_password(new_password, user=user)
-    user.set_password(new_password)
-    user.save()
-    otp_obj.is_used = True
-    otp_obj.save()
\ No newline at end of file
+
+    code_hash = hash_code(user.pk, otp_code)
+    # The attempt is committed on its own, even when the code is wrong
+    if use_cache_store():
+        entry = _take_cached_attempt(user)
+    else:
+        otp = _take_db_attempt(user)
+
+    with transaction.atomic():
+        if use_cache_store():
+            consumed = _consume_cached_otp(user, entry, code_hash)
+        else:
+            consumed = _consume_db_otp(otp, code_hash)
+        if not consumed:
+            raise ValidationError({"otp": "Invalid or used OTP."})
+        user.set_password(new_password)
+        user.save()
+    return user
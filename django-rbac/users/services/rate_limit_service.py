@@ -0,0 +1,101 @@
+"""
+Cache-backed rate limiting.
+
+Sliding-window counters: each (scope, key) pair has one counter per fixed
+window, and a hit is allowed while
+
+    previous window count * (unelapsed share of the window) + current count <= limit
+
+which approximates a true sliding window with two cache keys. Counters are
+created with cache.add and bumped with cache.incr, both atomic on the shared
+backends (Redis, Memcached), so concurrent processes share the limits.
+Rejected hits are not counted, and the Retry-After of a rejection is the time
+until the weighted count leaves room for one more hit.
+Allowed/rejected totals are kept per scope and exposed by get_counters().
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+COUNTER_KEY = 'rl:{scope}:{key}:{window}'
+STATS_KEY = 'rl:stats:{scope}:{outcome}'
+
+def get_cache():
+    return caches[getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default')]
+
+def get_rate(scope):
+    """Returns the (limit, window seconds) of a scope, None if unlimited."""
+    rate = getattr(settings, 'RATE_LIMITS', {}).get(scope)
+    return parse_rate(rate) if rate else None
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60)."""
+    limit, period = rate.split('/')
+    return int(limit), PERIODS[period]
+
+def make_key(value):
+    # Emails/usernames can hold characters some cache backends reject in keys
+    return hashlib.sha256(str(value).strip().lower().encode()).hexdigest()[:32]
+
+def _incr(cache, key, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add and incr
+        cache.set(key, 1, timeout)
+        return 1
+
+def _retry_after(previous, current, limit, window, elapsed):
+    """Seconds until one more hit is allowed, if none is made meanwhile (current: allowed hits)."""
+    if current < limit and previous:
+        # Room left in this window once the previous one weighs less
+        return window - elapsed - (limit - current - 1) * window / previous
+    # Once this window ends, its hits weigh as the previous window's
+    return window - elapsed + (window * (1 - (limit - 1) / current) if current else 0)
+
+def hit(scope, key, limit, window):
+    """
+    Records a hit of key in scope and returns (allowed, retry_after seconds).
+    A rejected hit is taken back, so retrying after retry_after succeeds.
+    """
+    cache = get_cache()
+    now = time.time()
+    current_window = int(now // window)
+    elapsed = now - current_window * window
+
+    counter_key = COUNTER_KEY.format(scope=scope, key=key, window=current_window)
+    current = _incr(cache, counter_key, window * 2)
+    previous = cache.get(COUNTER_KEY.format(scope=scope, key=key, window=current_window - 1), 0)
+    weighted = previous * (window - elapsed) / window + current
+
+    allowed = weighted <= limit
+    _incr(cache, STATS_KEY.format(scope=scope, outcome='allowed' if allowed else 'rejected'), None)
+    if allowed:
+        return True, 0
+    try:
+        cache.decr(counter_key)
+    except ValueError:
+        pass  # Expired meanwhile
+    return False, max(1, math.ceil(_retry_after(previous, current - 1, limit, window, elapsed)))
+
+def get_counters():
+    """Returns {scope: {'rate', 'allowed', 'rejected'}} for every configured scope."""
+    rates = getattr(settings, 'RATE_LIMITS', {})
+    keys = {
+        (scope, outcome): STATS_KEY.format(scope=scope, outcome=outcome)
+        for scope in rates for outcome in ('allowed', 'rejected')
+    }
+    values = get_cache().get_many(keys.values())
+    return {
+        scope: {
+            'rate': rate,
+            'allowed': values.get(keys[(scope, 'allowed')], 0),
+            'rejected': values.get(keys[(scope, 'rejected')], 0),
+        }
+        for scope, rate in rates.items()
+    }
@@ -0,0 +1,101 @@
+"""
+Cache-backed refresh token blacklist (TOKEN_BLACKLIST_CACHE setting).
+
+Every refresh checks the refresh token against the blacklist, and with
+BLACKLIST_AFTER_ROTATION every refresh also blacklists the token it rotates.
+When enabled, each blacklisted JTI is also kept in the shared cache until the
+token expires. The database (BlacklistedToken) remains the source of truth:
+
+- every new BlacklistedToken row, whoever creates it (rotation, logout, the
+  admin), is added to the cache once its transaction commits;
+- a rebuild loads every unexpired blacklisted JTI into the cache, then marks
+  the cache complete for twice REBUILD_SECONDS. Rebuilds run out of band, every
+  REBUILD_SECONDS, from the rebuild_token_blacklist_cache command (--loop);
+- while the cache is complete, a JTI missing from it is not blacklisted and the
+  check needs no query. Otherwise (no rebuild yet, or the worker stopped) the
+  check queries the database: requests never rebuild the cache themselves.
+
+The cache must be shared by every process and must not evict keys before they
+expire (e.g. a dedicated Redis database): a JTI lost from a complete cache
+would be accepted until the next rebuild. Un-blacklisting a token (deleting its
+BlacklistedToken row) only takes effect once its cache key expires.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+BLACKLISTED_KEY = 'jwt:blacklisted:{jti}'
+COMPLETE_KEY = 'jwt:blacklist:complete'
+
+
+def get_config():
+    config = getattr(settings, 'TOKEN_BLACKLIST_CACHE', {})
+    return {
+        'ENABLED': config.get('ENABLED', False),
+        'ALIAS': config.get('ALIAS', 'default'),
+        'REBUILD_SECONDS': config.get('REBUILD_SECONDS', 300),
+        'BATCH_SIZE': config.get('BATCH_SIZE', 5000),
+    }
+
+def get_cache(config=None):
+    return caches[(config or get_config())['ALIAS']]
+
+def _add(jti, expires_at):
+    timeout = (expires_at - timezone.now()).total_seconds()
+    if timeout > 0:
+        get_cache().set(BLACKLISTED_KEY.format(jti=jti), True, timeout=timeout)
+
+def add(jti, expires_at):
+    """Adds a blacklisted JTI to the cache once the current transaction commits."""
+    if get_config()['ENABLED']:
+        transaction.on_commit(lambda: _add(jti, expires_at))
+
+def rebuild(config=None):
+    """Loads every unexpired blacklisted JTI into the cache, then marks it complete. Returns the count."""
+    config = config or get_config()
+    cache = get_cache(config)
+    now = timezone.now()
+    rows = (
+        BlacklistedToken.objects.filter(token__expires_at__gt=now)
+        .order_by()
+        .values_list('token__jti', 'token__expires_at')
+        .iterator(chunk_size=config['BATCH_SIZE'])
+    )
+    count, batch = 0, {}
+
+    def write(batch):
+        # One timeout per batch: outliving its token does not matter, the token is expired
+        timeout = (max(batch.values()) - now).total_seconds()
+        cache.set_many({BLACKLISTED_KEY.format(jti=jti): True for jti in batch}, timeout=timeout)
+
+    for jti, expires_at in rows:
+        batch[jti] = expires_at
+        if len(batch) >= config['BATCH_SIZE']:
+            write(batch)
+            count, batch = count + len(batch), {}
+    if batch:
+        write(batch)
+        count += len(batch)
+    # Outlives the next rebuild, so the mark never lapses while the worker runs
+    cache.set(COMPLETE_KEY, True, timeout=2 * config['REBUILD_SECONDS'])
+    return count
+
+def _in_database(jti):
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+def is_blacklisted(jti):
+    """Whether a refresh token JTI is blacklisted, from the cache when it is complete."""
+    config = get_config()
+    if not config['ENABLED']:
+        return _in_database(jti)
+
+    cache = get_cache(config)
+    key = BLACKLISTED_KEY.format(jti=jti)
+    values = cache.get_many([key, COMPLETE_KEY])
+    if key in values:
+        return True
+    if COMPLETE_KEY in values:
+        return False
+    return _in_database(jti)
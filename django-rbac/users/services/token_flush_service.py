@@ -0,0 +1,71 @@
+"""
+Purge of expired refresh tokens (TOKEN_FLUSH setting).
+
+Every login and every rotation adds an OutstandingToken row, and every logout
+or rotation a BlacklistedToken row. Once a token has expired both rows are
+useless: the blacklist is emptied of expired tokens first, then the outstanding
+list. Each table is walked in ascending primary-key order, batch by batch, and
+each batch is removed by a short DELETE on its primary keys, so the tables are
+never locked for long. Tokens are issued in order, so expired rows are the
+lowest ids and each batch is found without a long scan.
+
+The purge runs from the flush_expired_tokens command, once (e.g. from cron) or
+as a long-running worker with --loop, never from the web processes.
+Concurrent purges are harmless: a row is only ever deleted once.
+"""
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+def get_config():
+    config = getattr(settings, 'TOKEN_FLUSH', {})
+    return {
+        'BATCH_SIZE': config.get('BATCH_SIZE', 1000),
+        'SLEEP': config.get('SLEEP', 0),
+    }
+
+def get_expired(model, now=None):
+    """Expired rows of BlacklistedToken or OutstandingToken."""
+    now = now or timezone.now()
+    if model is BlacklistedToken:
+        return BlacklistedToken.objects.filter(token__expires_at__lt=now)
+    return OutstandingToken.objects.filter(expires_at__lt=now)
+
+def purge(model, now=None, dry_run=False, batch_size=None, sleep=None, progress=None):
+    """Removes the expired rows of model in batches of primary keys. Returns the number removed."""
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    sleep = config['SLEEP'] if sleep is None else sleep
+    expired = get_expired(model, now)
+
+    removed, last_id, started = 0, 0, time.monotonic()
+    while True:
+        ids = list(expired.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        last_id = ids[-1]
+        if dry_run:
+            removed += len(ids)
+        else:
+            # Only the primary keys are loaded to cascade to the tokens blacklisted since the blacklist pass
+            removed += model.objects.filter(pk__in=ids).only('pk').delete()[1].get(model._meta.label, 0)
+        if progress:
+            progress(model, removed, time.monotonic() - started)
+        if sleep:
+            time.sleep(sleep)
+
+def flush_expired(dry_run=False, batch_size=None, sleep=None, progress=None):
+    """
+    Purges the expired blacklisted, then outstanding, tokens.
+    Returns {'blacklisted': n, 'outstanding': n}.
+    """
+    now = timezone.now()
+    options = dict(now=now, dry_run=dry_run, batch_size=batch_size, sleep=sleep, progress=progress)
+    return {
+        'blacklisted': purge(BlacklistedToken, **options),
+        'outstanding': purge(OutstandingToken, **options),
+    }
+
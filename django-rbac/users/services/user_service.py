@@ -1,7 +1,13 @@
 from rest_framework import serializers
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.db import transaction
 from django.contrib.auth.password_validation import validate_password
 from users.models import User
 from rbac.models import Role
+from rbac.services import cache_service
+
+USER_STATE_KEY = 'users:state:{user_id}'
 
 def create_user(validated_data):
     """
@@ -10,7 +16,13 @@ def create_user(validated_data):
     """
     roles = validated_data.pop('roles', [])
     groups = validated_data.pop('groups', [])
-    user = User.objects.create_user(**validated_data)
+    password = validated_data.pop('password', None)
+    # Same as User.objects.create_user, but hashing through User.set_password
+    validated_data['username'] = User.normalize_username(validated_data['username'])
+    validated_data['email'] = User.objects.normalize_email(validated_data.get('email'))
+    user = User(**validated_data)
+    user.set_password(password)
+    user.save()
 
     if not roles:
         try:
@@ -38,4 +50,39 @@ def change_user_password(user, new_password, old_password=None):
     validate_password(new_password, user=user)
     user.set_password(new_password)
     user.save()
-    return user
\ No newline at end of file
+    return user
+
+def deactivate_user(user):
+    """
+    Soft-deletes a user. Saving drops the cached user state (see users.signals),
+    so the user's access tokens stop authenticating immediately.
+    """
+    user.is_active = False
+    user.save()
+    return user
+
+def get_user_by_id(user_id):
+    return User.objects.get(pk=user_id)
+
+def get_user_state(user_id):
+    """
+    Returns the flags checked on every authenticated request
+    (is_active, is_staff, is_superuser) from the cache, loading them
+    with a single narrow query on a miss. Returns None for an unknown user.
+    Only a shared cache is used: the invalidation of a process-local one
+    would not reach the other processes, e.g. when a user is deactivated.
+    """
+    shared = cache_service.is_shared(caches[DEFAULT_CACHE_ALIAS])
+    key = USER_STATE_KEY.format(user_id=user_id)
+    state = cache.get(key) if shared else None
+    if state is None:
+        state = User.objects.filter(pk=user_id).values('is_active', 'is_staff', 'is_superuser').first()
+        if state is None:
+            return None
+        if shared:
+            cache.set(key, state, timeout=getattr(settings, 'USER_STATE_CACHE_TIMEOUT', 60))
+    return state
+
+def invalidate_user_state(user_id):
+    """Drops the cached state of a user once the current transaction commits."""
+    transaction.on_commit(lambda: cache.delete(USER_STATE_KEY.format(user_id=user_id)))
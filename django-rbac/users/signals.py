@@ -1,19 +1,125 @@
-import json
 from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_save
 from simple_history.signals import pre_create_historical_record
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 
 from .models import User
+from rbac.services import cache_service, effective_permission_service, snapshot_service
+from .services import user_service, login_service, audit_service, token_blacklist_service
 
 
 # Signal to add roles snapshot to the historical record
-# This will store the current roles of a User in the history record
+# This will store the current roles and groups of a User in the history record
 @receiver(pre_create_historical_record)
 def add_roles_snapshot(sender, **kwargs):
     instance = kwargs['instance']
     history_instance = kwargs['history_instance']
     if not isinstance(instance, User):
         return
-    names = list(instance.roles.values_list('name', flat=True))
-    data = json.loads(history_instance.history_change_reason or '{}')
-    data['roles'] = names
-    history_instance.history_change_reason = json.dumps(data)
+    history_instance.snapshot = snapshot_service.build_snapshot(instance)
+
+
+# Role and group assignment changes add a history record with the new snapshot
+# to each changed user. Reverse clears report no ids: they are captured on
+# pre_clear by the effective permission receivers below. Bulk membership
+# changes (assignment_service.update_group_membership) are recorded once, on
+# the group, instead.
+@receiver(m2m_changed, sender=User.roles.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def save_assignments_in_user_history(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if getattr(instance, '_aggregated_history', False):
+        return
+    if not reverse:
+        snapshot_service.record_users([instance.pk])
+    elif action == "post_clear":
+        snapshot_service.record_users(getattr(instance, '_cleared_user_ids', []))
+    else:
+        snapshot_service.record_users(pk_set)
+
+
+# Invalidate the cached permissions of the users whose roles or groups changed.
+# Forward changes (user.roles.add) carry the user as instance; reverse changes
+# (role.users.add, group.users.add) carry the user ids in pk_set.
+@receiver(m2m_changed, sender=User.roles.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        instance.__dict__.pop('permission_codes', None)
+        cache_service.invalidate_user_permissions([instance.pk])
+    elif pk_set is not None:
+        cache_service.invalidate_user_permissions(pk_set)
+    else:
+        # Reverse clear does not report which users were affected.
+        cache_service.bump_rbac_version()
+
+
+# The stateless JWT authentication reads is_active and the admin flags from
+# a cache: drop it whenever the user row changes (e.g. soft delete).
+@receiver(post_save, sender=User)
+def invalidate_user_state(sender, instance, **kwargs):
+    user_service.invalidate_user_state(instance.pk)
+
+
+# Buffer successful logins for the batched audit writer (LoginEvent rows and
+# last_login). Runs on the post-login background thread.
+@receiver(login_service.login_succeeded)
+def audit_login(sender, user_id, event, **kwargs):
+    audit_service.record_login(event)
+
+
+# Keep users.UserEffectivePermission in sync with the user's roles and groups.
+# Forward changes carry the user as instance; reverse changes carry user ids
+# in pk_set, except reverse clears, whose members are captured on pre_clear.
+# New assignments only add rows; removals recompute the affected users.
+@receiver(m2m_changed, sender=User.roles.through)
+def sync_effective_permissions_on_user_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # instance is the User, pk_set holds role ids
+        if action == "post_add":
+            effective_permission_service.grant_roles([instance.pk], pk_set)
+        elif action in ("post_remove", "post_clear"):
+            effective_permission_service.schedule_sync([instance.pk])
+        return
+    # instance is the Role, pk_set holds user ids
+    if action == "pre_clear":
+        instance._cleared_user_ids = list(instance.users.values_list('id', flat=True))
+    elif action == "post_add":
+        effective_permission_service.grant_roles(pk_set, [instance.pk])
+    elif action == "post_remove":
+        effective_permission_service.schedule_sync(pk_set)
+    elif action == "post_clear":
+        effective_permission_service.schedule_sync(getattr(instance, '_cleared_user_ids', []))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def sync_effective_permissions_on_user_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # instance is the User, pk_set holds group ids
+        if action == "post_add":
+            role_ids = effective_permission_service.get_group_role_ids(pk_set)
+            effective_permission_service.grant_roles([instance.pk], role_ids)
+        elif action in ("post_remove", "post_clear"):
+            effective_permission_service.schedule_sync([instance.pk])
+        return
+    # instance is the Group, pk_set holds user ids
+    if action == "pre_clear":
+        instance._cleared_user_ids = list(instance.users.values_list('id', flat=True))
+    elif action == "post_add":
+        role_ids = effective_permission_service.get_group_role_ids([instance.pk])
+        effective_permission_service.grant_roles(pk_set, role_ids)
+    elif action == "post_remove":
+        effective_permission_service.schedule_sync(pk_set)
+    elif action == "post_clear":
+        effective_permission_service.schedule_sync(getattr(instance, '_cleared_user_ids', []))
+
+
+# Keep the cached refresh token blacklist in step with the database,
+# whichever path blacklisted the token (rotation, logout, the admin).
+@receiver(post_save, sender=BlacklistedToken)
+def cache_blacklisted_token(sender, instance, created, **kwargs):
+    if created:
+        token_blacklist_service.add(instance.token.jti, instance.token.expires_at)
@@ -0,0 +1,384 @@
+import base64
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from users.authentication import StatelessUser
+from users.models import LoginEvent, OutboundEmail, PasswordResetOTP, User
+from users.services import (
+    audit_service, email_service, hashing_service, import_service, login_service, otp_service, rate_limit_service,
+    token_blacklist_service, user_service,
+)
+from users.throttling import IPRateThrottle, LoginUsernameThrottle
+from users.tokens import PermissionClaimsRefreshToken
+
+
+class UsersTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='alice', email='alice@example.com', password='x', birthday='2000-01-01'
+        )
+
+
+class StatelessUserTests(UsersTestCase):
+    def get_stateless_user(self):
+        token = PermissionClaimsRefreshToken.for_user(self.user).access_token
+        return StatelessUser(token, user_service.get_user_state(self.user.pk))
+
+    def test_field_writes_are_saved(self):
+        user = self.get_stateless_user()
+        user.email = 'new@example.com'
+        user.is_active = False
+        user.save()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'new@example.com')
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(user.is_active)
+
+    def test_state_is_not_cached_per_process(self):
+        # A deactivation made in another process must be seen at once
+        user_service.get_user_state(self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertFalse(user_service.get_user_state(self.user.pk)['is_active'])
+
+    def test_claims_need_no_query(self):
+        user = self.get_stateless_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(user.username, 'alice')
+            self.assertTrue(user.is_active)
+
+
+class UserImportTests(UsersTestCase):
+    def row(self, username, email):
+        return {
+            'username': username, 'email': email, 'first_name': 'F', 'last_name': 'L',
+            'birthday': '2000-01-01', 'password': 'Import@pass1',
+        }
+
+    def test_failed_rows_do_not_block_later_rows(self):
+        importer = import_service.UserImporter(validate_passwords=False)
+        valid, errors = importer.validate_chunk([(1, self.row('bob', 'bob@example.com'))])
+        self.assertFalse(errors)
+        # Nothing inserted: the same username is still free in the next chunk
+        valid, errors = importer.validate_chunk([(2, self.row('bob', 'other@example.com'))])
+        self.assertFalse(errors)
+
+        report = importer.run([(3, self.row('bob', 'bob@example.com')), (4, self.row('bob', 'b2@example.com'))])
+        self.assertEqual((report['created'], report['failed']), (1, 1))
+        valid, errors = importer.validate_chunk([(5, self.row('bob', 'b3@example.com'))])
+        self.assertEqual(errors[0]['errors'], {'username': ["A user with that username already exists."]})
+
+    def test_reported_errors_are_capped(self):
+        importer = import_service.UserImporter(chunk_size=2, validate_passwords=False)
+        written = []
+        report = importer.run([(line, "Invalid JSON") for line in range(5)], on_errors=written.extend, max_errors=3)
+        self.assertEqual(report['failed'], 5)
+        self.assertEqual([error['line'] for error in report['errors']], [0, 1, 2])
+        self.assertEqual(len(written), 5)
+
+    def test_uploads_are_capped(self):
+        lines = ''.join(f'{{"username": "user{index}"}}\n' for index in range(3))
+        upload = SimpleUploadedFile('users.jsonl', lines.encode())
+        with self.assertRaises(serializers.ValidationError):
+            import_service.read_upload(upload, 'jsonl', max_rows=2)
+        upload = SimpleUploadedFile('users.jsonl', lines.encode())
+        self.assertEqual(len(import_service.read_upload(upload, 'jsonl', max_rows=3)), 3)
+
+
+class PasswordHashingTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        hashing_service.reset_executor()
+        self.addCleanup(hashing_service.reset_executor)
+
+    def test_passwords_are_hashed_on_the_executor(self):
+        self.user.set_password('Secret@pass1')
+        self.assertTrue(self.user.check_password('Secret@pass1'))
+        self.assertFalse(self.user.check_password('wrong'))
+        metrics = hashing_service.get_metrics()
+        self.assertEqual((metrics['executor'], metrics['submitted'], metrics['completed']), ('thread', 3, 3))
+        self.assertEqual(metrics['pending'], 0)
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_outdated_hashes_are_upgraded(self):
+        self.user.password = make_password('Secret@pass1', hasher='md5')
+        self.user.save(update_fields=['password'])
+        self.assertTrue(self.user.check_password('Secret@pass1'))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+    def test_full_queue_is_rejected(self):
+        executor = hashing_service.HashingExecutor('thread', 1, max_pending=1, queue_timeout=0)
+        self.addCleanup(executor.shutdown)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        worker = threading.Thread(target=executor.run, args=(block,))
+        worker.start()
+        started.wait(5)
+        with self.assertLogs(hashing_service.logger, 'WARNING'), self.assertRaises(hashing_service.PasswordHashingBusy):
+            executor.run(make_password, 'Secret@pass1')
+        release.set()
+        worker.join(5)
+
+        metrics = executor.get_metrics()
+        self.assertEqual((metrics['submitted'], metrics['rejected'], metrics['peak_pending']), (1, 1, 1))
+        # A slot is free again
+        self.assertTrue(executor.run(str.isdigit, '1'))
+
+    def test_inline_executor_and_unknown_kind(self):
+        self.assertEqual(hashing_service.HashingExecutor('inline', 1, 1, 0).run(str.upper, 'a'), 'A')
+        with self.assertRaises(ValueError):
+            hashing_service.HashingExecutor('fork', 1, 1, 0)
+        self.assertEqual(hashing_service.verify_password(None, self.user.password), (False, False))
+
+
+class LoginAuditTests(UsersTestCase):
+    def event(self, timestamp=None):
+        return {'user_id': self.user.pk, 'timestamp': timestamp or timezone.now(), 'ip': '10.0.0.1', 'user_agent': ''}
+
+    def test_batches_are_written(self):
+        writer = audit_service.LoginAuditWriter(batch_size=2, flush_interval=60, max_buffer=100)
+        writer.buffer.extend([self.event(), self.event(), self.event()])
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(LoginEvent.objects.filter(user=self.user).count(), 3)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(writer.get_metrics()['flushes'], 2)
+
+    def test_failing_batch_is_discarded_after_max_retries(self):
+        writer = audit_service.LoginAuditWriter(batch_size=2, flush_interval=60, max_buffer=100, max_retries=2)
+        writer.buffer.extend([self.event('not a date'), self.event(), self.event()])
+        with self.assertLogs(audit_service.logger, 'ERROR'):
+            self.assertEqual(writer.flush(), 0)
+        self.assertEqual(len(writer.buffer), 3)
+        # Second failure: the batch is dropped and the events behind it are written
+        with self.assertLogs(audit_service.logger, 'ERROR'):
+            self.assertEqual(writer.flush(), 1)
+        metrics = writer.get_metrics()
+        self.assertEqual((metrics['buffered'], metrics['failures'], metrics['discarded']), (0, 2, 2))
+        self.assertEqual(LoginEvent.objects.filter(user=self.user).count(), 1)
+
+
+class ClientIPTests(TestCase):
+    def get_ip(self, **settings):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='6.6.6.6, 10.0.0.2', REMOTE_ADDR='10.0.0.1')
+        with override_settings(REST_FRAMEWORK=settings):
+            return login_service.get_client_ip(request)
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        self.assertEqual(self.get_ip(), '10.0.0.1')
+        self.assertEqual(self.get_ip(NUM_PROXIES=0), '10.0.0.1')
+
+    def test_forwarded_for_behind_trusted_proxies(self):
+        self.assertEqual(self.get_ip(NUM_PROXIES=1), '10.0.0.2')
+        self.assertEqual(self.get_ip(NUM_PROXIES=2), '6.6.6.6')
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def hit(self, at, limit=2):
+        with mock.patch.object(rate_limit_service.time, 'time', return_value=60000 + at):
+            return rate_limit_service.hit('test', 'client', limit, 60)
+
+    def test_retry_after_is_honoured(self):
+        self.assertEqual([self.hit(0), self.hit(1)], [(True, 0), (True, 0)])
+        # Two hits weigh 2 * (60 - s) / 60 in the next window: room for one more after s = 30
+        self.assertEqual(self.hit(2), (False, 88))
+        for at in range(3, 60, 5):
+            self.assertFalse(self.hit(at)[0])
+        self.assertEqual(self.hit(89), (False, 1))
+        self.assertEqual(self.hit(90), (True, 0))
+
+    def test_retry_after_within_the_window(self):
+        for at in range(3):
+            self.hit(at, limit=3)
+        # Three hits in the previous window weigh 3 * (60 - s) / 60: room for one more after s = 20
+        self.assertEqual(self.hit(60, limit=3), (False, 20))
+        self.assertFalse(self.hit(79, limit=3)[0])
+        self.assertEqual(self.hit(80, limit=3), (True, 0))
+
+
+class ThrottleKeyTests(TestCase):
+    def request(self, forwarded_for, remote_addr='10.0.0.1'):
+        request = RequestFactory().post('/', HTTP_X_FORWARDED_FOR=forwarded_for, REMOTE_ADDR=remote_addr)
+        request.data = {'username': 'alice'}
+        return request
+
+    def test_forwarded_for_does_not_change_the_ip_key(self):
+        throttle = IPRateThrottle()
+        self.assertEqual(
+            throttle.get_cache_key(self.request('1.1.1.1'), None),
+            throttle.get_cache_key(self.request('2.2.2.2'), None),
+        )
+
+    def test_login_username_key_includes_the_ip(self):
+        throttle = LoginUsernameThrottle()
+        self.assertNotEqual(
+            throttle.get_cache_key(self.request('', '10.0.0.1'), None),
+            throttle.get_cache_key(self.request('', '10.0.0.2'), None),
+        )
+
+
+class PasswordResetOTPTests(UsersTestCase):
+    password = 'New@pass123'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def request_otp(self, code='123456'):
+        with mock.patch.object(otp_service, 'generate_otp', return_value=code):
+            otp_service.request_password_reset_otp(self.user)
+
+    def reset(self, code):
+        return otp_service.reset_password_with_otp(self.user, code, self.password)
+
+    def test_code_is_used_once(self):
+        self.request_otp()
+        self.reset('123456')
+        self.assertTrue(self.user.check_password(self.password))
+        with self.assertRaises(ValidationError):
+            self.reset('123456')
+
+    def test_guesses_are_capped(self):
+        self.request_otp()
+        for _ in range(PasswordResetOTP.MAX_ATTEMPTS):
+            with self.assertRaises(ValidationError):
+                self.reset('000000')
+        with self.assertRaises(ValidationError):
+            self.reset('123456')
+        self.assertFalse(self.user.check_password(self.password))
+
+    def test_concurrent_guesses_are_capped(self):
+        # Guesses that all read the code before any attempt was counted
+        self.request_otp()
+        stale = PasswordResetOTP.objects.get(user=self.user)
+        PasswordResetOTP.objects.update(failed_attempts=PasswordResetOTP.MAX_ATTEMPTS)
+        with mock.patch.object(otp_service, '_get_active_otp', return_value=stale):
+            for code in ('000000', '123456'):
+                with self.assertRaises(ValidationError):
+                    self.reset(code)
+        otp = PasswordResetOTP.objects.get(pk=stale.pk)
+        self.assertEqual((otp.failed_attempts, otp.is_used), (PasswordResetOTP.MAX_ATTEMPTS, False))
+
+    def test_concurrent_requests_get_one_code(self):
+        # Requests that all passed the cooldown check before any code was created
+        for store in ('db', 'cache'):
+            with self.subTest(store=store), self.settings(OTP_STORE=store):
+                cache.clear()
+                PasswordResetOTP.objects.all().delete()
+                with mock.patch.object(otp_service, 'get_cooldown_remaining', return_value=0):
+                    self.request_otp()
+                    with self.assertRaises(ValidationError):
+                        self.request_otp()
+                self.assertLessEqual(PasswordResetOTP.objects.count(), 1)
+                self.assertEqual(len(mail.outbox) + OutboundEmail.objects.count(), 1)
+                mail.outbox.clear()
+                OutboundEmail.objects.all().delete()
+
+    def test_cooldown_outlives_the_code(self):
+        for store in ('db', 'cache'):
+            with self.subTest(store=store), self.settings(OTP_STORE=store):
+                cache.clear()
+                PasswordResetOTP.objects.all().delete()
+                self.request_otp()
+                self.reset('123456')
+                self.assertGreater(otp_service.get_cooldown_remaining(self.user), 0)
+                with self.assertRaises(ValidationError):
+                    self.request_otp()
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OTPEmailTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        with mock.patch.object(otp_service, 'generate_otp', return_value='123456'):
+            otp_service.request_password_reset_otp(self.user)
+        self.email = OutboundEmail.objects.get()
+
+    def test_code_is_only_rendered_at_send_time(self):
+        self.assertNotIn('123456', str(self.email.context) + self.email.secret)
+        # The worker runs in another process, with its own cache
+        cache.clear()
+        self.assertEqual(email_service.process_queue(), (1, 0))
+        self.assertIn('123456', mail.outbox[0].body)
+        self.assertEqual(OutboundEmail.objects.get().secret, '')
+
+    def test_sealed_secret_is_authenticated(self):
+        self.assertEqual(email_service.unseal(self.email.secret), {'otp': '123456'})
+        tampered = bytearray(base64.urlsafe_b64decode(self.email.secret))
+        tampered[email_service.NONCE_BYTES] ^= 1
+        for sealed in (base64.urlsafe_b64encode(bytes(tampered)).decode(), 'short'):
+            with self.assertRaises(email_service.InvalidSeal):
+                email_service.unseal(sealed)
+        with self.settings(SECRET_KEY='rotated-secret-key-rotated-secret-key-0123'):
+            with self.assertRaises(email_service.InvalidSeal):
+                email_service.unseal(self.email.secret)
+        with self.settings(SECRET_KEY='rotated-secret-key-rotated-secret-key-0123',
+                           SECRET_KEY_FALLBACKS=[settings.SECRET_KEY]):
+            self.assertEqual(email_service.unseal(self.email.secret), {'otp': '123456'})
+
+    def test_expired_codes_are_not_sent(self):
+        OutboundEmail.objects.update(expires_at=timezone.now())
+        with self.assertLogs(email_service.logger, 'WARNING'):
+            self.assertEqual(email_service.process_queue(), (0, 0))
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.Status.EXPIRED)
+        self.assertFalse(mail.outbox)
+
+    def test_no_retry_past_expiry(self):
+        with mock.patch.object(email_service, 'get_retry_delay', return_value=timedelta(minutes=10)):
+            with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError):
+                with self.assertLogs(email_service.logger, 'WARNING'):
+                    self.assertEqual(email_service.process_queue(), (0, 1))
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.Status.EXPIRED)
+
+
+@override_settings(TOKEN_BLACKLIST_CACHE={'ENABLED': True})
+class BlacklistCacheTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.token = PermissionClaimsRefreshToken.for_user(self.user)
+        self.jti = self.token['jti']
+
+    def blacklist(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=self.jti))
+
+    def test_blacklisted_tokens_are_cached(self):
+        token_blacklist_service.rebuild()
+        self.blacklist()
+        with self.assertNumQueries(0):
+            self.assertTrue(token_blacklist_service.is_blacklisted(self.jti))
+            self.assertFalse(token_blacklist_service.is_blacklisted('other'))
+
+    def test_database_until_rebuilt(self):
+        self.blacklist()
+        cache.delete(token_blacklist_service.BLACKLISTED_KEY.format(jti=self.jti))
+        with self.assertNumQueries(1):
+            self.assertTrue(token_blacklist_service.is_blacklisted(self.jti))
+        with self.assertNumQueries(1):
+            self.assertFalse(token_blacklist_service.is_blacklisted('other'))
+        # Requests do not rebuild the cache themselves
+        self.assertIsNone(cache.get(token_blacklist_service.COMPLETE_KEY))
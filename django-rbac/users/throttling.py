@@ -0,0 +1,91 @@
+"""
+DRF throttles backed by users.services.rate_limit_service.
+
+Throttles run in APIView.initial(), before the serializer: rejected logins
+and resets never reach password hashing. Each class limits one scope of
+RATE_LIMITS ('<limit>/<period>') by one identifier of the request.
+"""
+from rest_framework.throttling import BaseThrottle
+
+from .services import rate_limit_service
+from .services.login_service import get_client_ip
+
+
+class CacheRateThrottle(BaseThrottle):
+    scope = None
+
+    def get_cache_key(self, request, view):
+        """Identifier of the client in this scope, None to skip the check."""
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        rate = rate_limit_service.get_rate(self.scope)
+        if rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        allowed, self.retry_after = rate_limit_service.hit(self.scope, key, *rate)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPRateThrottle(CacheRateThrottle):
+    # X-Forwarded-For is only trusted behind REST_FRAMEWORK['NUM_PROXIES'] proxies
+    def get_cache_key(self, request, view):
+        return rate_limit_service.make_key(get_client_ip(request))
+
+
+class RequestFieldRateThrottle(CacheRateThrottle):
+    """Keys on a field of the request body (e.g. the email of an OTP request)."""
+    field = None
+
+    def get_cache_key(self, request, view):
+        value = request.data.get(self.field) if hasattr(request.data, 'get') else None
+        if not value or not isinstance(value, str):
+            return None
+        return rate_limit_service.make_key(value)
+
+
+class UserIdRateThrottle(CacheRateThrottle):
+    def get_cache_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return str(request.user.pk)
+
+
+# --- Scopes used by the views ---
+class LoginIPThrottle(IPRateThrottle):
+    scope = 'login_ip'
+
+class LoginUsernameThrottle(RequestFieldRateThrottle):
+    # Per username and IP: guesses from elsewhere cannot lock the owner out
+    scope = 'login_username'
+    field = 'username'
+
+    def get_cache_key(self, request, view):
+        key = super().get_cache_key(request, view)
+        return key and rate_limit_service.make_key(f"{key}:{get_client_ip(request)}")
+
+class OTPRequestIPThrottle(IPRateThrottle):
+    scope = 'otp_ip'
+
+class OTPRequestEmailThrottle(RequestFieldRateThrottle):
+    scope = 'otp_email'
+    field = 'email'
+
+class PasswordResetIPThrottle(IPRateThrottle):
+    scope = 'reset_ip'
+
+class PasswordResetEmailThrottle(RequestFieldRateThrottle):
+    scope = 'reset_email'
+    field = 'email'
+
+class RegisterIPThrottle(IPRateThrottle):
+    scope = 'register_ip'
+
+class RegisterUserThrottle(UserIdRateThrottle):
+    scope = 'register_user'
@@ -0,0 +1,58 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from rbac.services import claims_service
+from users.services import token_blacklist_service
+
+
+class PermissionClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token whose access tokens carry the user's permission claims
+    when RBAC_JWT_PERMISSION_CLAIMS is enabled. The claims are resolved each
+    time an access token is issued (login and refresh), never copied over
+    from the refresh token itself. The blacklist is checked through
+    token_blacklist_service, from the cache when TOKEN_BLACKLIST_CACHE is enabled,
+    and rotation does not load the user to blacklist or outstand a token.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        # Read by StatelessUser, so the username needs no database lookup
+        token['username'] = user.get_username()
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        if claims_service.is_enabled():
+            claims_service.add_permission_claims(access, self.payload[api_settings.USER_ID_CLAIM])
+        return access
+
+    def check_blacklist(self):
+        if token_blacklist_service.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        # The token being blacklisted is nearly always outstanding already
+        try:
+            token = OutstandingToken.objects.get(jti=self.payload[api_settings.JTI_CLAIM])
+        except OutstandingToken.DoesNotExist:
+            return super().blacklist()
+        return BlacklistedToken.objects.get_or_create(token=token)
+
+    def outstand(self):
+        # Only called on rotation, once TokenRefreshSerializer has loaded the user
+        return OutstandingToken.objects.get_or_create(
+            jti=self.payload[api_settings.JTI_CLAIM],
+            defaults={
+                'user_id': self.payload.get(api_settings.USER_ID_CLAIM),
+                'created_at': self.current_time,
+                'token': str(self),
+                'expires_at': datetime_from_epoch(self.payload['exp']),
+            },
+        )
@@ -1,33 +1,29 @@
 import re
 import logging
-import random
-from django.core.mail import send_mail
-from django.conf import settings
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+import secrets
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext as _
+from users.models import PasswordResetOTP
+from users.services import email_service
 
 def generate_otp():
-    return f"{random.randint(100000, 999999)}"
+    return f"{100000 + secrets.randbelow(900000)}"
 
 logger = logging.getLogger(__name__)
 def send_otp_email(email: str, otp: str):
     """
-    Sends the OTP to the user's email address using an HTML template.
+    Queues the OTP email (HTML template) for the send_queued_emails worker,
+    so that the request does not wait on SMTP. The code is only stored sealed,
+    and the email is dropped once the code has expired.
     """
-    subject = 'Your One-Time Password (OTP) for Password Reset'
-    context = {'otp': otp}
-    html_message = render_to_string('emails/otp_email.html', context)
-    plain_message = strip_tags(html_message)
-    email_from = settings.EMAIL_HOST_USER
-    recipient_list = [email]
-    
-    try:
-        send_mail(subject, plain_message, email_from, recipient_list, html_message=html_message, fail_silently=False)
-        logger.info(f"Successfully sent OTP to {email}")
-    except Exception as e:
-        logger.error(f"Error sending OTP to {email}: {e}")
+    email_service.enqueue_email(
+        to=email,
+        subject='Your One-Time Password (OTP) for Password Reset',
+        template='emails/otp_email.html',
+        secret_context={'otp': otp},
+        expires_in=PasswordResetOTP.EXPIRATION_MINUTES * 60,
+    )
+    logger.info(f"Queued OTP email to {email}")
 
 
 class RegexPasswordValidator:
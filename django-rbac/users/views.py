@@ -1,18 +1,25 @@
 from django.shortcuts import get_object_or_404
 from rest_framework.exceptions import ValidationError
-from datetime import timedelta
-from django.utils import timezone
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rbac.services.permission_service import AutoPermissionMixin
-from .models import User, PasswordResetOTP
+from rbac.views import BaseHistoryListView, ROLE_SNAPSHOT_PARAMETERS
+from .models import User, LoginEvent
 from .serializers import *
 from rest_framework import status
 from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter
 from rest_framework_simplejwt.views import TokenObtainPairView as SimpleJWTTokenObtainPairView
-from .utils import generate_otp, send_otp_email
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework.parsers import MultiPartParser
+from drf_spectacular.types import OpenApiTypes
+from .services import user_service, import_service, hashing_service, login_service, otp_service, rate_limit_service
+from .throttling import (
+    LoginIPThrottle, LoginUsernameThrottle, OTPRequestIPThrottle, OTPRequestEmailThrottle,
+    PasswordResetIPThrottle, PasswordResetEmailThrottle, RegisterIPThrottle, RegisterUserThrottle,
+)
 
-# Custom TokenObtainPairView to log user login
+# Custom TokenObtainPairView: authenticates once, then hands the login over
+# to the post-login hooks (users.services.login_service), run off the request path
 @extend_schema(tags=["Users"])
 class TokenObtainPairView(SimpleJWTTokenObtainPairView):
     """
@@ -20,21 +27,68 @@ class TokenObtainPairView(SimpleJWTTokenObtainPairView):
     token pair to prove the authentication of those credentials.
     """
     permission_classes = [permissions.AllowAny]
+    # Checked before the serializer, so rejected attempts cost no password hash
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
+
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-        
-        if response.status_code == 200:
-            # The user object is attached to the serializer after successful validation
-            serializer = self.get_serializer(data=request.data)
+        serializer = self.get_serializer(data=request.data)
+        try:
             serializer.is_valid(raise_exception=True)
-            
-        return response
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        # The serializer keeps the authenticated user, no second check needed
+        login_service.dispatch_login(request, serializer.user)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 # Register a new user
 @extend_schema(tags=["Users"])
 class RegisterView(AutoPermissionMixin, generics.CreateAPIView):
     serializer_class = RegisterSerializer
     resource = "user"
+    throttle_classes = [RegisterIPThrottle, RegisterUserThrottle]
+
+# Import users in bulk from an uploaded CSV or JSONL file
+@extend_schema(tags=["Users"])
+class UserImportView(AutoPermissionMixin, generics.GenericAPIView):
+    serializer_class = UserImportSerializer
+    parser_classes = [MultiPartParser]
+    resource = "user"
+    permission_code_map = {'POST': 'import'}
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # Small files only: passwords are hashed in this thread, no process pool
+        rows = import_service.read_upload(data['file'], data['format'])
+        with import_service.UserImporter(
+            validate_passwords=data['validate_passwords'],
+            history_user=getattr(request.user, 'db_user', request.user),
+        ) as importer:
+            report = importer.run(rows)
+
+        response_status = status.HTTP_201_CREATED if report['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(report, status=response_status)
+
+# Queue depth and timings of the password hashing executor (this process only)
+@extend_schema(tags=["Users"], responses=OpenApiTypes.OBJECT)
+class PasswordHashingMetricsView(AutoPermissionMixin, generics.GenericAPIView):
+    resource = "user"
+    permission_code_map = {'GET': 'view_metrics'}
+
+    def get(self, request, *args, **kwargs):
+        return Response(hashing_service.get_metrics(), status=status.HTTP_200_OK)
+
+# Allowed/rejected counters of each rate limit scope (shared through the cache)
+@extend_schema(tags=["Users"], responses=OpenApiTypes.OBJECT)
+class RateLimitMetricsView(AutoPermissionMixin, generics.GenericAPIView):
+    resource = "user"
+    permission_code_map = {'GET': 'view_metrics'}
+
+    def get(self, request, *args, **kwargs):
+        return Response(rate_limit_service.get_counters(), status=status.HTTP_200_OK)
 
 # This view allows users to retrieve their own details
 @extend_schema(tags=["Users"])
@@ -43,7 +97,8 @@ class UserDetailView(generics.RetrieveAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # The User row, not the StatelessUser proxy of StatelessJWTAuthentication
+        return getattr(self.request.user, 'db_user', self.request.user)
 
 # This view allows admins to list all active users
 @extend_schema(
@@ -85,8 +140,7 @@ class UserRetrieveUpdateDestroyView(AutoPermissionMixin, generics.RetrieveUpdate
     # Instead of deleting the user, we deactivate them
     def destroy(self, request, *args, **kwargs):
         user = self.get_object()
-        user.is_active = False
-        user.save()
+        user_service.deactivate_user(user)
         return Response({'detail': 'User has been deactivated (soft delete).'}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -105,26 +159,53 @@ class LogoutView(AutoPermissionMixin, generics.GenericAPIView):
 
 
 # ----- Historical Read -----
-@extend_schema(tags=["Users"])
-class UserHistoryListView(AutoPermissionMixin, generics.ListAPIView):
+@extend_schema(parameters=ROLE_SNAPSHOT_PARAMETERS, tags=["Users"])
+class UserHistoryListView(AutoPermissionMixin, BaseHistoryListView):
     # Retrieves the change history for a specific user.
     serializer_class = HistoricalUserSerializer
+    model = User
     resource = "user_history"
+    snapshot_filters = {'role': 'roles'}
 
-    def get_queryset(self):
-        user_pk = self.kwargs['pk']
-        return User.history.filter(id=user_pk).order_by('-history_date')
-
-@extend_schema_view(get=extend_schema(operation_id="all_user_history", tags=["Users"]))
-class AllUserHistoryListView(AutoPermissionMixin, generics.ListAPIView):
+@extend_schema_view(get=extend_schema(operation_id="all_user_history", parameters=ROLE_SNAPSHOT_PARAMETERS, tags=["Users"]))
+class AllUserHistoryListView(AutoPermissionMixin, BaseHistoryListView):
     """
     Retrieves the complete change history for all users, ordered by most recent first.
     This provides a full audit trail for the system.
     """
     serializer_class = HistoricalUserSerializer
+    get_all = True
+    model = User
     resource = "user_history"
-    queryset = User.history.all().order_by('-history_date')
+    snapshot_filters = {'role': 'roles'}
+
+
+
+# Login audit log, written in batches by users.services.audit_service
+@extend_schema(
+    parameters=[
+        OpenApiParameter(
+            name='user',
+            type=int,
+            location=OpenApiParameter.QUERY,
+            description='Only show the logins of this user id'
+        ),
+    ],
+    tags=["Users"]
+)
+class LoginEventListView(AutoPermissionMixin, generics.ListAPIView):
+    serializer_class = LoginEventSerializer
+    resource = "user"
+    permission_code_map = {'GET': 'audit_log'}
 
+    def get_queryset(self):
+        queryset = LoginEvent.objects.select_related('user').order_by('-timestamp')
+        user_id = self.request.query_params.get('user')
+        if user_id is not None:
+            if not user_id.isdigit():
+                raise ValidationError({"user": "Must be a user id."})
+            queryset = queryset.filter(user_id=user_id)
+        return queryset
 
 
 # ----- Password management -----
@@ -139,7 +220,7 @@ class ChangeOwnPasswordView(AutoPermissionMixin, generics.GenericAPIView):
     def put(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save(instance=request.user)
+        serializer.save(instance=getattr(request.user, 'db_user', request.user))
         
         return Response({"detail": "Password changed successfully."}, status=status.HTTP_200_OK)
 
@@ -162,52 +243,32 @@ class AdminChangePasswordView(AutoPermissionMixin, generics.GenericAPIView):
         serializer.save(instance=user)
         return Response({"detail": "Password changed successfully."}, status=status.HTTP_200_OK)
 
-# Reset Password OTP management
+# Reset Password OTP management (cooldown, hashing and consumption live in otp_service)
 @extend_schema(tags=["Users"])
 class RequestOTPView(generics.CreateAPIView):
     serializer_class = RequestOTPSerializer
     permission_classes = [permissions.AllowAny]
-    cooldown_seconds = 120  #
-    # Check if the user is on cooldown
-    def _can_request_new_otp(self, user):
-        last_otp = PasswordResetOTP.objects.filter(user=user).order_by('-created_at').first()
-        if not last_otp:
-            return True, 0  # No previous OTP, can request
-
-        next_allowed_time = last_otp.created_at + timedelta(seconds=self.cooldown_seconds)
-        if timezone.now() < next_allowed_time:
-            remaining = int((next_allowed_time - timezone.now()).total_seconds())
-            return False, remaining
-        return True, 0
-    
+    throttle_classes = [OTPRequestIPThrottle, OTPRequestEmailThrottle]
+
     def perform_create(self, serializer):
         user = serializer.context['user']
-        can_request, remaining = self._can_request_new_otp(user)
-        if not can_request:
-            raise ValidationError(
-                {"detail": f"Please wait {remaining} seconds before requesting a new OTP."}
-            )
-        code = generate_otp()
-        PasswordResetOTP.objects.create(user=user, code=code)
-        send_otp_email(user.email, code)
+        otp_service.request_password_reset_otp(user)
 
 @extend_schema(tags=["Users"])
 class ResetPasswordView(generics.CreateAPIView):
     serializer_class = ResetPasswordSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [PasswordResetIPThrottle, PasswordResetEmailThrottle]
 
     def perform_create(self, serializer):
-        user = serializer.context['user']
-        otp_obj = serializer.context['otp_obj']
-        new_password = serializer.validated_data['new_password']
-
-        user.set_password(new_password)
-        user.save()
-        otp_obj.is_used = True
-        otp_obj.save()
+        otp_service.reset_password_with_otp(
+            user=serializer.context['user'],
+            otp_code=serializer.validated_data['otp'],
+            new_password=serializer.validated_data['new_password'],
+        )
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
-        return Response({"detail": "✔️ Password reset successfully."}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({"detail": "✔️ Password reset successfully."}, status=status.HTTP_200_OK)